@@ -0,0 +1,302 @@
+from .Student import StudentState
+from .Teacher import TeacherState
+import numpy as np
+import copy
+
+
+class Assignment:
+    def __init__(self, difficulty: float, student_idx: float):
+        assert 0 <= difficulty <= 1, "difficulty must be in [0, 1]"
+        self.difficulty = difficulty
+        self.student_idx = student_idx
+
+        self.submitted = False
+        self.time_submitted = None
+        self.time_graded = None
+
+    def submit(self, s: StudentState):
+        """
+        Calculates the quality of the assignment based on the student's g values
+        and the time they worked on the assignment.
+        """
+        g = s.g
+        time_worked = s.time_worked
+
+        # also making quality = value between 0 - 100
+        quality = sum(g) / len(g) + time_worked / 20
+        quality *= 100
+        self.quality = max(0, min(100, quality))
+
+        self.submitted = True
+
+    def grade(self, t: TeacherState):
+        """
+        Calculates the grade of the assignment based on the teacher's mh value
+        and the assignment's difficulty.
+
+        """
+        assert self.submitted, "assignment must be submitted before grading"
+        mh = t.mh  # between -1 and 1
+        difficulty = self.difficulty  # between 0 and 1
+
+        grade = self.quality
+        grade += 15 * (mh + 1)  # so that mh > 0
+        grade -= 15 * difficulty
+        return max(0, min(100, grade))
+
+
+class AssignmentStore:
+    """
+    Array-backed storage for the assignments of a classroom. Every assignment
+    is a row, with its fields stored in the columns student_idx, difficulty,
+    quality, time_submitted and time_graded (nan until they happen).
+
+    Assignments are handed out to every student at once, so they're issued in
+    blocks of n_students rows: row b * n_students + i is student i's copy of
+    the b-th assignment. Students submit their oldest outstanding assignment
+    first, which means a student's pending assignments are always the blocks
+    [n_submitted[i], n_blocks).
+
+    Submitted assignments go into a FIFO grading queue of row ids; queue[:head]
+    are the graded ones and queue[head:tail] are waiting to be graded.
+
+    With n_classrooms, the store holds the assignments of that many
+    classrooms (as ClassroomBatch does): every array gets a leading
+    classroom dimension, head, tail and n_submitted become arrays, and the
+    ids of assignments are (classroom, row) tuples of index arrays, so that
+    store.quality[ids] and the like still work.
+
+    A store can be forked without copying anything: the fork shares every
+    array with its parent, and each side copies an array the first time it
+    writes to it (so only the arrays that a branch actually changes are
+    copied).
+    """
+    COLUMNS = ("student_idx", "difficulty", "quality", "time_submitted", "time_graded")
+    ARRAYS = COLUMNS + ("queue", "n_submitted")
+
+    def __init__(self, n_students: int, n_classrooms: int = None):
+        self.n_students = n_students
+        self.n_classrooms = n_classrooms
+        self.shape = () if n_classrooms is None else (n_classrooms,)
+        self.n_blocks = 0
+        self.n_submitted = np.zeros(self.shape + (n_students,), dtype=int)
+
+        # the columns, which grow by doubling
+        self.student_idx = np.zeros(self.shape + (0,), dtype=int)
+        self.difficulty = np.zeros(self.shape + (0,))
+        self.quality = np.zeros(self.shape + (0,))
+        self.time_submitted = np.zeros(self.shape + (0,))
+        self.time_graded = np.zeros(self.shape + (0,))
+
+        # the grading queue
+        self.queue = np.zeros(self.shape + (0,), dtype=int)
+        self.head = np.zeros(self.shape, dtype=int)
+        self.tail = np.zeros(self.shape, dtype=int)
+
+        # running total of (time_graded - time_submitted) over graded ones
+        self.total_grading_gap = np.zeros(self.shape)
+
+        # the arrays that are shared with a fork and must be copied on write
+        self._shared = set()
+
+    def __len__(self):
+        return self.n_blocks * self.n_students
+
+    def _out(self, x: np.ndarray):
+        # a single classroom's counts are plain numbers
+        return x.item() if self.n_classrooms is None else x
+
+    @property
+    def n_pending(self) -> np.ndarray:
+        """
+        The number of assignments each student hasn't submitted yet.
+        """
+        return self.n_blocks - self.n_submitted
+
+    @property
+    def n_ungraded(self):
+        return self._out(self.tail - self.head)
+
+    @property
+    def n_graded(self):
+        return self._out(self.head)
+
+    @property
+    def ungraded(self) -> np.ndarray:
+        """
+        The ids of the ungraded assignments, in the order they'll be graded
+        (for a single classroom).
+        """
+        return self.queue[self.head:self.tail]
+
+    @property
+    def graded(self) -> np.ndarray:
+        """
+        The ids of the graded assignments, in the order they were graded (for
+        a single classroom).
+        """
+        return self.queue[:self.head]
+
+    def _writable(self, name: str) -> np.ndarray:
+        """
+        Returns the array called name, copying it first if it's shared with a
+        fork.
+        """
+        if name in self._shared:
+            setattr(self, name, getattr(self, name).copy())
+            self._shared.discard(name)
+        return getattr(self, name)
+
+    def _grow(self, name: str, size: int, fill=0) -> np.ndarray:
+        """
+        Makes sure that the array called name has room for size entries
+        (per classroom), doubling it when it runs out, and returns it
+        (writable).
+        """
+        arr = getattr(self, name)
+        n = arr.shape[-1]
+        if size <= n:
+            return self._writable(name)
+
+        out = np.full(self.shape + (max(size, 2 * n, 16),), fill, dtype=arr.dtype)
+        out[..., :n] = arr
+        setattr(self, name, out)
+        self._shared.discard(name)
+        return out
+
+    def _ids(self, classroom_idx, rows):
+        return rows if self.n_classrooms is None else (classroom_idx, rows)
+
+    def fork(self) -> "AssignmentStore":
+        """
+        Returns a copy of the store that can be changed independently of this
+        one. O(1): the arrays are only copied when one of the two writes to
+        them.
+        """
+        out = copy.copy(self)
+        self._shared = set(self.ARRAYS)
+        out._shared = set(self.ARRAYS)
+        return out
+
+    def issue(self, difficulty):
+        """
+        Hands out a new assignment with the given difficulty to every student
+        (with one difficulty per classroom, if there are several).
+        """
+        difficulty = np.asarray(difficulty, dtype=float)
+        assert np.all((0 <= difficulty) & (difficulty <= 1)), "difficulty must be in [0, 1]"
+        start = len(self)
+        end = start + self.n_students
+
+        for name in self.COLUMNS:
+            fill = 0 if name == "student_idx" else np.nan
+            self._grow(name, end, fill)
+
+        self.student_idx[..., start:end] = np.arange(self.n_students)
+        self.difficulty[..., start:end] = difficulty[..., None]
+        self.n_blocks += 1
+
+    def submit(self, student_idx, g, time_worked, t=None, classroom_idx=None):
+        """
+        Submits the oldest pending assignment of each student in student_idx
+        and adds them to the back of their classroom's grading queue, in that
+        order. The quality of each assignment is calculated from the student's
+        competencies and the time they worked on it.
+
+        params:
+            student_idx -- the students who submit, with shape (m,)
+            g -- their competencies, with shape (m, n_competencies)
+            time_worked -- the time they worked on the assignment, shape (m,)
+            t -- the day of the submission
+            classroom_idx -- the classroom of each student, with shape (m,),
+                             if the store has several
+
+        returns:
+            ids -- the ids of the submitted assignments
+        """
+        student_idx = np.asarray(student_idx, dtype=int)
+        if self.n_classrooms is None:
+            lead, classroom_idx = (), np.zeros(len(student_idx), dtype=int)
+        else:
+            classroom_idx = np.asarray(classroom_idx, dtype=int)
+            lead = (classroom_idx,)
+        idx = lead + (student_idx,)
+        if np.any(self.n_pending[idx] <= 0):
+            raise ValueError("student has no unsubmitted assignments")
+
+        # also making quality = value between 0 - 100
+        quality = np.mean(g, axis=-1) + np.asarray(time_worked) / 20
+        quality = np.clip(quality * 100, 0, 100)
+
+        rows = self.n_submitted[idx] * self.n_students + student_idx
+        self._writable("quality")[lead + (rows,)] = quality
+        self._writable("time_submitted")[lead + (rows,)] = np.nan if t is None else t
+        self._writable("n_submitted")[idx] += 1
+
+        # add them to the grading queues, after what's already there and in
+        # the order they were given within each classroom
+        counts = np.bincount(classroom_idx, minlength=self.n_classrooms or 1)
+        order = np.argsort(classroom_idx, kind="stable")
+        rank = np.empty(len(rows), dtype=int)
+        rank[order] = np.arange(len(rows)) - np.repeat(np.cumsum(counts) - counts, counts)
+
+        counts = counts.reshape(self.shape)
+        self._grow("queue", np.max(self.tail + counts, initial=0))
+        self.queue[lead + (self.tail[lead] + rank,)] = rows
+        self.tail = self.tail + counts
+
+        return self._ids(classroom_idx, rows)
+
+    def pop_ungraded(self, n, t=None):
+        """
+        Takes (up to) the n oldest assignments off the grading queue (of each
+        classroom, if n is an array), marking them as graded on day t, and
+        returns their ids, classroom by classroom.
+        """
+        n = np.clip(n, 0, self.tail - self.head)
+        if self.n_classrooms is None:
+            lead, classroom_idx = (), np.zeros(n.item(), dtype=int)
+        else:
+            classroom_idx = np.repeat(np.arange(self.n_classrooms), n)
+            lead = (classroom_idx,)
+
+        starts = np.cumsum(n) - n
+        offsets = np.arange(len(classroom_idx)) - np.repeat(starts, n)
+        rows = self.queue[lead + (self.head[lead] + offsets,)]
+
+        if len(rows):
+            self._writable("time_graded")[lead + (rows,)] = np.nan if t is None else t
+            gap = self.time_graded[lead + (rows,)] - self.time_submitted[lead + (rows,)]
+            self.total_grading_gap = self.total_grading_gap + np.bincount(
+                classroom_idx, gap, minlength=self.n_classrooms or 1
+            ).reshape(self.shape)
+        self.head = self.head + n
+        return self._ids(classroom_idx, rows)
+
+    def mean_grading_gap(self):
+        """
+        The average number of days between submitting and grading an
+        assignment, or None (nan, for several classrooms) if nothing has been
+        graded yet.
+        """
+        if self.n_classrooms is None:
+            if not self.head:
+                return None
+            return (self.total_grading_gap / self.head).item()
+
+        with np.errstate(invalid="ignore", divide="ignore"):
+            return np.where(self.head > 0, self.total_grading_gap / self.head, np.nan)
+
+    def assignment(self, i) -> Assignment:
+        """
+        Materializes assignment i (a row, or a (classroom, row) tuple) as an
+        Assignment object, for inspection.
+        """
+        out = Assignment(self.difficulty[i].item(), self.student_idx[i].item())
+        out.submitted = not np.isnan(self.time_submitted[i])
+        if out.submitted:
+            out.quality = self.quality[i].item()
+            out.time_submitted = self.time_submitted[i].item()
+        if not np.isnan(self.time_graded[i]):
+            out.time_graded = self.time_graded[i].item()
+        return out
@@ -1,49 +1,14 @@
-from .Student import Student, StudentState, StudentObservation, StudentAction
+from .Student import (
+    Student, StudentState, StudentObservation, StudentAction,
+    StudentStateBatch, StudentActionBatch
+)
 from .Teacher import Teacher, TeacherState, TeacherObservation, TeacherAction
-from collections import defaultdict
-from typing import List, Tuple, Dict, Set
-import random
-
-
-class Assignment:
-    def __init__(self, difficulty: float, student_idx: float):
-        assert 0 <= difficulty <= 1, "difficulty must be in [0, 1]"
-        self.difficulty = difficulty
-        self.student_idx = student_idx
-
-        self.submitted = False
-        self.time_submitted = None
-        self.time_graded = None
-
-    def submit(self, s: StudentState):
-        """
-        Calculates the quality of the assignment based on the student's g values
-        and the time they worked on the assignment.
-        """
-        g = s.g
-        time_worked = s.time_worked
-
-        # also making quality = value between 0 - 100
-        quality = sum(g) / len(g) + time_worked / 20
-        quality *= 100
-        self.quality = max(0, min(100, quality))
-
-        self.submitted = True
-
-    def grade(self, t: TeacherState):
-        """
-        Calculates the grade of the assignment based on the teacher's mh value
-        and the assignment's difficulty.
-
-        """
-        assert self.submitted, "assignment must be submitted before grading"
-        mh = t.mh  # between -1 and 1
-        difficulty = self.difficulty  # between 0 and 1
-
-        grade = self.quality
-        grade += 15 * (mh + 1)  # so that mh > 0
-        grade -= 15 * difficulty
-        return max(0, min(100, grade))
+from .POMDP import get_rng
+from .History import History, HistoryView, HistoryColumn
+from .AssignmentStore import AssignmentStore
+from typing import List, Tuple
+import numpy as np
+import copy
 
 
 class Classroom:
@@ -53,81 +18,138 @@ class Classroom:
     states, and the student and teacher policies.
     """
 
-    def __init__(self, n_students, assignment_every=3):
+    def __init__(
+        self, n_students, assignment_every=3, rng: np.random.Generator = None
+    ):
         # create objects to manage the student and teacher logic
         self.s_logic = Student()
         self.t_logic = Teacher()
         self.n_students = n_students
 
-        # create the initial student states
-        tmp = [self._initialize_student() for _ in range(n_students)]
+        # every random draw of the simulation comes from this generator
+        self.rng = get_rng(rng)
+
+        # create the initial student states. the observations and actions are
+        # kept by each student's (append-only) history
+        tmp = self._initialize_students(n_students, self.rng)
         self.student_s = [s for (s, _) in tmp]
-        self.student_o = [[o] for (_, o) in tmp]
-        self.student_a = [[] for _ in range(n_students)]
+        self.student_hist = [History(o) for (_, o) in tmp]
 
-        # ungraded, graded lists of assignments
-        self.unsubmitted: Dict[int, Set[Assignment]] = defaultdict(set)
-        self.ungraded: List[Assignment] = []
-        self.graded: List[Assignment] = []
+        # every assignment, with the grading queue of submitted ones
+        self.assignments = AssignmentStore(n_students)
         self.assignment_every = assignment_every
 
         # create the initial teacher state
-        s, o = self._initialize_teacher()
+        s, o = self._initialize_teacher(self.rng)
         self.teacher_s = s
-        self.teacher_o = [o]
-        self.teacher_a = []
+        self.teacher_hist = History(o)
 
     @property
-    def student_h(self):
+    def student_o(self) -> List[HistoryColumn]:
+        return [h.o for h in self.student_hist]
+
+    @property
+    def student_a(self) -> List[HistoryColumn]:
+        return [h.a for h in self.student_hist]
+
+    @property
+    def teacher_o(self) -> HistoryColumn:
+        return self.teacher_hist.o
+
+    @property
+    def teacher_a(self) -> HistoryColumn:
+        return self.teacher_hist.a
+
+    @property
+    def student_h(self) -> List[HistoryView]:
         """
-        Interleaves observations and actions into a tuple list.
+        Read-only views of each student's history, interleaving observations
+        and actions into a tuple list. O(1) per student.
         """
-        out = []
-        for i in range(self.n_students):
-            sh = list(zip(self.student_o[i], self.student_a[i]))
-            sh.append((self.student_o[i][-1], None))
-            out.append(sh)
-        return out
+        return [h.view() for h in self.student_hist]
 
     @property
-    def teacher_h(self):
+    def teacher_h(self) -> HistoryView:
         """
-        Interleaves observations and actions into a tuple list.
+        A read-only view of the teacher's history, interleaving observations
+        and actions into a tuple list. O(1).
         """
-        out = list(zip(self.teacher_o, self.teacher_a))
-        out.append((self.teacher_o[-1], None))
-        return out
+        return self.teacher_hist.view()
 
-    def _initialize_student(self) -> Tuple[StudentState, StudentObservation]:
+    @property
+    def student_latest_o(self) -> List[StudentObservation]:
         """
-        Creates an initial student.
+        The latest observation of each student, for memoryless policies.
         """
-        initial_mh = random.uniform(-1, 1)
-        initial_prod = random.uniform(0, 1)
-        # adjust number of competencies via range(x)
-        initial_g = [random.uniform(0, 1) for _ in range(8)]
-        initial_free_time = round(random.uniform(0, 7))
-        initial_time_worked = 0  # no time worked initially
+        return [h.latest for h in self.student_hist]
 
-        # create initial student state
-        initial_student_state = StudentState(
-            initial_mh, initial_prod, initial_g, initial_free_time, 0,
-            initial_time_worked, []
-        )
+    @property
+    def teacher_latest_o(self) -> TeacherObservation:
+        """
+        The latest observation of the teacher, for memoryless policies.
+        """
+        return self.teacher_hist.latest
+
+    def fork(self, rng: np.random.Generator = None) -> "Classroom":
+        """
+        Branches the classroom so that the branch can be simulated forward
+        (e.g. to try out a different teacher action) without affecting this
+        one. Nothing is deep copied: the states are shared because the
+        simulation replaces them instead of modifying them, and the histories
+        and assignments are copy-on-write, so the cost is proportional to what
+        the branch changes rather than to the size of the classroom.
+
+        params:
+            rng -- the generator of the branch. By default it's a copy of this
+                   classroom's generator, so that (until the two diverge) the
+                   branch sees the same random draws as this classroom.
+        """
+        out = copy.copy(self)
+        out.student_s = list(self.student_s)
+        out.student_hist = [h.fork() for h in self.student_hist]
+        out.teacher_hist = self.teacher_hist.fork()
+        out.assignments = self.assignments.fork()
+        out.rng = copy.deepcopy(self.rng) if rng is None else rng
+        return out
 
-        # create initial student observation
-        initial_observation = StudentObservation(None, initial_free_time, 0)
+    @staticmethod
+    def _initialize_students(
+        n: int, rng: np.random.Generator = None
+    ) -> List[Tuple[StudentState, StudentObservation]]:
+        """
+        Creates n initial students. Each field is drawn for the whole class
+        at once, in the same order as VectorClassroom._initialize_students.
+        """
+        rng = get_rng(rng)
+        initial_mh = rng.uniform(-1, 1, n).tolist()
+        initial_prod = rng.uniform(0, 1, n).tolist()
+        # adjust number of competencies via the second dimension
+        initial_g = rng.uniform(0, 1, (n, 8)).tolist()
+        initial_free_time = [round(ft) for ft in rng.uniform(0, 7, n).tolist()]
+        initial_time_worked = 0  # no time worked initially
 
-        return initial_student_state, initial_observation
+        return [
+            (
+                StudentState(mh, prod, g, ft, 0, initial_time_worked, []),
+                StudentObservation(None, ft, 0)
+            )
+            for mh, prod, g, ft in zip(
+                initial_mh, initial_prod, initial_g, initial_free_time
+            )
+        ]
 
-    def _initialize_teacher(self) -> Tuple[TeacherState, TeacherObservation]:
+    @staticmethod
+    def _initialize_teacher(
+        rng: np.random.Generator = None
+    ) -> Tuple[TeacherState, TeacherObservation]:
         """
         Creates an initial teacher.
         """
-        initial_mh = random.uniform(-1, 1)
-        initial_prod = random.uniform(0, 1)
-        initial_g = random.uniform(0, 1)
-        initial_free_time = round(random.uniform(0, 7))
+        rng = get_rng(rng)
+        initial_mh = rng.uniform(-1, 1)
+        initial_prod = rng.uniform(0, 1)
+        initial_g = rng.uniform(0, 1)
+        initial_free_time = round(rng.uniform(0, 7))
         initial_num_assignments = 0
 
         # create initial teacher state
@@ -140,20 +162,11 @@ class Classroom:
 
         return initial_teacher_state, initial_observation
 
-    @staticmethod
-    def _sample_from_weights_dict(weights_dict: dict[object, float]) -> object:
-        """
-        Samples an object from the weights_dict, where the weights_dict maps
-        objects to their weights.
-        """
-        objects, weights = zip(*weights_dict.items())
-        return random.choices(objects, weights)[0]
-
     def s_transition(self, s: StudentState, a: StudentAction) -> StudentState:
         """
         Returns the next state of the student after taking action a in state s.
         """
-        return self._sample_from_weights_dict(self.s_logic.transition(s, a))
+        return self.s_logic.sample_transition(s, a, self.rng)
 
     def student_step(self, actions: List[StudentAction], t=None) -> List[float]:
         """
@@ -177,57 +190,57 @@ class Classroom:
                        reward corresponding to student i
         """
         if t is not None and t % self.assignment_every == 0:
-            # create a new assignment
-            difficulty = random.random()
-            for s_idx in range(self.n_students):
-                assign = Assignment(difficulty, s_idx)
-                self.unsubmitted[s_idx].add(assign)
-
-        rewards = []
+            # create a new assignment for every student
+            self.assignments.issue(self.rng.random())
+
+        # submit the oldest outstanding assignment of every student who submits
+        submitters = [s_idx for s_idx, a in enumerate(actions) if a.submit]
+        if submitters:
+            self.assignments.submit(
+                submitters,
+                [self.student_s[s_idx].g for s_idx in submitters],
+                [self.student_s[s_idx].time_worked for s_idx in submitters],
+                t
+            )
+
+        # the new states, rewards and observations are sampled for the whole
+        # class at once by the batched model, so that the classroom draws from
+        # rng in exactly the same order as a VectorClassroom or ClassroomBatch
+        S = StudentStateBatch.from_items(self.student_s)
+        A = StudentActionBatch.from_items(actions)
+        Sp = self.s_logic.batch_transition(S, A, self.rng)
+        Sp.num_assignments = self.assignments.n_pending
+        rewards = self.s_logic.batch_reward(S, A, Sp)
+        O = self.s_logic.batch_observation(A, Sp, self.rng)
 
         for s_idx, action in enumerate(actions):
             student_state = self.student_s[s_idx]
 
-            # check if the student submitted an assignment
+            # the batch only keeps the last assignment's duration, so the full
+            # list is carried over from the old state
+            assign_durations = student_state.assign_durations.copy()
             if action.submit:
-                # get the student's unsubmitted assignments
-                unsubmitted = self.unsubmitted[s_idx]
-                if not unsubmitted:
-                    raise ValueError("student has no unsubmitted assignments")
-
-                # submit the assignment
-                assign = unsubmitted.pop()
-                assign.submit(student_state)
-                assign.time_submitted = t
-                self.ungraded.append(assign)
-
-            # new state
-            new_student_state = self.s_transition(student_state, action)
-            new_student_state.num_assignments = len(self.unsubmitted[s_idx])
-
-            # calculate reward for the student
-            reward = self.s_logic._reward(
-                student_state, action, new_student_state)
-            rewards.append(reward)
+                assign_durations.append(student_state.time_worked)
 
             # update student state
-            self.student_s[s_idx] = new_student_state
+            self.student_s[s_idx] = StudentState(
+                Sp.mh[s_idx].item(), Sp.prod[s_idx].item(),
+                Sp.g[s_idx].tolist(), Sp.free_time[s_idx].item(),
+                Sp.num_assignments[s_idx].item(), Sp.time_worked[s_idx].item(),
+                assign_durations
+            )
 
-            # sample an observation from the student's observation model
-            self.student_o[s_idx].append(self._sample_from_weights_dict(
-                self.s_logic.observation(action, new_student_state)
-            ))
-
-            # append the action to the student's action list
-            self.student_a[s_idx].append(action)
+            # add the observation to the student's history along with the
+            # action
+            self.student_hist[s_idx].append(action, O.item(s_idx))
 
-        return rewards
+        return rewards.tolist()
 
     def t_transition(self, s: TeacherState, a: TeacherAction) -> TeacherState:
         """
         Returns the next state of the teacher after taking action a in state s.
         """
-        return self._sample_from_weights_dict(self.t_logic.transition(s, a))
+        return self.t_logic.sample_transition(s, a, self.rng)
 
     def teacher_step(self, a: TeacherAction, t=None) -> float:
         """
@@ -246,41 +259,48 @@ class Classroom:
 
         # calculate next step and reward
         new_teacher_state = self.t_transition(teacher_state, a)
-        new_teacher_state.num_assignments = len(self.ungraded)
+        new_teacher_state.num_assignments = self.assignments.n_ungraded
         reward = self.t_logic._reward(teacher_state, a, new_teacher_state)
 
-        # grade assignments
+        # grade assignments, taking them off the front of the queue
         num_assignments = self.t_logic._assignments_graded(teacher_state, a)
-        for _ in range(num_assignments):
-            try:
-                # get the student and assignment
-                assign = self.ungraded.pop(0)
-            except IndexError:
-                # no more assignments to grade
-                break
-
-            # grade the assignment
-            grade = assign.grade(teacher_state)
-            assign.time_graded = t
-            self.graded.append(assign)
-
-            # randomly select a competency to affect
-            student_idx = assign.student_idx
-
-            new_g = self.student_s[student_idx].g.copy()
-            g_idx = random.randint(0, 7)
-            new_g[g_idx] = min(1, new_g[g_idx] + (grade / 100) * 1e-4)
-
-            self.student_s[student_idx].g = new_g
-
-            # change the student observation so they can see their grade
-            self.student_o[student_idx][-1].assignment_grade = grade
+        ids = self.assignments.pop_ungraded(num_assignments, t)
+        if len(ids):
+            grades = self.t_logic.batch_grades(
+                teacher_state.mh,
+                self.assignments.quality[ids],
+                self.assignments.difficulty[ids]
+            )
+
+            # gather the competencies of the graded students into a matrix,
+            # bump them all at once, and hand each student its new row
+            students, rows = np.unique(
+                self.assignments.student_idx[ids], return_inverse=True
+            )
+            g = np.array([self.student_s[i].g for i in students], dtype=float)
+            self.t_logic.apply_grades(g, (rows,), grades, self.rng)
+            for i, new_g in zip(students.tolist(), g):
+                # states may be shared with forks, so they're replaced rather
+                # than modified
+                new_state = copy.copy(self.student_s[i])
+                new_state.g = new_g.tolist()
+                self.student_s[i] = new_state
+
+            # change the student observations so they can see their grade (if
+            # a student had several graded, the last one is kept)
+            last = dict(zip(
+                self.assignments.student_idx[ids].tolist(), grades.tolist()
+            ))
+            for i, grade in last.items():
+                h = self.student_hist[i]
+                new_o = copy.copy(h.latest)
+                new_o.assignment_grade = grade
+                h.replace_latest(new_o)
 
         # update teacher state and observation lists
         self.teacher_s = new_teacher_state
-        self.teacher_o.append(self._sample_from_weights_dict(
-            self.t_logic.observation(a, new_teacher_state)
-        ))
-        self.teacher_a.append(a)
+        self.teacher_hist.append(
+            a, self.t_logic.sample_observation(a, new_teacher_state, self.rng)
+        )
 
         return reward
@@ -0,0 +1,212 @@
+from .Student import (
+    Student, StudentStateBatch, StudentActionBatch, StudentObservationBatch
+)
+from .Teacher import (
+    Teacher, TeacherStateBatch, TeacherActionBatch, TeacherObservationBatch
+)
+from .Classroom import Classroom
+from .VectorClassroom import VectorClassroom
+from .AssignmentStore import AssignmentStore
+from .POMDP import GeneratorBatch, get_rng
+from typing import List, Tuple
+import numpy as np
+
+
+class ClassroomBatch:
+    """
+    K independent classrooms that are advanced in lockstep. Every quantity has
+    a leading batch dimension: student fields have shape (K, n_students),
+    teacher fields have shape (K,), and the rewards and observations that the
+    steps produce are arrays of the same shapes. Each classroom follows the
+    same step and reward semantics as Classroom.
+
+    The assignments of every classroom are kept by a single AssignmentStore
+    with a leading classroom dimension, so classroom k's assignments and
+    grading queue live in row k of its arrays.
+
+    Every classroom has its own generator, rngs[k], and draws from it in the
+    same order as a VectorClassroom would (the batched models draw through a
+    GeneratorBatch). So classroom k evolves exactly like a VectorClassroom or
+    a Classroom with that generator, no matter which classrooms it's batched
+    with.
+    """
+
+    def __init__(
+        self,
+        n_classrooms,
+        n_students,
+        assignment_every=3,
+        rngs: List[np.random.Generator] = None
+    ):
+        # create objects to manage the student and teacher logic
+        self.s_logic = Student()
+        self.t_logic = Teacher()
+        self.n_classrooms = n_classrooms
+        self.n_students = n_students
+
+        # the random draws of classroom k come from rngs[k], which are split
+        # off the default generator if they aren't given
+        if rngs is None:
+            rngs = get_rng().spawn(n_classrooms)
+        assert len(rngs) == n_classrooms, "need one generator per classroom"
+        self.rngs = rngs
+        self.rng = GeneratorBatch(rngs)
+
+        # create the initial student states, self.student_o[t] holds the
+        # observations of every student in every classroom on day t
+        s, o = self._initialize_students()
+        self.student_s = s
+        self.student_o: List[StudentObservationBatch] = [o]
+        self.student_a: List[StudentActionBatch] = []
+
+        # every assignment of every classroom, with the grading queues of the
+        # submitted ones
+        self.assignments = AssignmentStore(n_students, n_classrooms)
+        self.assignment_every = assignment_every
+
+        # create the initial teacher states
+        s, o = self._initialize_teachers()
+        self.teacher_s = s
+        self.teacher_o: List[TeacherObservationBatch] = [o]
+        self.teacher_a: List[TeacherActionBatch] = []
+
+    def _initialize_students(self) -> Tuple[StudentStateBatch, StudentObservationBatch]:
+        """
+        Creates the initial students of every classroom, the same way that
+        VectorClassroom does.
+        """
+        tmp = [
+            VectorClassroom._initialize_students(self.n_students, rng)
+            for rng in self.rngs
+        ]
+        return (
+            StudentStateBatch.stack([s for (s, _) in tmp]),
+            StudentObservationBatch.stack([o for (_, o) in tmp])
+        )
+
+    def _initialize_teachers(self) -> Tuple[TeacherStateBatch, TeacherObservationBatch]:
+        """
+        Creates the initial teachers of every classroom, the same way that
+        Classroom does.
+        """
+        tmp = [Classroom._initialize_teacher(rng) for rng in self.rngs]
+        return (
+            TeacherStateBatch.from_items([s for (s, _) in tmp]),
+            TeacherObservationBatch.from_items([o for (_, o) in tmp])
+        )
+
+    def student_step(self, actions: StudentActionBatch, t=None) -> np.ndarray:
+        """
+        Performs a step for every student in every classroom. See
+        Classroom.student_step for the semantics.
+
+        params:
+            actions -- the actions that the students take, as a
+                       StudentActionBatch of shape (K, n_students) or as a
+                       flat, row-major list of StudentActions
+
+        returns:
+            rewards -- the rewards of the students, with shape (K, n_students)
+        """
+        if not isinstance(actions, StudentActionBatch):
+            actions = StudentActionBatch.from_items(actions).reshape(
+                self.n_classrooms, self.n_students
+            )
+
+        if t is not None and t % self.assignment_every == 0:
+            # create a new assignment in every classroom
+            self.assignments.issue(self.rng.random(self.n_classrooms))
+
+        # submit the oldest outstanding assignment of every student who submits
+        k_idx, s_idx = np.nonzero(actions.submit)
+        if len(k_idx):
+            self.assignments.submit(
+                s_idx,
+                self.student_s.g[k_idx, s_idx],
+                self.student_s.time_worked[k_idx, s_idx],
+                t,
+                classroom_idx=k_idx
+            )
+
+        # new states, with the number of outstanding assignments set by the
+        # classroom rather than the model
+        student_s = self.student_s
+        new_student_s = self.s_logic.batch_transition(student_s, actions, self.rng)
+        new_student_s.num_assignments = self.assignments.n_pending
+
+        # calculate the rewards and observations
+        rewards = self.s_logic.batch_reward(student_s, actions, new_student_s)
+        self.student_s = new_student_s
+        self.student_o.append(
+            self.s_logic.batch_observation(actions, new_student_s, self.rng)
+        )
+        self.student_a.append(actions)
+
+        return rewards
+
+    def teacher_step(self, actions: TeacherActionBatch, t=None) -> np.ndarray:
+        """
+        Performs a step for the teacher of every classroom. See
+        Classroom.teacher_step for the semantics.
+
+        params:
+            actions -- the actions that the teachers take, as a
+                       TeacherActionBatch of shape (K,) or as a list of
+                       TeacherActions
+
+        returns:
+            rewards -- the rewards of the teachers, with shape (K,)
+        """
+        if not isinstance(actions, TeacherActionBatch):
+            actions = TeacherActionBatch.from_items(actions)
+
+        # get most updated teacher states
+        teacher_s = self.teacher_s
+
+        # calculate next step and reward
+        new_teacher_s = self.t_logic.batch_transition(teacher_s, actions, self.rng)
+        new_teacher_s.num_assignments = self.assignments.n_ungraded
+        rewards = self.t_logic.batch_reward(teacher_s, actions, new_teacher_s)
+
+        # grade the front of each classroom's queue
+        ids = self.assignments.pop_ungraded(
+            self.t_logic.batch_assignments_graded(teacher_s, actions), t
+        )
+        k_idx = ids[0]
+        if len(k_idx):
+            n_graded = np.bincount(k_idx, minlength=self.n_classrooms)
+            starts = np.cumsum(n_graded) - n_graded
+            s_idx = self.assignments.student_idx[ids]
+
+            grades = self.t_logic.batch_grades(
+                teacher_s.mh[k_idx],
+                self.assignments.quality[ids],
+                self.assignments.difficulty[ids]
+            )
+
+            # randomly select a competency of each student to affect, one
+            # classroom at a time
+            g = self.student_s.g
+            for k in np.flatnonzero(n_graded):
+                sl = slice(starts[k], starts[k] + n_graded[k])
+                self.t_logic.apply_grades(
+                    g[k], (s_idx[sl],), grades[sl], self.rngs[k]
+                )
+
+            # change the latest observations so the students can see their
+            # grade (if a student had several graded, the last one is kept)
+            flat = (k_idx * self.n_students + s_idx)[::-1]
+            flat, rev_pos = np.unique(flat, return_index=True)
+            last = len(k_idx) - 1 - rev_pos
+            self.student_o[-1].assignment_grade[
+                flat // self.n_students, flat % self.n_students
+            ] = grades[last]
+
+        # update teacher states and observation lists
+        self.teacher_s = new_teacher_s
+        self.teacher_o.append(
+            self.t_logic.batch_observation(actions, new_teacher_s)
+        )
+        self.teacher_a.append(actions)
+
+        return rewards
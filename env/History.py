@@ -0,0 +1,186 @@
+from .POMDP import Observation, Action
+from collections.abc import Sequence
+from typing import List, Tuple
+
+
+class History:
+    """
+    An append-only record of the observations and actions of a single agent.
+    o[t] is the observation the agent had on day t and a[t] is the action it
+    took from there, so there is always one more observation than actions.
+
+    Policies don't get the history itself; they get a HistoryView, a
+    read-only snapshot that is O(1) to create.
+
+    Histories can be forked in O(1). Forking freezes everything recorded so
+    far into a shared base that both sides read through, and each side keeps
+    appending to its own tail. The only write to an existing entry,
+    replace_latest, is copy-on-write: if the latest observation lives in the
+    shared base, it's shadowed by the tail instead of being overwritten.
+    """
+
+    def __init__(self, o: Observation):
+        # the frozen history that this one extends, and how many of its
+        # observations and actions are part of this history
+        self._base: "History" = None
+        self._n_base_o = 0
+        self._n_base_a = 0
+
+        # the tail that belongs to this history
+        self._o: List[Observation] = [o]
+        self._a: List[Action] = []
+
+    def __len__(self):
+        """
+        The number of observations in the history.
+        """
+        return self._n_base_o + len(self._o)
+
+    def obs(self, i: int) -> Observation:
+        """
+        Returns o[i], for 0 <= i < len(self).
+        """
+        h = self
+        while i < h._n_base_o:
+            h = h._base
+        return h._o[i - h._n_base_o]
+
+    def act(self, i: int) -> Action:
+        """
+        Returns a[i], for 0 <= i < len(self) - 1.
+        """
+        h = self
+        while i < h._n_base_a:
+            h = h._base
+        return h._a[i - h._n_base_a]
+
+    @property
+    def o(self) -> "HistoryColumn":
+        return HistoryColumn(self.obs, lambda: len(self))
+
+    @property
+    def a(self) -> "HistoryColumn":
+        return HistoryColumn(self.act, lambda: len(self) - 1)
+
+    def append(self, a: Action, o: Observation):
+        """
+        Records that the agent took action a and then observed o.
+        """
+        self._a.append(a)
+        self._o.append(o)
+
+    def replace_latest(self, o: Observation):
+        """
+        Replaces the latest observation with o (e.g. once an assignment is
+        graded). Observations may be shared with forks, so they're never
+        modified in place.
+        """
+        if self._o:
+            self._o[-1] = o
+        else:
+            # the latest observation is in the base, so shadow it
+            self._n_base_o -= 1
+            self._o.append(o)
+
+    @property
+    def latest(self) -> Observation:
+        return self._o[-1] if self._o else self.obs(len(self) - 1)
+
+    def view(self) -> "HistoryView":
+        return HistoryView(self, len(self))
+
+    def fork(self) -> "History":
+        """
+        Returns a copy of the history that can be extended independently of
+        this one. O(1).
+        """
+        out = History.__new__(History)
+        if not self._o and not self._a:
+            # nothing since the last fork, so the base can be shared as is
+            out._base, out._n_base_o, out._n_base_a = (
+                self._base, self._n_base_o, self._n_base_a
+            )
+            out._o, out._a = [], []
+            return out
+
+        # move the current contents into a frozen base...
+        base = History.__new__(History)
+        base._base, base._n_base_o, base._n_base_a = (
+            self._base, self._n_base_o, self._n_base_a
+        )
+        base._o, base._a = self._o, self._a
+
+        # ...that both this history and the fork extend with empty tails
+        for h in (self, out):
+            h._base = base
+            h._n_base_o = len(base)
+            h._n_base_a = len(base) - 1
+            h._o, h._a = [], []
+
+        return out
+
+
+class HistoryColumn(Sequence):
+    """
+    A live, read-only sequence over the observations (or actions) of a
+    History, so that h.o[t] and h.a[t] keep working however the history is
+    stored.
+    """
+    __slots__ = ("get", "length")
+
+    def __init__(self, get, length):
+        self.get = get
+        self.length = length
+
+    def __len__(self):
+        return self.length()
+
+    def __getitem__(self, i):
+        n = len(self)
+        if isinstance(i, slice):
+            return [self.get(j) for j in range(*i.indices(n))]
+
+        if i < 0:
+            i += n
+        if not 0 <= i < n:
+            raise IndexError("history index out of range")
+
+        return self.get(i)
+
+
+class HistoryView(Sequence):
+    """
+    A read-only view of the first n observations of a History, presented as
+    the interleaved (o, a) tuple list that policies expect:
+
+        [(o_0, a_0), (o_1, a_1), ..., (o_{n-1}, None)]
+
+    The view doesn't copy anything, and since histories only ever grow, it
+    keeps showing the same n steps even after the history is appended to.
+    """
+    __slots__ = ("history", "n")
+
+    def __init__(self, history: History, n: int):
+        self.history = history
+        self.n = n
+
+    def __len__(self):
+        return self.n
+
+    def _pair(self, i: int) -> Tuple[Observation, Action]:
+        a = self.history.act(i) if i < self.n - 1 else None
+        return self.history.obs(i), a
+
+    def __getitem__(self, i):
+        if isinstance(i, slice):
+            return [self._pair(j) for j in range(*i.indices(self.n))]
+
+        if i < 0:
+            i += self.n
+        if not 0 <= i < self.n:
+            raise IndexError("history index out of range")
+
+        return self._pair(i)
+
+    def __repr__(self):
+        return f"HistoryView({list(self)})"
@@ -1,4 +1,5 @@
 import numpy as np
+from functools import lru_cache
 from typing import List, Tuple
 
 # ------------------------------------------------------------------------------
@@ -30,6 +31,84 @@ class Observation:
         raise NotImplementedError("eq not implemented")
 
 
+class Batch:
+    """
+    A struct-of-arrays collection of states, actions, or observations. Every
+    field named in FIELDS is stored as a numpy array whose leading dimensions
+    index the elements of the batch (fields like the student's g carry an
+    extra trailing dimension). This lets the models advance many elements in
+    one vectorized step instead of constructing an object per element.
+
+    The first field must hold exactly one value per element; it's used to
+    determine the shape of the batch.
+    """
+    FIELDS: Tuple[str, ...] = ()
+
+    def __init__(self, **fields):
+        for name in self.FIELDS:
+            setattr(self, name, np.asarray(fields[name]))
+
+    @property
+    def shape(self) -> Tuple[int, ...]:
+        return getattr(self, self.FIELDS[0]).shape
+
+    def __len__(self):
+        return self.shape[0]
+
+    def __getitem__(self, idx):
+        """
+        Selects a sub-batch using numpy indexing on the leading dimensions.
+        """
+        return type(self)(**{
+            name: getattr(self, name)[idx] for name in self.FIELDS
+        })
+
+    def copy(self):
+        return type(self)(**{
+            name: getattr(self, name).copy() for name in self.FIELDS
+        })
+
+    @classmethod
+    def stack(cls, batches: list):
+        """
+        Stacks a list of batches with the same shape along a new first
+        dimension.
+        """
+        return cls(**{
+            name: np.stack([getattr(b, name) for b in batches])
+            for name in cls.FIELDS
+        })
+
+    def reshape(self, *shape):
+        """
+        Reshapes the leading dimensions of the batch, keeping any trailing
+        per-element dimensions.
+        """
+        n_lead = len(self.shape)
+        return type(self)(**{
+            name: getattr(self, name).reshape(
+                shape + getattr(self, name).shape[n_lead:]
+            )
+            for name in self.FIELDS
+        })
+
+    @classmethod
+    def from_items(cls, items: list):
+        """
+        Builds a one-dimensional batch from a list of objects.
+        """
+        raise NotImplementedError("from_items not implemented")
+
+    def item(self, idx):
+        """
+        Returns the element at idx as an object.
+        """
+        raise NotImplementedError("item not implemented")
+
+    def __repr__(self):
+        return f"{type(self).__name__}(shape = {self.shape})"
+
+
 class Policy:
     def action(self, h: List[Tuple[Observation, Action]]):
         raise NotImplementedError("action not implemented")
@@ -46,10 +125,25 @@ class MemorylessPolicy(Policy):
         o = h[-1][0]
         return self.action(o)
 
+    def batch_action(self, O: Batch, rng: np.random.Generator = None) -> list:
+        """
+        Chooses an action for every observation in the batch O. By default
+        this calls action on each observation and returns a flat list of the
+        actions (in row-major order); policies can override it with a
+        vectorized version that returns a Batch of actions with the same shape
+        as O. Randomized policies should draw from rng when it's given.
+        """
+        flat = O.reshape(-1)
+        return [self.action(flat.item(i)) for i in range(len(flat))]
+
 
 def make_memoryless(π: Policy):
+    """
+    Turns π into a memoryless policy that only ever shows π the latest
+    observation, as a history of length one.
+    """
     out = MemorylessPolicy()
-    out.action = lambda h: π.action(h[-1][0])
+    out.action = lambda o: π.action([(o, None)])
     return out
 
 
@@ -69,6 +163,109 @@ class UtilityFunction:
         raise NotImplementedError("utility not implemented")
 
 
+# ------------------------------------------------------------------------------
+# random number generation
+# ------------------------------------------------------------------------------
+# the generator that's used when a method isn't given one
+_default_rng = np.random.default_rng()
+
+
+def get_rng(rng: np.random.Generator = None) -> np.random.Generator:
+    """
+    Returns rng, or the shared default generator if rng is None.
+    """
+    return _default_rng if rng is None else rng
+
+
+def seed_default_rng(seed) -> None:
+    """
+    Reseeds the shared default generator (e.g. in a worker process, which
+    would otherwise inherit its parent's state).
+    """
+    global _default_rng
+    _default_rng = np.random.default_rng(seed)
+
+
+def run_rng(seed: int, run: int, stream: int = 0) -> np.random.Generator:
+    """
+    Returns the generator for one stream of run `run` of a sweep. The streams
+    are derived from the seed sequence (seed, spawn_key=(run, stream)), so
+    they only depend on the seed and the run index -- not on which process
+    runs it or what other runs it's batched with.
+
+    params:
+        seed -- the seed of the whole sweep (None for fresh entropy)
+        run -- the index of the run in the sweep
+        stream -- which stream of the run (e.g. ENV_STREAM or POLICY_STREAM)
+    """
+    return np.random.default_rng(
+        np.random.SeedSequence(seed, spawn_key=(run, stream))
+    )
+
+
+# the streams of a run
+ENV_STREAM = 0
+POLICY_STREAM = 1
+
+
+class GeneratorBatch:
+    """
+    Stands in for a np.random.Generator in the batched methods when the first
+    dimension of the batch indexes independent runs: every draw is split
+    along that dimension and row k is drawn from rngs[k]. Row k then holds
+    exactly the numbers that rngs[k] would have produced for that run on its
+    own, while the rest of the computation stays vectorized.
+
+    Only the methods that the models and baseline policies use are provided.
+    """
+
+    def __init__(self, rngs: List[np.random.Generator]):
+        self.rngs = rngs
+
+    def _draw(self, method: str, size, *args) -> np.ndarray:
+        # the arguments are broadcast to the full size and split by row
+        args = [np.broadcast_to(arg, size) for arg in args]
+        return np.stack([
+            getattr(rng, method)(*(arg[k] for arg in args), size=size[1:])
+            for k, rng in enumerate(self.rngs)
+        ])
+
+    @staticmethod
+    def _size(size) -> Tuple[int, ...]:
+        return (size,) if np.isscalar(size) else tuple(size)
+
+    def random(self, size) -> np.ndarray:
+        return self._draw('random', self._size(size))
+
+    def standard_normal(self, size) -> np.ndarray:
+        return self._draw('standard_normal', self._size(size))
+
+    def integers(self, low, high, size) -> np.ndarray:
+        return self._draw('integers', self._size(size), low, high)
+
+    def normal(self, loc, scale, size=None) -> np.ndarray:
+        if size is None:
+            size = np.broadcast(loc, scale).shape
+        return self._draw('normal', self._size(size), loc, scale)
+
+    def dirichlet(self, alpha, size) -> np.ndarray:
+        return np.stack([
+            rng.dirichlet(alpha, self._size(size)[1:]) for rng in self.rngs
+        ])
+
+
+def sample_from_weights(
+    weights_dict: dict[object, float], rng: np.random.Generator = None
+) -> object:
+    """
+    Samples an object from the weights_dict, where the weights_dict maps
+    objects to their weights.
+    """
+    objects, weights = zip(*weights_dict.items())
+    weights = np.asarray(weights, dtype=float)
+    return objects[get_rng(rng).choice(len(objects), p=weights / weights.sum())]
+
+
 def make_belief_utility(U: StateUtilityFunction):
     def get(self, b):
         states = list(b.keys())
@@ -89,6 +286,53 @@ def make_belief_utility(U: StateUtilityFunction):
     return out
 
 
+class AlphaVectorUtility(UtilityFunction):
+    """
+    A belief utility represented by alpha vectors over a finite, indexed set
+    of states: U(b) = max_k alphas[k] @ b. Each vector comes with the action
+    that it's for, so the greedy action for a belief is the action of the
+    maximizing vector, and evaluating a belief is one matrix-vector product.
+
+    Beliefs can be arrays of probabilities over the states, or dicts from
+    states to probabilities when the state -> index map is given.
+
+    params:
+        alphas -- the alpha vectors, with shape (n_vectors, n_states)
+        actions -- the action of each vector
+        index -- maps each state to its position in the vectors
+    """
+
+    def __init__(self, alphas: np.ndarray, actions: list, index: dict = None):
+        assert len(alphas) == len(actions), "need one action per alpha vector"
+        self.alphas = np.asarray(alphas)
+        self.actions = actions
+        self.index = index
+
+    def _vector(self, b) -> np.ndarray:
+        if isinstance(b, np.ndarray):
+            return b
+
+        out = np.zeros(self.alphas.shape[1])
+        for (s, p) in b.items():
+            out[self.index[s]] += p
+        return out
+
+    def values(self, b) -> np.ndarray:
+        """
+        alphas[k] @ b for every vector k.
+        """
+        return self.alphas @ self._vector(b)
+
+    def __getitem__(self, b) -> float:
+        return self.values(b).max()
+
+    def __setitem__(self, b, u: float):
+        raise NotImplementedError("alpha vectors are computed by a solver, not set")
+
+    def action(self, b):
+        return self.actions[int(np.argmax(self.values(b)))]
+
+
 # ------------------------------------------------------------------------------
 # POMDP class with some logic implemented
 # ------------------------------------------------------------------------------
@@ -99,11 +343,54 @@ class POMDP:
     outside of the POMDP class and passed in as parameters to the methods.
 
     This class only holds the mathematical logic for the POMDP.
+
+    Models whose transition and observation distributions are pure functions
+    of their arguments can set DETERMINISTIC = True. The methods in MEMOIZED
+    are then memoized in bounded LRU caches (of CACHE_SIZE entries each),
+    which saves planners from rebuilding the same distributions over and
+    over. The cached dicts are shared between calls,
+    so callers must not modify them.
     """
+    DETERMINISTIC = False
+    CACHE_SIZE = 4096
+    MEMOIZED = ("transition", "observation", "reward_state")
 
     def __init__(self, discount: float):
         # discount factor
         self.discount = discount
+        self._memoize()
+
+    def _memoize(self):
+        if self.DETERMINISTIC:
+            for name in self.MEMOIZED:
+                setattr(self, name, lru_cache(self.CACHE_SIZE)(getattr(self, name)))
+
+    def cache_info(self) -> dict:
+        """
+        The hits, misses and size of each cache, or an empty dict if the model
+        isn't memoized.
+        """
+        if not self.DETERMINISTIC:
+            return {}
+
+        return {name: getattr(self, name).cache_info() for name in self.MEMOIZED}
+
+    def cache_clear(self):
+        if self.DETERMINISTIC:
+            for name in self.MEMOIZED:
+                getattr(self, name).cache_clear()
+
+    def __getstate__(self):
+        # the caches wrap bound methods, which can't be pickled, so they're
+        # rebuilt (empty) on the other side
+        state = self.__dict__.copy()
+        for name in self.MEMOIZED:
+            state.pop(name, None)
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._memoize()
 
     def _reward(self, s: State, a: Action, sp: State) -> float:
         """
@@ -126,6 +413,67 @@ class POMDP:
         """
         raise NotImplementedError("observation not implemented")
 
+    def sample_transition(
+        self, s: State, a: Action, rng: np.random.Generator = None
+    ) -> State:
+        """
+        Samples a next state sp from the transition distribution for taking
+        action a in state s. By default this materializes the whole
+        distribution; models should override it with an O(1) sampler.
+        """
+        return sample_from_weights(self.transition(s, a), rng)
+
+    def sample_observation(
+        self, a: Action, sp: State, rng: np.random.Generator = None
+    ) -> Observation:
+        """
+        Samples an observation for taking action a and transitioning to state
+        sp. By default this materializes the whole distribution; models should
+        override it with an O(1) sampler.
+        """
+        return sample_from_weights(self.observation(a, sp), rng)
+
+    def generate(
+        self, s: State, a: Action, rng: np.random.Generator = None
+    ) -> Tuple[State, Observation, float]:
+        """
+        The generative model: samples the next state, the observation, and the
+        reward for taking action a in state s in one call.
+
+        returns:
+            (sp, o, r) -- the next state, observation, and reward
+        """
+        sp = self.sample_transition(s, a, rng)
+        o = self.sample_observation(a, sp, rng)
+        return sp, o, self._reward(s, a, sp)
+
+    # --------------------------------------------------------------------------
+    # batched versions of the model, for models that support struct-of-arrays
+    # batches (see STATE_BATCH, ACTION_BATCH and OBSERVATION_BATCH)
+    # --------------------------------------------------------------------------
+    STATE_BATCH: type = None
+    ACTION_BATCH: type = None
+    OBSERVATION_BATCH: type = None
+
+    def batch_reward(self, S: Batch, A: Batch, Sp: Batch) -> np.ndarray:
+        raise NotImplementedError("batch_reward not implemented")
+
+    def batch_reward_state(self, S: Batch, A: Batch) -> np.ndarray:
+        raise NotImplementedError("batch_reward_state not implemented")
+
+    def batch_transition(
+        self, S: Batch, A: Batch, rng: np.random.Generator = None
+    ) -> Batch:
+        raise NotImplementedError("batch_transition not implemented")
+
+    def batch_observation(
+        self, A: Batch, Sp: Batch, rng: np.random.Generator = None
+    ) -> Batch:
+        raise NotImplementedError("batch_observation not implemented")
+
+    def batch_observation_likelihood(self, A: Batch, Sp: Batch, O: Batch) -> np.ndarray:
+        raise NotImplementedError("batch_observation_likelihood not implemented")
+
     def lookahead_state(self, s: State, a: Action, U: StateUtilityFunction) -> float:
         """
         Calculates the expected utility of taking action a from state s.
@@ -135,57 +483,133 @@ class POMDP:
             a -- action to take
             U -- a StateUtilityFunction mapping states to their expected utility
         """
-        return self.reward(s, a) + self.discount * sum(
+        return self.reward_state(s, a) + self.discount * sum(
             prob * U[sp] for (sp, prob) in self.transition(s, a).items()
         )
 
-    def lookahead(self, b, a: Action, U: UtilityFunction, update):
+    def lookahead_tables(self, b, a: Action, cache: dict = None):
+        """
+        Builds the tables that a lookahead from belief b with action a needs,
+        calling transition once per state of the belief and observation once
+        per next state. For models with random supports (like Student), every
+        observation is then scored against the same samples.
+
+        params:
+            b -- the current belief state
+            a -- action to take
+            cache -- an optional dict that keeps the transition and observation
+                     distributions of (s, a) and (a, sp) between calls, e.g.
+                     across the actions of lookahead_actions
+
+        returns:
+            (p, T, Sp, Z, O) -- the probabilities p of the states in b, the
+                                |b| x |Sp| transition matrix to the next states
+                                Sp, and the |Sp| x |O| observation matrix to
+                                the observations O
+        """
+        cache = {} if cache is None else cache
+
+        def get(key, f):
+            if key not in cache:
+                cache[key] = f()
+            return cache[key]
+
+        states = list(b.keys())
+        p = np.array([b[s] for s in states], dtype=float)
+
+        # the next states and observations that can follow, by index
+        rows = [get(("T", s, a), lambda: self.transition(s, a)) for s in states]
+        sp_idx = {}
+        for row in rows:
+            for sp in row:
+                sp_idx.setdefault(sp, len(sp_idx))
+        Sp = list(sp_idx)
+
+        cols = [get(("O", a, sp), lambda: self.observation(a, sp)) for sp in Sp]
+        o_idx = {}
+        for col in cols:
+            for o in col:
+                o_idx.setdefault(o, len(o_idx))
+        O = list(o_idx)
+
+        T = np.zeros((len(states), len(Sp)))
+        for i, row in enumerate(rows):
+            for (sp, prob) in row.items():
+                T[i, sp_idx[sp]] += prob
+
+        Z = np.zeros((len(Sp), len(O)))
+        for j, col in enumerate(cols):
+            for (o, prob) in col.items():
+                Z[j, o_idx[o]] += prob
+
+        return p, T, Sp, Z, O
+
+    def lookahead(self, b, a: Action, U: UtilityFunction, update=None, cache: dict = None):
         """
         Looks ahead using the transition and observation model and calculates
         the expected utility of taking action a from belief state b.
 
+        The models are tabulated once (see lookahead_tables), so the
+        probability of every observation, and the exact posterior after it,
+        come out of a couple of matrix products instead of going back to the
+        models for every observation.
+
         params:
             b -- the current belief state
             a -- action to take
             U -- a UtilityFunction mapping beliefs to their expected utility
             update -- a function that accepts b, a, o and returns the new belief
-                      state
-        """
-        def obs_prob(o, b, a):
-            """
-            The probability of observation o given belief state b and action a.
-            """
-            # we could actually be in a number of states
-            states = list(b.keys())
-            beliefs = np.array([b[s] for s in states])
-
-            # the probability of observing o from each of the states...
-            probs = []
-            for s in states:
-                # ...depends on the transition model...
-                T = self.transition(s, a)
-                sps = list(T.keys())
-                t_probs = np.array([T[sp] for sp in sps])
-
-                # ...and the observation model.
-                o_probs = np.array([self.observation(a, sp)[o] for sp in sps])
-                probs.append(np.dot(t_probs, o_probs))
-
-            return np.dot(beliefs, probs)
-
-        # calculate the support of the observation distribution
-        O = set()
-        for s in b:
-            O |= set(self.observation(a, s).keys())
-
-        # calculate the expected utility
-        return self.reward(b, a) + self.discount * sum(
-            obs_prob(o, b, a) * U[update(b, a, o)] for o in O
-        )
+                      state. by default, this is the exact Bayesian update over
+                      the tabulated next states
+            cache -- see lookahead_tables
+        """
+        return self.reward(b, a) + self._lookahead_future(b, a, U, update, cache)
+
+    def _lookahead_future(self, b, a: Action, U: UtilityFunction, update, cache: dict) -> float:
+        """
+        The discounted expected utility after taking action a from belief b.
+        """
+        p, T, Sp, Z, O = self.lookahead_tables(b, a, cache)
+
+        # P(sp, o | b, a), and the probability of each observation
+        joint = (p @ T)[:, None] * Z
+        obs_prob = joint.sum(axis=0)
+
+        # the expected utility after each observation that can happen
+        out = 0
+        for k in np.flatnonzero(obs_prob):
+            if update is None:
+                nz = np.flatnonzero(joint[:, k])
+                bp = {Sp[j]: joint[j, k] / obs_prob[k] for j in nz}
+            else:
+                bp = update(b, a, O[k])
+            out += obs_prob[k] * U[bp]
+
+        return self.discount * out
+
+    def lookahead_actions(self, b, A: List[Action], U: UtilityFunction, update=None) -> np.ndarray:
+        """
+        The lookahead of every action in A from belief b, as an array. The
+        transition and observation distributions are shared between the
+        actions, and the expected rewards are computed for all of them at once
+        (see rewards).
+        """
+        cache = {}
+        return self.rewards(b, A) + np.array([
+            self._lookahead_future(b, a, U, update, cache) for a in A
+        ])
+
+    def greedy_action(self, b, A: List[Action], U: UtilityFunction, update=None) -> Action:
+        """
+        The action in A with the highest lookahead from belief b.
+        """
+        return A[int(np.argmax(self.lookahead_actions(b, A, U, update)))]
 
     def reward_state(self, s: State, a: Action) -> float:
         """
-        Returns the expected reward for taking action a in state s.
+        Returns the expected reward for taking action a in state s. By default
+        this averages over the support of transition; models should override
+        it with an exact version when the expectation has a closed form.
 
         params:
             s -- the current state
@@ -209,37 +633,96 @@ class POMDP:
         rewards = np.array([self.reward_state(s, a) for s in states])
         return np.dot(probs, rewards)
 
-    def rollout(self, s: State, o: Observation, π: Policy, d: int = 10) -> float:
+    def rewards(self, b, A: List[Action]) -> np.ndarray:
+        """
+        The expected reward of every action in A given the belief state b, as
+        an array. Models with batches do this in one batch_reward_state call
+        over every (action, state) pair.
         """
-        Conducts a rollout from state s using policy π for d time steps.
+        if self.STATE_BATCH is None:
+            return np.array([self.reward(b, a) for a in A])
+
+        states = list(b.keys())
+        probs = np.array([b[s] for s in states])
+        S = self.STATE_BATCH.from_items(states)
+        A = self.ACTION_BATCH.from_items(A).reshape(len(A), 1)
+        return self.batch_reward_state(S, A) @ probs
+
+    def rollout(
+        self,
+        s: State,
+        o: Observation,
+        π: Policy,
+        d: int = 10,
+        rng: np.random.Generator = None
+    ) -> float:
+        """
+        Conducts a rollout from state s using policy π for d time steps. Each
+        step adds the expected reward of the action, so the only noise in the
+        return comes from the sampled trajectory.
 
         params
             s -- the initial state
+            o -- the observation of the initial state
             π -- the policy to use
             d -- the number of time steps to simulate
+            rng -- the generator to sample the trajectory from
         """
         out = 0
-        os = [o]
+        h = [(o, None)]
 
         for i in range(d):
             # decide which action to take
-            a = π[os]
+            a = π[h]
 
             # update the current reward
-            out += (self.discount ** i) * self.reward(s, a)
+            out += (self.discount ** i) * self.reward_state(s, a)
 
-            # calculate the next states we can transition into
-            T = self.transition(s, a)
-            if not T:
-                break
+            # randomly move in to one of the next states and observe it
+            sp = self.sample_transition(s, a, rng)
+            h[-1] = (h[-1][0], a)
+            h.append((self.sample_observation(a, sp, rng), None))
+            s = sp
 
-            # randomly move in to one of the next states
-            next_states = list(T.keys())
-            next_state_ps = [T[sp] for sp in next_states]
-            sp = np.random.choice(next_states, p=next_state_ps)
+        return out
 
-            # observe the next state
-            os.append(self.observation(a, sp))
-            s = sp
+    def batch_rollout(
+        self,
+        S: Batch,
+        O: Batch,
+        π: MemorylessPolicy,
+        d: int = 10,
+        rng: np.random.Generator = None
+    ) -> np.ndarray:
+        """
+        The batched version of rollout: advances one trajectory from every
+        state in S together, with array operations, and returns their
+        discounted returns (an array with the shape of S). The start states
+        can be the particles of a ParticleBelief, whose weights then give the
+        rollout value of the belief.
+
+        params
+            S -- the initial states, as a STATE_BATCH
+            O -- the observations of the initial states, with the same shape
+            π -- the policy to use, which only sees the latest observations
+                 (through batch_action)
+            d -- the number of time steps to simulate
+            rng -- the generator to sample the trajectories from
+        """
+        rng = get_rng(rng)
+        out = np.zeros(S.shape)
+
+        for i in range(d):
+            # decide which actions to take
+            A = π.batch_action(O, rng)
+            if not isinstance(A, Batch):
+                A = self.ACTION_BATCH.from_items(A).reshape(*O.shape)
+
+            # update the current rewards
+            out += (self.discount ** i) * self.batch_reward_state(S, A)
+
+            # move every trajectory to a sampled next state and observe it
+            S = self.batch_transition(S, A, rng)
+            O = self.batch_observation(A, S, rng)
 
         return out
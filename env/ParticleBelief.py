@@ -0,0 +1,218 @@
+from .POMDP import POMDP, State, Action, Observation, Batch, get_rng
+from collections.abc import Mapping
+from typing import List, Union
+import numpy as np
+
+
+def _as_batch(cls: type, x) -> Batch:
+    """
+    Turns a single object, a list of objects, or a Batch into a Batch of the
+    class cls. A single object becomes a batch with shape ().
+    """
+    if isinstance(x, Batch):
+        return x
+    if isinstance(x, list):
+        return cls.from_items(x)
+    return cls.from_items([x]).reshape()
+
+
+def _expand(B: Batch, shape) -> Batch:
+    """
+    Broadcasts a batch with one element per belief (leading shape shape[:-1])
+    against the particles of those beliefs (leading shape shape).
+    """
+    n_lead = len(B.shape)
+    return type(B)(**{
+        name: np.broadcast_to(
+            np.expand_dims(getattr(B, name), n_lead),
+            shape + getattr(B, name).shape[n_lead:]
+        )
+        for name in B.FIELDS
+    })
+
+
+def _take(B: Batch, idx: np.ndarray) -> Batch:
+    """
+    Selects the particles idx[..., j] along the last leading dimension of B.
+    """
+    axis = idx.ndim - 1
+    return type(B)(**{
+        name: np.take_along_axis(
+            getattr(B, name),
+            idx.reshape(idx.shape + (1,) * (getattr(B, name).ndim - idx.ndim)),
+            axis
+        )
+        for name in B.FIELDS
+    })
+
+
+class ParticleBelief(Mapping):
+    """
+    A belief over the states of a POMDP, represented by weighted particles.
+    The particles are a STATE_BATCH of the model with shape (..., N): the last
+    dimension indexes the N particles of a belief and the leading dimensions
+    (if any) index independent beliefs, e.g. one per student in a classroom.
+    All of the beliefs are updated together.
+
+    An update propagates every particle through batch_transition, copies the
+    fields that the observation reveals exactly (like the free time and the
+    number of assignments) into the particles, reweights them with
+    batch_observation_likelihood, and resamples (systematically) the beliefs
+    whose effective sample size drops below resample_threshold * N.
+
+    A single belief (particles with shape (N,)) can also be used as a dict of
+    State -> probability, so it works with POMDP.reward and POMDP.lookahead
+    (with particle_update as the update function).
+    """
+
+    def __init__(
+        self,
+        model: POMDP,
+        particles: Batch,
+        weights: np.ndarray = None,
+        rng: np.random.Generator = None,
+        resample_threshold: float = 0.5
+    ):
+        self.model = model
+        self.particles = particles
+        if weights is None:
+            weights = np.full(particles.shape, 1 / particles.shape[-1])
+        self.weights = weights
+        self.rng = get_rng(rng)
+        self.resample_threshold = resample_threshold
+        self._dict = None
+
+    @classmethod
+    def from_dict(
+        cls,
+        model: POMDP,
+        b: dict[State, float],
+        n_particles: int,
+        rng: np.random.Generator = None,
+        **kwargs
+    ) -> "ParticleBelief":
+        """
+        Draws n_particles particles from a dict belief b.
+        """
+        rng = get_rng(rng)
+        states = list(b.keys())
+        probs = np.array([b[s] for s in states], dtype=float)
+        idx = rng.choice(len(states), n_particles, p=probs / probs.sum())
+        particles = model.STATE_BATCH.from_items([states[i] for i in idx])
+        return cls(model, particles, rng=rng, **kwargs)
+
+    @property
+    def n_particles(self) -> int:
+        return self.particles.shape[-1]
+
+    def ess(self) -> np.ndarray:
+        """
+        The effective sample size of each belief.
+        """
+        return 1 / np.sum(self.weights ** 2, axis=-1)
+
+    def mean(self, name: str) -> np.ndarray:
+        """
+        The expected value of the state field called name under each belief.
+        """
+        values = getattr(self.particles, name)
+        w = self.weights.reshape(self.weights.shape + (1,) * (values.ndim - self.weights.ndim))
+        return np.sum(w * values, axis=self.weights.ndim - 1)
+
+    def update(
+        self,
+        a: Union[Action, List[Action], Batch],
+        o: Union[Observation, List[Observation], Batch]
+    ) -> "ParticleBelief":
+        """
+        Returns the belief after taking action a and observing o. a and o hold
+        one action and observation per belief, as objects (a list of them for
+        several beliefs) or as batches.
+        """
+        model = self.model
+        shape = self.particles.shape
+        A = _expand(_as_batch(model.ACTION_BATCH, a), shape)
+        O = _expand(_as_batch(model.OBSERVATION_BATCH, o), shape)
+
+        # propagate the particles through the transition model
+        Sp = model.batch_transition(self.particles, A, self.rng)
+
+        # the fields that are observed exactly are known, whatever the model
+        # predicted for them
+        for name in O.FIELDS:
+            if name in Sp.FIELDS:
+                setattr(Sp, name, np.array(getattr(O, name), dtype=getattr(Sp, name).dtype))
+
+        # weight the particles by how well they explain the observation. if
+        # none of a belief's particles do, it keeps its predicted weights
+        w = self.weights * model.batch_observation_likelihood(A, Sp, O)
+        total = w.sum(axis=-1, keepdims=True)
+        w = np.where(total > 0, w / np.where(total > 0, total, 1), self.weights)
+
+        out = ParticleBelief(model, Sp, w, self.rng, self.resample_threshold)
+        return out.resample(out.ess() < self.resample_threshold * self.n_particles)
+
+    def resample(self, which: np.ndarray = None) -> "ParticleBelief":
+        """
+        Systematically resamples the beliefs selected by the boolean array
+        which (all of them by default), giving their particles equal weights.
+        """
+        lead = self.weights.shape[:-1]
+        if which is None:
+            which = np.ones(lead, dtype=bool)
+        if not np.any(which):
+            return self
+
+        # one offset per belief, with the N positions evenly spaced after it
+        N = self.n_particles
+        positions = (self.rng.random(lead + (1,)) + np.arange(N)) / N
+
+        # search all of the beliefs at once by shifting belief r to [r, r + 1)
+        cum = np.cumsum(self.weights, axis=-1)
+        cum /= cum[..., -1:]
+        offset = np.arange(int(np.prod(lead))).reshape(lead + (1,))
+        idx = np.searchsorted(
+            (cum + offset).ravel(), (positions + offset).ravel()
+        ).reshape(self.weights.shape)
+        idx = np.minimum(idx - offset * N, N - 1)
+
+        # only the selected beliefs use the resampled particles
+        keep = np.arange(N) + np.zeros(self.weights.shape, dtype=int)
+        idx = np.where(which[..., None], idx, keep)
+        weights = np.where(which[..., None], 1 / N, self.weights)
+
+        return ParticleBelief(
+            self.model, _take(self.particles, idx), weights, self.rng,
+            self.resample_threshold
+        )
+
+    # --------------------------------------------------------------------------
+    # dict interface, for a single belief
+    # --------------------------------------------------------------------------
+    def _as_dict(self) -> dict[State, float]:
+        if self._dict is None:
+            assert len(self.particles.shape) == 1, "only a single belief is a dict"
+            self._dict = {}
+            for i in range(self.n_particles):
+                s = self.particles.item(i)
+                self._dict[s] = self._dict.get(s, 0) + self.weights[i].item()
+        return self._dict
+
+    def __getitem__(self, s: State) -> float:
+        return self._as_dict()[s]
+
+    def __iter__(self):
+        return iter(self._as_dict())
+
+    def __len__(self):
+        return len(self._as_dict())
+
+    def __repr__(self):
+        return f"ParticleBelief(shape = {self.particles.shape})"
+
+
+def particle_update(b: ParticleBelief, a: Action, o: Observation) -> ParticleBelief:
+    """
+    The update function to pass to POMDP.lookahead for particle beliefs.
+    """
+    return b.update(a, o)
@@ -1,7 +1,8 @@
-from .POMDP import POMDP, State, Action, Observation
+from .POMDP import POMDP, State, Action, Observation, Batch, get_rng
 from typing import Union, List
 import numpy as np
 from itertools import product
+from scipy.special import ndtr
 
 
 # ------------------------------------------------------------------------------
@@ -143,6 +144,111 @@ class StudentObservation(Observation):
         return f"StudentObservation(grade = {self.assignment_grade}, ft = {self.free_time}, n_assign = {self.num_assignments})"
 
 
+class StudentStateBatch(Batch):
+    """
+    Many student states stored as arrays. g has shape (..., 8) and the other
+    fields have one value per student. Instead of the full assign_durations
+    list, the batch keeps last_duration, the time worked on the most recently
+    submitted assignment, which is all the observation model needs.
+    """
+    FIELDS = (
+        "mh", "prod", "g", "free_time", "num_assignments", "time_worked",
+        "last_duration"
+    )
+
+    @classmethod
+    def from_items(cls, states: List[StudentState]):
+        return cls(
+            mh=[s.mh for s in states],
+            prod=[s.prod for s in states],
+            g=[s.g for s in states],
+            free_time=[s.free_time for s in states],
+            num_assignments=[s.num_assignments for s in states],
+            time_worked=[s.time_worked for s in states],
+            last_duration=[
+                s.assign_durations[-1] if s.assign_durations else 0.0
+                for s in states
+            ],
+        )
+
+    def item(self, i) -> StudentState:
+        return StudentState(
+            self.mh[i].item(), self.prod[i].item(), self.g[i].tolist(),
+            self.free_time[i].item(), self.num_assignments[i].item(),
+            self.time_worked[i].item(), [self.last_duration[i].item()]
+        )
+
+
+class StudentActionBatch(Batch):
+    """
+    Many student actions stored as arrays. rest and work are nan wherever the
+    student submits, mirroring the None values on StudentAction.
+    """
+    FIELDS = ("submit", "rest", "work")
+
+    @classmethod
+    def from_items(cls, actions: List[StudentAction]):
+        return cls(
+            submit=np.array([a.submit for a in actions], dtype=bool),
+            rest=np.array([
+                np.nan if a.submit else a.rest for a in actions
+            ], dtype=float),
+            work=np.array([
+                np.nan if a.submit else a.work for a in actions
+            ], dtype=float),
+        )
+
+    def item(self, i) -> StudentAction:
+        if self.submit[i]:
+            return StudentAction(submit=True)
+
+        return StudentAction(
+            rest=self.rest[i].item(), work=self.work[i].item()
+        )
+
+
+class StudentObservationBatch(Batch):
+    """
+    Many student observations stored as arrays. assignment_grade is nan where
+    the observation has no grade.
+    """
+    FIELDS = ("assignment_grade", "free_time", "num_assignments")
+
+    @classmethod
+    def from_items(cls, observations: List[StudentObservation]):
+        return cls(
+            assignment_grade=np.array([
+                np.nan if o.assignment_grade is None else o.assignment_grade
+                for o in observations
+            ], dtype=float),
+            free_time=np.array([o.free_time for o in observations]),
+            num_assignments=np.array([o.num_assignments for o in observations]),
+        )
+
+    def item(self, i) -> StudentObservation:
+        grade = self.assignment_grade[i].item()
+        return StudentObservation(
+            None if np.isnan(grade) else grade,
+            self.free_time[i].item(),
+            self.num_assignments[i].item()
+        )
+
+
+def clipped_normal_mean(mu, sigma, lo, hi):
+    """
+    The mean of clip(X, lo, hi) for X ~ N(mu, sigma^2). Works elementwise on
+    arrays.
+    """
+    alpha = (lo - mu) / sigma
+    beta = (hi - mu) / sigma
+    pdf = lambda x: np.exp(-x ** 2 / 2) / np.sqrt(2 * np.pi)
+    return (
+        lo * ndtr(alpha) + hi * (1 - ndtr(beta))
+        + mu * (ndtr(beta) - ndtr(alpha))
+        + sigma * (pdf(alpha) - pdf(beta))
+    )
+
+
 # ------------------------------------------------------------------------------
 # student class and logic
 # ------------------------------------------------------------------------------
@@ -151,9 +257,17 @@ class Student(POMDP):
         [0.1, -0.05],
         [-0.05, 0.1]
     ])
+    # MH_PROD_FACTOR @ MH_PROD_FACTOR.T == MH_PROD_COVARIANCE, for sampling
+    MH_PROD_FACTOR = np.linalg.cholesky(MH_PROD_COVARIANCE)
     ACTION = StudentAction
     STATE = StudentState
     OBSERVATION = StudentObservation
+    STATE_BATCH = StudentStateBatch
+    ACTION_BATCH = StudentActionBatch
+    OBSERVATION_BATCH = StudentObservationBatch
+
+    # transition and observation draw fresh samples on every call
+    DETERMINISTIC = False
 
     def __init__(self):
         super().__init__(0.95)
@@ -178,7 +292,46 @@ class Student(POMDP):
         # Aggregate the rewards
         return mh_improvement + prod_reward + competencies_improvement + overwhelmed_penalty
 
-    def transition(self, s: StudentState, a: StudentAction) -> dict[StudentState, float]:
+    def reward_state(self, s: StudentState, a: StudentAction) -> float:
+        """
+        The exact expected reward for taking action a in state s. The reward
+        is linear in mh, prod and g, and the only noise is the (clipped)
+        normal noise on mh and prod, so the expectation has a closed form
+        instead of having to be estimated from transition's samples. O(1).
+        """
+        if a.submit:
+            # submitting is deterministic (except for the free time, which
+            # doesn't affect the reward)
+            if s.num_assignments <= 0:
+                raise ValueError("Cannot submit when there are no assignments")
+
+            mh = max(-1, min(1, s.mh + 0.01))
+            prod = s.prod
+            g = sum(s.g)
+            num_assignments = s.num_assignments - 1
+        else:
+            # the expected mh and prod after clipping the noisy values
+            new_mh = max(-1, min(1, s.mh + a.rest * 0.1))
+            new_prod = max(0, min(1, s.prod + a.work * 0.1))
+            sd = np.sqrt(np.diag(self.MH_PROD_COVARIANCE))
+            mh = clipped_normal_mean(new_mh, sd[0], -1, 1)
+            prod = clipped_normal_mean(new_prod, sd[1], 0, 1)
+
+            # working improves competencies
+            g = sum(min(1, gi + a.work * 0.05) for gi in s.g)
+            num_assignments = s.num_assignments
+
+        overwhelmed_penalty = 0
+        if num_assignments > 5:
+            overwhelmed_penalty = (num_assignments - 5) * -0.1
+
+        return float(
+            (mh - s.mh) + (prod - s.prod) + (g - sum(s.g)) + overwhelmed_penalty
+        )
+
+    def transition(
+        self, s: StudentState, a: StudentAction, rng: np.random.Generator = None
+    ) -> dict[StudentState, float]:
         """
         Returns the probability of transitioning to state sp when taking action
         a in state s. Relative to |S|, |A|, and |O|, this should be O(1).
@@ -205,7 +358,7 @@ class Student(POMDP):
         new_prod = max(0, min(1, s.prod + a.work * 0.1))
 
         # take 10 samples from a multivariate normal distribution
-        mh_prod = np.random.multivariate_normal(
+        mh_prod = get_rng(rng).multivariate_normal(
             [new_mh, new_prod], self.MH_PROD_COVARIANCE, 10
         )
         np.clip(mh_prod[:, 0], -1, 1, out=mh_prod[:, 0])
@@ -227,7 +380,9 @@ class Student(POMDP):
             for mhp_sample, ft in product(mh_prod, range(8))
         }
 
-    def observation(self, a: StudentAction, sp: StudentState) -> dict[StudentObservation, float]:
+    def observation(
+        self, a: StudentAction, sp: StudentState, rng: np.random.Generator = None
+    ) -> dict[StudentObservation, float]:
         """
         Returns the probability of each observation for taking action a and
         transitioning to state sp. Relative to |S|, |A|, and |O|, this should be
@@ -244,7 +399,7 @@ class Student(POMDP):
             grade = max(0, min(100, quality))
 
             # draw 20 samples from a normal distribution with noise
-            noisy_grades = np.random.normal(grade, 10, 20)
+            noisy_grades = get_rng(rng).normal(grade, 10, 20)
 
             # clip the grades to be in [0, 100]
             noisy_grades = np.clip(noisy_grades, 0, 100)
@@ -256,3 +411,204 @@ class Student(POMDP):
 
         # otherwise, it's just the free time
         return {StudentObservation(None, sp.free_time, sp.num_assignments): 1.0}
+
+    def sample_transition(
+        self, s: StudentState, a: StudentAction, rng: np.random.Generator = None
+    ) -> StudentState:
+        """
+        Samples a single next state from the distribution that transition
+        returns, without constructing its whole support. O(1).
+        """
+        if a.submit and s.num_assignments <= 0:
+            raise ValueError("Cannot submit when there are no assignments")
+
+        # the same draws, in the same order, as batch_transition makes for a
+        # batch of one student
+        rng = get_rng(rng)
+        noise_mh, noise_prod = self._mh_prod_noise(rng.standard_normal(2))
+        ft = rng.integers(8)
+        if a.submit:
+            return StudentState(
+                max(-1, min(1, s.mh + 0.01)),
+                s.prod,
+                s.g,
+                ft,
+                s.num_assignments - 1,
+                0,
+                s.assign_durations + [s.time_worked]
+            )
+
+        # rest improves mh, working improves productivity
+        new_mh = max(-1, min(1, s.mh + a.rest * 0.1))
+        new_prod = max(0, min(1, s.prod + a.work * 0.1))
+
+        return StudentState(
+            max(-1, min(1, new_mh + noise_mh)),
+            max(0, min(1, new_prod + noise_prod)),
+            [min(1, gi + a.work * 0.05) for gi in s.g],
+            ft,
+            s.num_assignments,
+            s.time_worked + a.work * s.free_time,
+            s.assign_durations.copy()
+        )
+
+    def sample_observation(
+        self, a: StudentAction, sp: StudentState, rng: np.random.Generator = None
+    ) -> StudentObservation:
+        """
+        Samples a single observation from the distribution that observation
+        returns, drawing one noisy grade instead of 20. Like
+        batch_observation, it draws the grade noise even when there's no grade
+        to observe. O(1).
+        """
+        noise = get_rng(rng).normal(0, 10)
+        if a.submit:
+            quality = (sum(sp.g) + sp.assign_durations[-1]) * 100
+            grade = max(0, min(100, quality))
+            noisy_grade = max(0, min(100, grade + noise))
+            return StudentObservation(noisy_grade, sp.free_time, sp.num_assignments)
+
+        return StudentObservation(None, sp.free_time, sp.num_assignments)
+
+    @classmethod
+    def _mh_prod_noise(cls, z: np.ndarray):
+        """
+        Turns standard normal draws z, with shape (..., 2), into correlated
+        (mh, prod) noise with covariance MH_PROD_COVARIANCE. It's z @
+        MH_PROD_FACTOR.T written out elementwise, so that the noise comes out
+        bit-identical whatever the shape of the batch.
+        """
+        F = cls.MH_PROD_FACTOR
+        return z[..., 0] * F[0, 0], z[..., 0] * F[1, 0] + z[..., 1] * F[1, 1]
+
+    # --------------------------------------------------------------------------
+    # batched versions of the model, operating on struct-of-arrays batches
+    # --------------------------------------------------------------------------
+    def batch_reward(
+        self, S: StudentStateBatch, A: StudentActionBatch, Sp: StudentStateBatch
+    ) -> np.ndarray:
+        """
+        The vectorized version of _reward, returning one reward per student.
+        """
+        mh_improvement = Sp.mh - S.mh
+        prod_reward = Sp.prod - S.prod
+        competencies_improvement = Sp.g.sum(axis=-1) - S.g.sum(axis=-1)
+        overwhelmed_penalty = np.where(
+            Sp.num_assignments > 5, (Sp.num_assignments - 5) * -0.1, 0
+        )
+        return mh_improvement + prod_reward + competencies_improvement + overwhelmed_penalty
+
+    def batch_reward_state(self, S: StudentStateBatch, A: StudentActionBatch) -> np.ndarray:
+        """
+        The vectorized version of reward_state, returning the exact expected
+        reward of every student.
+        """
+        submit = A.submit
+        if np.any(submit & (S.num_assignments <= 0)):
+            raise ValueError("Cannot submit when there are no assignments")
+
+        # students who submit have no rest/work allocation
+        rest = np.where(submit, 0, A.rest)
+        work = np.where(submit, 0, A.work)
+
+        # the expected mh and prod after clipping the noisy values
+        sd = np.sqrt(np.diag(self.MH_PROD_COVARIANCE))
+        work_mh = clipped_normal_mean(np.clip(S.mh + rest * 0.1, -1, 1), sd[0], -1, 1)
+        work_prod = clipped_normal_mean(np.clip(S.prod + work * 0.1, 0, 1), sd[1], 0, 1)
+
+        # submitting is deterministic
+        mh = np.where(submit, np.clip(S.mh + 0.01, -1, 1), work_mh)
+        prod = np.where(submit, S.prod, work_prod)
+        g = np.minimum(1, S.g + work[..., None] * 0.05).sum(axis=-1)
+        num_assignments = S.num_assignments - submit
+
+        overwhelmed_penalty = np.where(
+            num_assignments > 5, (num_assignments - 5) * -0.1, 0
+        )
+        return (mh - S.mh) + (prod - S.prod) + (g - S.g.sum(axis=-1)) + overwhelmed_penalty
+
+    def batch_transition(
+        self,
+        S: StudentStateBatch,
+        A: StudentActionBatch,
+        rng: np.random.Generator = None
+    ) -> StudentStateBatch:
+        """
+        Samples one next state for every student in the batch, following the
+        same dynamics as transition. Drawing a single sample per student is
+        equivalent to picking uniformly from the support that transition
+        enumerates.
+        """
+        submit = A.submit
+        if np.any(submit & (S.num_assignments <= 0)):
+            raise ValueError("Cannot submit when there are no assignments")
+        rng = get_rng(rng)
+
+        # students who submit have no rest/work allocation
+        rest = np.where(submit, 0, A.rest)
+        work = np.where(submit, 0, A.work)
+
+        # rest improves mh, working improves productivity, with correlated
+        # noise on both
+        noise_mh, noise_prod = self._mh_prod_noise(rng.standard_normal(S.shape + (2,)))
+        work_mh = np.clip(np.clip(S.mh + rest * 0.1, -1, 1) + noise_mh, -1, 1)
+        work_prod = np.clip(np.clip(S.prod + work * 0.1, 0, 1) + noise_prod, 0, 1)
+
+        # working improves competencies
+        work_g = np.minimum(1, S.g + work[..., None] * 0.05)
+
+        return StudentStateBatch(
+            mh=np.where(submit, np.clip(S.mh + 0.01, -1, 1), work_mh),
+            prod=np.where(submit, S.prod, work_prod),
+            g=np.where(submit[..., None], S.g, work_g),
+            free_time=rng.integers(0, 8, S.shape),
+            num_assignments=np.where(
+                submit, S.num_assignments - 1, S.num_assignments
+            ),
+            time_worked=np.where(submit, 0, S.time_worked + work * S.free_time),
+            last_duration=np.where(submit, S.time_worked, S.last_duration),
+        )
+
+    def batch_observation(
+        self,
+        A: StudentActionBatch,
+        Sp: StudentStateBatch,
+        rng: np.random.Generator = None
+    ) -> StudentObservationBatch:
+        """
+        Samples one observation for every student in the batch, following the
+        same model as observation.
+        """
+        quality = np.clip((Sp.g.sum(axis=-1) + Sp.last_duration) * 100, 0, 100)
+        noisy_grades = np.clip(get_rng(rng).normal(quality, 10), 0, 100)
+
+        return StudentObservationBatch(
+            assignment_grade=np.where(A.submit, noisy_grades, np.nan),
+            free_time=Sp.free_time,
+            num_assignments=Sp.num_assignments,
+        )
+
+    def batch_observation_likelihood(
+        self,
+        A: StudentActionBatch,
+        Sp: StudentStateBatch,
+        O: StudentObservationBatch
+    ) -> np.ndarray:
+        """
+        The likelihood of each observation in O for taking the action in A and
+        transitioning to the state in Sp (the arguments broadcast against each
+        other). Only the grade of a submitted assignment is noisy: it's a
+        normal around the quality of the work, clipped to [0, 100], so grades
+        of exactly 0 or 100 get the probability mass of the clipped tails. The
+        rest of the observation is ignored, since it's fully determined.
+        """
+        quality = np.clip((Sp.g.sum(axis=-1) + Sp.last_duration) * 100, 0, 100)
+        grade = O.assignment_grade
+        z = (grade - quality) / 10
+
+        density = np.exp(-z ** 2 / 2) / (10 * np.sqrt(2 * np.pi))
+        density = np.where(grade <= 0, ndtr(z), density)
+        density = np.where(grade >= 100, 1 - ndtr(z), density)
+
+        graded = A.submit & ~np.isnan(grade)
+        return np.where(graded, density, 1.0)
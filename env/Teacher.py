@@ -1,4 +1,6 @@
-from .POMDP import POMDP, State, Action, Observation
+from .POMDP import POMDP, State, Action, Observation, Batch, get_rng
+from typing import List
+import numpy as np
 from math import isclose
 
 # ------------------------------------------------------------------------------
@@ -96,6 +98,58 @@ class TeacherObservation(Observation):
             self.num_assignments == other.num_assignments
         ])
 
+
+class TeacherStateBatch(Batch):
+    """
+    Many teacher states stored as arrays, one value per teacher in each field.
+    """
+    FIELDS = ("mh", "prod", "g", "free_time", "num_assignments")
+
+    @classmethod
+    def from_items(cls, states: List[TeacherState]):
+        return cls(**{
+            name: np.array([getattr(s, name) for s in states])
+            for name in cls.FIELDS
+        })
+
+    def item(self, i) -> TeacherState:
+        return TeacherState(*(getattr(self, name)[i].item() for name in self.FIELDS))
+
+
+class TeacherActionBatch(Batch):
+    """
+    Many teacher actions stored as arrays, one value per teacher in each field.
+    """
+    FIELDS = ("rest", "grading", "pd")
+
+    @classmethod
+    def from_items(cls, actions: List[TeacherAction]):
+        return cls(**{
+            name: np.array([getattr(a, name) for a in actions], dtype=float)
+            for name in cls.FIELDS
+        })
+
+    def item(self, i) -> TeacherAction:
+        return TeacherAction(*(getattr(self, name)[i].item() for name in self.FIELDS))
+
+
+class TeacherObservationBatch(Batch):
+    """
+    Many teacher observations stored as arrays, one value per teacher in each
+    field.
+    """
+    FIELDS = ("free_time", "num_assignments")
+
+    @classmethod
+    def from_items(cls, observations: List[TeacherObservation]):
+        return cls(**{
+            name: np.array([getattr(o, name) for o in observations])
+            for name in cls.FIELDS
+        })
+
+    def item(self, i) -> TeacherObservation:
+        return TeacherObservation(*(getattr(self, name)[i].item() for name in self.FIELDS))
+
 # ------------------------------------------------------------------------------
 # teacher class and logic
 # ------------------------------------------------------------------------------
@@ -105,6 +159,13 @@ class Teacher(POMDP):
     ACTION = TeacherAction
     STATE = TeacherState
     OBSERVATION = TeacherObservation
+    STATE_BATCH = TeacherStateBatch
+    ACTION_BATCH = TeacherActionBatch
+    OBSERVATION_BATCH = TeacherObservationBatch
+
+    # apart from free time, which is always uniform, the transition is a pure
+    # function of (s, a), and the observation is fully determined
+    DETERMINISTIC = True
 
     def __init__(self):
         super().__init__(0.95)
@@ -148,10 +209,11 @@ class Teacher(POMDP):
         assignments_per_hour = 1 + s.g * 3
         return round(time_grading * assignments_per_hour)
 
-    def transition(self, s: TeacherState, a: TeacherAction) -> dict[TeacherState, float]:
+    def _next_fields(self, s: TeacherState, a: TeacherAction):
         """
-        Returns the probability of transitioning to state sp when taking action
-        a in state s. Relative to |S|, |A|, and |O|, this should be O(1).
+        Calculates the (mh, prod, g, num_assignments) that the teacher moves
+        into after taking action a in state s. Everything except free time is
+        determined by (s, a).
         """
         # rest improves mh, grading hurts mh, pd does nothing
         new_mh = max(-1, min(1, s.mh + a.rest * 0.1 - a.grading * 0.1))
@@ -172,11 +234,44 @@ class Teacher(POMDP):
         assignments_graded = self._assignments_graded(s, a)
         new_num_assignments = max(0, s.num_assignments - assignments_graded)
 
+        return new_mh, new_prod, new_g, new_num_assignments
+
+    def reward_state(self, s: TeacherState, a: TeacherAction) -> float:
+        """
+        The exact expected reward for taking action a in state s. Everything
+        but the free time is determined by (s, a), and the free time is
+        uniform over 8 values, so the free time penalty is -1 with probability
+        1/8. O(1).
+        """
+        new_mh, new_prod, new_g, new_num_assignments = self._next_fields(s, a)
+
+        # a free time without the penalty, which is then added in expectation
+        sp = TeacherState(new_mh, new_prod, new_g, 1, new_num_assignments)
+        return self._reward(s, a, sp) - 1 / 8
+
+    def transition(self, s: TeacherState, a: TeacherAction) -> dict[TeacherState, float]:
+        """
+        Returns the probability of transitioning to state sp when taking action
+        a in state s. Relative to |S|, |A|, and |O|, this should be O(1).
+        """
+        new_mh, new_prod, new_g, new_num_assignments = self._next_fields(s, a)
         return {
             TeacherState(new_mh, new_prod, new_g, ft, new_num_assignments): 1/8
             for ft in range(8)
         }
 
+    def sample_transition(
+        self, s: TeacherState, a: TeacherAction, rng: np.random.Generator = None
+    ) -> TeacherState:
+        """
+        Samples a single next state from the distribution that transition
+        returns. O(1).
+        """
+        new_mh, new_prod, new_g, new_num_assignments = self._next_fields(s, a)
+        return TeacherState(
+            new_mh, new_prod, new_g, get_rng(rng).integers(8), new_num_assignments
+        )
+
     def observation(self, a: TeacherAction, sp: TeacherState) -> dict[TeacherObservation, float]:
         """
         Returns the probability of each observation for taking action a and 
@@ -187,3 +282,169 @@ class Teacher(POMDP):
         return {
             TeacherObservation(sp.free_time, sp.num_assignments): 1.0
         }
+
+    def sample_observation(
+        self, a: TeacherAction, sp: TeacherState, rng: np.random.Generator = None
+    ) -> TeacherObservation:
+        """
+        The observation is deterministic, so this just constructs it. O(1).
+        """
+        return TeacherObservation(sp.free_time, sp.num_assignments)
+
+    # --------------------------------------------------------------------------
+    # batched versions of the model, operating on struct-of-arrays batches
+    # --------------------------------------------------------------------------
+    def batch_reward(
+        self, S: TeacherStateBatch, A: TeacherActionBatch, Sp: TeacherStateBatch
+    ) -> np.ndarray:
+        """
+        The vectorized version of _reward, returning one reward per teacher.
+        """
+        mh_reward = Sp.mh - S.mh
+        prod_reward = Sp.prod * (1 + A.grading)
+        competence_reward = Sp.g - S.g
+        free_time_penalty = np.where(Sp.free_time < 1, -1, 0)
+        assign_penalty = np.where(
+            Sp.num_assignments > 80, -(Sp.num_assignments - 80) / 50, 0
+        )
+        return mh_reward + prod_reward + competence_reward + free_time_penalty + assign_penalty
+
+    @staticmethod
+    def batch_assignments_graded(S: TeacherStateBatch, A: TeacherActionBatch) -> np.ndarray:
+        """
+        The vectorized version of _assignments_graded.
+        """
+        time_grading = A.grading * S.free_time
+        assignments_per_hour = 1 + S.g * 3
+        return np.rint(time_grading * assignments_per_hour).astype(int)
+
+    @staticmethod
+    def batch_grades(mh, quality: np.ndarray, difficulty: np.ndarray) -> np.ndarray:
+        """
+        Grades a batch of assignments in one step. A happier teacher grades
+        more generously and harder assignments get lower grades.
+
+        params:
+            mh -- the mental health of the teacher grading each assignment,
+                  either a scalar or an array that broadcasts with quality
+            quality -- the quality of each assignment, between 0 and 100
+            difficulty -- the difficulty of each assignment, between 0 and 1
+
+        returns:
+            grades -- the grade of each assignment, between 0 and 100
+        """
+        grades = quality + 15 * (np.asarray(mh) + 1)  # so that mh > 0
+        grades = grades - 15 * difficulty
+        return np.clip(grades, 0, 100)
+
+    @staticmethod
+    def apply_grades(
+        g: np.ndarray,
+        idx: tuple,
+        grades: np.ndarray,
+        rng: np.random.Generator = None
+    ):
+        """
+        Lets the students learn from their grades: every graded assignment
+        bumps one randomly selected competency of its student. All of the
+        bumps are applied in place with a single scatter-add, so a student
+        with several graded assignments receives all of them.
+
+        params:
+            g -- the students' competencies, with the competencies along the
+                 last dimension
+            idx -- a tuple of index arrays into the leading dimensions of g,
+                   selecting the student of each graded assignment
+            grades -- the grade of each assignment
+            rng -- the generator that picks the competencies
+        """
+        g_idx = get_rng(rng).integers(0, g.shape[-1], len(grades))
+        np.add.at(g, tuple(idx) + (g_idx,), (grades / 100) * 1e-4)
+        np.minimum(g, 1, out=g)
+
+    def _batch_next_fields(self, S: TeacherStateBatch, A: TeacherActionBatch):
+        """
+        The vectorized version of _next_fields.
+        """
+        # rest improves mh, grading hurts mh, pd does nothing
+        new_mh = np.clip(S.mh + A.rest * 0.1 - A.grading * 0.1, -1, 1)
+
+        # grading improves productivity, rest or pd hurts productivity
+        new_prod = np.clip(S.prod + A.grading * 0.1 - (A.rest + A.pd) * 0.05, 0, 1)
+
+        # pd improves competence slightly
+        new_g = np.clip(S.g + A.pd * 1e-3, 0, 1)
+
+        # if mental health is low, productivity and competence decrease
+        low_mh = S.mh < -0.5
+        new_prod = np.where(low_mh, np.maximum(0, new_prod * 0.95), new_prod)
+        new_g = np.where(low_mh, np.maximum(0, new_g * 0.99), new_g)
+
+        # calculate how many assignments were graded
+        assignments_graded = self.batch_assignments_graded(S, A)
+        new_num_assignments = np.maximum(0, S.num_assignments - assignments_graded)
+
+        return new_mh, new_prod, new_g, new_num_assignments
+
+    def batch_reward_state(self, S: TeacherStateBatch, A: TeacherActionBatch) -> np.ndarray:
+        """
+        The vectorized version of reward_state.
+        """
+        new_mh, new_prod, new_g, new_num_assignments = self._batch_next_fields(S, A)
+        Sp = TeacherStateBatch(
+            mh=new_mh,
+            prod=new_prod,
+            g=new_g,
+            free_time=np.ones(S.shape, dtype=int),
+            num_assignments=new_num_assignments,
+        )
+        return self.batch_reward(S, A, Sp) - 1 / 8
+
+    def batch_transition(
+        self,
+        S: TeacherStateBatch,
+        A: TeacherActionBatch,
+        rng: np.random.Generator = None
+    ) -> TeacherStateBatch:
+        """
+        Samples one next state for every teacher in the batch, following the
+        same dynamics as transition.
+        """
+        new_mh, new_prod, new_g, new_num_assignments = self._batch_next_fields(S, A)
+        return TeacherStateBatch(
+            mh=new_mh,
+            prod=new_prod,
+            g=new_g,
+            free_time=get_rng(rng).integers(0, 8, S.shape),
+            num_assignments=new_num_assignments,
+        )
+
+    def batch_observation(
+        self,
+        A: TeacherActionBatch,
+        Sp: TeacherStateBatch,
+        rng: np.random.Generator = None
+    ) -> TeacherObservationBatch:
+        """
+        The teacher fully observes its free time and number of assignments, so
+        this doesn't draw from rng.
+        """
+        return TeacherObservationBatch(
+            free_time=Sp.free_time.copy(),
+            num_assignments=Sp.num_assignments.copy(),
+        )
+
+    def batch_observation_likelihood(
+        self,
+        A: TeacherActionBatch,
+        Sp: TeacherStateBatch,
+        O: TeacherObservationBatch
+    ) -> np.ndarray:
+        """
+        The likelihood of each observation in O for taking the action in A and
+        transitioning to the state in Sp. The teacher observes its free time
+        and number of assignments exactly, so this is 1 where they match and
+        0 where they don't.
+        """
+        match = (Sp.free_time == O.free_time) & (Sp.num_assignments == O.num_assignments)
+        return match.astype(float)
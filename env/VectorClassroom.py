@@ -0,0 +1,196 @@
+from .Student import (
+    Student, StudentAction, StudentStateBatch, StudentActionBatch,
+    StudentObservationBatch
+)
+from .Teacher import Teacher, TeacherAction
+from .Classroom import Classroom
+from .AssignmentStore import AssignmentStore
+from .POMDP import get_rng
+from typing import List, Tuple, Union
+import numpy as np
+
+
+class VectorClassroom:
+    """
+    A struct-of-arrays version of Classroom. Instead of holding a StudentState
+    object per student, every student field (mh, prod, g, free_time,
+    num_assignments, time_worked) is stored as a numpy array and the whole
+    class is advanced in one batched step. The step and reward semantics are
+    the same as Classroom's.
+
+    The teacher is a single agent, so it's still represented by TeacherState
+    objects, exactly like in Classroom.
+    """
+
+    def __init__(
+        self, n_students, assignment_every=3, rng: np.random.Generator = None
+    ):
+        # create objects to manage the student and teacher logic
+        self.s_logic = Student()
+        self.t_logic = Teacher()
+        self.n_students = n_students
+
+        # every random draw of the simulation comes from this generator
+        self.rng = get_rng(rng)
+
+        # create the initial student states, self.student_o[t] holds the
+        # observations of every student on day t
+        s, o = self._initialize_students(n_students, self.rng)
+        self.student_s = s
+        self.student_o: List[StudentObservationBatch] = [o]
+        self.student_a: List[StudentActionBatch] = []
+
+        # every assignment, with the grading queue of submitted ones
+        self.assignments = AssignmentStore(n_students)
+        self.assignment_every = assignment_every
+
+        # create the initial teacher state
+        s, o = Classroom._initialize_teacher(self.rng)
+        self.teacher_s = s
+        self.teacher_o = [o]
+        self.teacher_a = []
+
+    @property
+    def teacher_h(self):
+        """
+        Interleaves observations and actions into a tuple list.
+        """
+        out = list(zip(self.teacher_o, self.teacher_a))
+        out.append((self.teacher_o[-1], None))
+        return out
+
+    @staticmethod
+    def _initialize_students(
+        n: int, rng: np.random.Generator = None
+    ) -> Tuple[StudentStateBatch, StudentObservationBatch]:
+        """
+        Creates n initial students, with the same draws as
+        Classroom._initialize_students.
+        """
+        rng = get_rng(rng)
+        mh = rng.uniform(-1, 1, n)
+        prod = rng.uniform(0, 1, n)
+        # adjust number of competencies via the second dimension
+        g = rng.uniform(0, 1, (n, 8))
+        free_time = np.rint(rng.uniform(0, 7, n)).astype(int)
+
+        s = StudentStateBatch(
+            mh=mh,
+            prod=prod,
+            g=g,
+            free_time=free_time,
+            num_assignments=np.zeros(n, dtype=int),
+            time_worked=np.zeros(n),
+            last_duration=np.zeros(n),
+        )
+        o = StudentObservationBatch(
+            assignment_grade=np.full(n, np.nan),
+            free_time=free_time.copy(),
+            num_assignments=np.zeros(n, dtype=int),
+        )
+        return s, o
+
+    def student_step(
+        self,
+        actions: Union[List[StudentAction], StudentActionBatch],
+        t=None
+    ) -> np.ndarray:
+        """
+        Performs a step for all of the students at once. See
+        Classroom.student_step for the semantics.
+
+        params:
+            actions -- the actions that the students take, either as a list
+                       where actions[i] is the action of student i or as a
+                       StudentActionBatch
+
+        returns:
+            rewards -- an array with the reward of each student
+        """
+        if not isinstance(actions, StudentActionBatch):
+            actions = StudentActionBatch.from_items(actions)
+
+        if t is not None and t % self.assignment_every == 0:
+            # create a new assignment for everyone
+            self.assignments.issue(self.rng.random())
+
+        # submit the oldest outstanding assignment of every student who submits
+        submitters = np.flatnonzero(actions.submit)
+        if len(submitters):
+            self.assignments.submit(
+                submitters,
+                self.student_s.g[submitters],
+                self.student_s.time_worked[submitters],
+                t
+            )
+
+        # new states, with the number of outstanding assignments set by the
+        # classroom rather than the model
+        student_s = self.student_s
+        new_student_s = self.s_logic.batch_transition(student_s, actions, self.rng)
+        new_student_s.num_assignments = self.assignments.n_pending
+
+        # calculate the rewards and observations
+        rewards = self.s_logic.batch_reward(student_s, actions, new_student_s)
+        self.student_s = new_student_s
+        self.student_o.append(
+            self.s_logic.batch_observation(actions, new_student_s, self.rng)
+        )
+        self.student_a.append(actions)
+
+        return rewards
+
+    def teacher_step(self, a: TeacherAction, t=None) -> float:
+        """
+        Performs a step for the teacher. See Classroom.teacher_step for the
+        semantics; the assignments that are graded today are graded in one
+        vectorized step.
+
+        params:
+            a -- the action that the teacher takes
+
+        returns:
+            reward -- the reward that the teacher receives
+        """
+        # get most updated teacher state
+        teacher_state = self.teacher_s
+
+        # calculate next step and reward
+        new_teacher_state = self.t_logic.sample_transition(
+            teacher_state, a, self.rng
+        )
+        new_teacher_state.num_assignments = self.assignments.n_ungraded
+        reward = self.t_logic._reward(teacher_state, a, new_teacher_state)
+
+        # grade assignments
+        num_assignments = self.t_logic._assignments_graded(teacher_state, a)
+        ids = self.assignments.pop_ungraded(num_assignments, t)
+        if len(ids):
+            student_idx = self.assignments.student_idx[ids]
+            grades = self.t_logic.batch_grades(
+                teacher_state.mh,
+                self.assignments.quality[ids],
+                self.assignments.difficulty[ids]
+            )
+
+            # randomly select a competency of each student to affect
+            self.t_logic.apply_grades(
+                self.student_s.g, (student_idx,), grades, self.rng
+            )
+
+            # change the latest observations so the students can see their
+            # grade (if a student had several graded, the last one is kept)
+            rev_students, rev_pos = np.unique(
+                student_idx[::-1], return_index=True
+            )
+            last = len(student_idx) - 1 - rev_pos
+            self.student_o[-1].assignment_grade[rev_students] = grades[last]
+
+        # update teacher state and observation lists
+        self.teacher_s = new_teacher_state
+        self.teacher_o.append(
+            self.t_logic.sample_observation(a, new_teacher_state, self.rng)
+        )
+        self.teacher_a.append(a)
+
+        return reward
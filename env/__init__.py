@@ -1,4 +1,13 @@
-from .POMDP import POMDP, State, Action, Observation, Policy, MemorylessPolicy, make_memoryless, UtilityFunction
-from .Classroom import Classroom, Assignment
+from .POMDP import POMDP, State, Action, Observation, Policy, MemorylessPolicy, make_memoryless, UtilityFunction, Batch
+from .POMDP import AlphaVectorUtility
+from .POMDP import get_rng, seed_default_rng, run_rng, ENV_STREAM, POLICY_STREAM, GeneratorBatch
+from .Classroom import Classroom
+from .AssignmentStore import Assignment, AssignmentStore
+from .History import History, HistoryView, HistoryColumn
+from .VectorClassroom import VectorClassroom
+from .ClassroomBatch import ClassroomBatch
+from .ParticleBelief import ParticleBelief, particle_update
 from .Student import StudentState, StudentAction, StudentObservation
-from .Teacher import TeacherState, TeacherAction, TeacherObservation
\ No newline at end of file
+from .Student import StudentStateBatch, StudentActionBatch, StudentObservationBatch
+from .Teacher import TeacherState, TeacherAction, TeacherObservation
+from .Teacher import TeacherStateBatch, TeacherActionBatch, TeacherObservationBatch
\ No newline at end of file
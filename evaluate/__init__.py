@@ -1 +1 @@
-from .log import Log
\ No newline at end of file
+from .log import Log, BatchLog
@@ -1,4 +1,5 @@
-from env import Classroom
+from env import Classroom, ClassroomBatch, Batch
+import numpy as np
 import pandas as pd
 from typing import List
 
@@ -12,15 +13,12 @@ class SimulationSnapshot:
         self.t = t
 
         # count of values
-        self.n_ungraded = len(c.ungraded)
-        self.n_graded = len(c.graded)
+        self.n_ungraded = c.assignments.n_ungraded
+        self.n_graded = c.assignments.n_graded
         self.n_students = c.n_students
 
         # grading gap
-        self.grading_gap = None
-        gg_tmp = [a.time_graded - a.time_submitted for a in c.graded]
-        if gg_tmp:
-            self.grading_gap = sum(gg_tmp) / len(gg_tmp)
+        self.grading_gap = c.assignments.mean_grading_gap()
 
         # teacher state
         self.teacher_s = c.teacher_s.__dict__
@@ -160,3 +158,74 @@ class Log:
                 obs[i]
             )
         ]
+
+
+class BatchLog:
+    """
+    The Log for a ClassroomBatch. It records the batched observations, actions
+    and rewards of every day and exports them in the same format as Log, with
+    the rows of classroom 0 first, then classroom 1, and so on (the same rows
+    as concatenating the Logs of K separate simulations).
+    """
+
+    def __init__(self, classroom: ClassroomBatch):
+        self.c = classroom
+        self.history: List[dict] = []
+
+    def record(self, t: int, **kwargs):
+        """
+        Logs the latest observations of the classroom batch along with the
+        actions and rewards of day t.
+        """
+        self.history.append({
+            't': t,
+            'teacher_o': self.c.teacher_o[-1],
+            'student_o': self.c.student_o[-1],
+            **kwargs
+        })
+
+    @staticmethod
+    def _columns(batches: List[Batch], prefix: str) -> dict:
+        """
+        Stacks a list of daily batches with shape (K, ...) into flat columns
+        ordered by classroom, then day, then everything else.
+        """
+        return {
+            f"{prefix}_{name}": np.stack(
+                [getattr(b, name) for b in batches], axis=1
+            ).reshape(-1)
+            for name in batches[0].FIELDS
+        }
+
+    def _oaroa_memoryless(self, agent: str, shape) -> pd.DataFrame:
+        h = self.history
+        days = range(1, len(h) - 1)
+        if not days:
+            return pd.DataFrame()
+
+        day = np.array([h[i]['t'] for i in days])
+        return pd.DataFrame({
+            **self._columns([h[i-1][f'{agent}_o'] for i in days], 'o'),
+            **self._columns([h[i][f'{agent}_a'] for i in days], 'a'),
+            'r': np.stack([h[i][f'{agent}_r'] for i in days], axis=1).reshape(-1),
+            **self._columns([h[i][f'{agent}_o'] for i in days], 'op'),
+            **self._columns([h[i+1][f'{agent}_a'] for i in days], 'ap'),
+            'day': np.broadcast_to(
+                day.reshape((1, -1) + (1,) * (len(shape) - 1)),
+                (shape[0], len(day)) + shape[1:]
+            ).reshape(-1),
+        })
+
+    def t_oaroa_memoryless(self) -> pd.DataFrame:
+        """
+        The batched version of Log.t_oaroa_memoryless.
+        """
+        return self._oaroa_memoryless('teacher', (self.c.n_classrooms,))
+
+    def s_oaroa_memoryless(self) -> pd.DataFrame:
+        """
+        The batched version of Log.s_oaroa_memoryless.
+        """
+        return self._oaroa_memoryless(
+            'student', (self.c.n_classrooms, self.c.n_students)
+        )
@@ -1,3 +1,6 @@
+import numpy as np
+
+
 def full_round(x, digits=2):
     """
     Rounds a list of numbers to a given number of digits making sure that the
@@ -23,3 +26,30 @@ def full_round(x, digits=2):
         out.append(r)
 
     return out
+
+
+def full_round_array(x, digits=2):
+    """
+    The vectorized version of full_round, rounding every row of a numpy array
+    along its last axis.
+
+    params
+    ------
+    x: numpy array of numbers
+    digits: number of digits to round to
+
+    returns
+    -------
+    numpy array of rounded numbers with the same shape as x
+    """
+    x = np.asarray(x, dtype=float)
+    out = np.empty_like(x)
+    err = np.zeros(x.shape[:-1])
+
+    for i in range(x.shape[-1]):
+        a = x[..., i] + err
+        r = np.round(a, digits)
+        err = a - r
+        out[..., i] = r
+
+    return out
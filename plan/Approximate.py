@@ -5,14 +5,16 @@ File: Approximate.py
 This file implements Approximate Q-Learning algorithms on a pandas dataframe.
 """
 import pandas as pd
-from collections import defaultdict
 from typing import Union
 from tqdm import tqdm
-from random import choice
-from sklearn.neighbors import KernelDensity
-from sklearn.linear_model import LinearRegression
+from sklearn.neighbors import KDTree
 import numpy as np
 
+from env import get_rng
+from .QLearning import EncodedTransitions, learned, sarsa_update
+from .QTable import QTable
+from .Replay import BatchSource, PrioritizedReplay
+
 def infer_fields(df: pd.DataFrame):
     c = df.columns
     return {
@@ -25,7 +27,8 @@ def infer_fields(df: pd.DataFrame):
 
 
 def verify_inputs(df, m, d, lr, gamma, Q, fields):
-    assert 0 <= lr <= 1, "learning rate (alpha) must be between 0 and 1"
+    if lr is not None:
+        assert 0 <= lr <= 1, "learning rate (alpha) must be between 0 and 1"
     assert 0 <= gamma <= 1, "discount factor (gamma) must be between 0 and 1"
 
     if fields is not None:
@@ -33,25 +36,30 @@ def verify_inputs(df, m, d, lr, gamma, Q, fields):
             [k in fields for k in ("o", "a", "r", "op", "ap")]
         ), "fields must contain keys: o, a, r, op, ap"
 
-def ks_helper(q_values, weights, bandwidth):
+def kernel_neighbourhood(table: QTable, pairs: np.ndarray, k: int, bandwidth: float):
     """
-    Helper function for kernel smoothing.
-
-    PARAMS:
-    q_values: np.array of Q-values to be smoothed
-    weights: np.array of weights for each Q-value
-    bandwidth: float for kernel density estimator
+    The neighbourhood index for kernel smoothing: the k pairs nearest to each
+    (o, a) pair in pairs (pair ids in the table), by the distance
+    between their concatenated observation and action tuples, along with the
+    weights of a Gaussian kernel with the given bandwidth.
 
-    RETURNS:
-    smoothed_value: float
+    returns
+    -------
+    nbr: np.ndarray
+        nbr[i] are the indices (into pairs) of the neighbours of pairs[i],
+        starting with pairs[i] itself
+    weights: np.ndarray
+        the kernel weight of each neighbour
     """
-    kde = KernelDensity(bandwidth=bandwidth)
-    # fit kernel density estimator to input Q-values
-    kde.fit(q_values.reshape(-1,1), sample_weight = weights)
-    # use trained kernel density estimator to score query point: 0 (assuming we're smoothing Q-values around 0)
-    smoothed_value = kde.score_samples([[0]])
-    # score_samples is a one-element array, so extract the smoothed value
-    return smoothed_value[0]
+    I, J = table.pair_obs[pairs], table.pair_act[pairs]
+    obs = table.obs_array().reshape(len(table.obs), -1)
+    actions = np.array(table.actions, dtype=float).reshape(len(table.actions), -1)
+    X = np.hstack([obs[I], actions[J]])
+
+    dist, nbr = KDTree(X).query(X, k=min(k, len(X)))
+    return nbr, np.exp(-dist ** 2 / (2 * bandwidth ** 2))
+
+
 def kernel_smoothing(
     df: pd.DataFrame,
     num_simulations: int = 1000,
@@ -62,9 +70,23 @@ def kernel_smoothing(
     fields: Union[dict, None] = None,
     replay_every: int = 10,
     verbose: bool = False,
+    bandwidth: float = 1.0,
+    k: int = 16,
+    rng: Union[np.random.Generator, None] = None,
+    replay: Union[PrioritizedReplay, None] = None,
 ):
     """
-    Performs SARSA with kernel smoothing on a pandas dataframe.
+    Performs SARSA with kernel smoothing on a pandas dataframe. The batches
+    are applied like in QLearning.sarsa. While too many of the (o, a) pairs in
+    Q have never been updated, the last update of each batch uses a smoothed
+    estimate of Q(o, a) in place of Q(o, a): the Gaussian kernel-weighted mean
+    of the Q values of its k nearest pairs that are in Q. Like in sarsa, the
+    old batches that are replayed are capped at about as many rows as the
+    data has.
+
+    Every pair that can be updated shows up in the dataframe, so the
+    neighbourhoods are found once up front, and the number of untouched pairs
+    is kept up to date as the batches change them.
 
     params
     ------
@@ -78,8 +100,8 @@ def kernel_smoothing(
         learning rate
     gamma: float
         discount factor
-    Q: dict
-        initial Q values
+    Q: dict or QTable
+        initial Q values, which are updated in place
     fields: dict
         dictionary containing the column names for the observation, action,
         reward, next observation, and next action
@@ -87,22 +109,39 @@ def kernel_smoothing(
         how often to add a replay batch
     verbose: bool
         whether or not to print out the progress of the algorithm
+    bandwidth: float
+        the bandwidth of the Gaussian kernel, in (o, a) space
+    k: int
+        the number of neighbours that a smoothed value is taken over
+    rng: np.random.Generator
+        the generator that the batches are sampled with
+    replay: PrioritizedReplay
+        the buffer to replay from, for prioritized replay (as in sarsa)
 
     returns
     -------
-    Q: dict
-        the learned Q values
+    Q: QTable
+        the learned Q values (Q itself, if it was given)
     """
     # setup the fields
     verify_inputs(df, num_simulations, num_samples, lr, gamma, Q, fields)
-    if fields is None:
-        fields = infer_fields(df)
-    if Q is None:
-        Q = defaultdict(float)
+    rng = get_rng(rng)
+
+    # encode the dataframe once, into the table that's learned
+    table = Q if isinstance(Q, QTable) else QTable.from_dict(Q or {})
+    data = EncodedTransitions(df, fields, table)
+    q = table.q
+
+    # the pairs in Q, and how many of them are still 0
+    in_q = table.known.copy()
+    n_in = int(in_q.sum())
+    n_null = int(np.sum(q[in_q] == 0.0))
 
-    # fill the null values with large numbers so they move to their own place
-    # in the KDTree
-    df = df.fillna(1e9)
+    # the neighbourhood of every pair in the data
+    pairs = np.unique(np.concatenate([data.sa, data.spa]))
+    nbr, weights = kernel_neighbourhood(table, pairs, k, bandwidth)
+    nbr = pairs[nbr]
+    row = np.searchsorted(pairs, data.sa)
 
     # verbose setup
     iterable = range(num_simulations)
@@ -110,53 +149,96 @@ def kernel_smoothing(
         iterable = tqdm(iterable)
 
     # run the algorithm
-    batches = []
+    source = BatchSource(
+        lambda: (rng.choice(len(data), num_samples, replace=False),),
+        num_samples, replay_every, rng, replay,
+        max_batches=max(1, len(data) // num_samples)
+    )
     for batch in iterable:
-        # is this a replay batch?
-        if batch % replay_every == 0 and batches:
-            # replay an old batch
-            replay_batch = choice(batches)
-            sample = df.loc[replay_batch]
-
-        else:
-            # sample num_samples rows from the dataframe
-            sample = df.sample(num_samples)
-
-            # add the indexes to the list of batches
-            batches.append(sample.index)
-
-        # update the Q values
-        for _, row in sample.iterrows():
-            # get the observation, action, reward, next observation, and next action
-            o = tuple(row[fields["o"]].to_numpy())
-            a = tuple(row[fields["a"]].to_numpy())
-            r = row[fields["r"]].item()
-            op = tuple(row[fields["op"]].to_numpy())
-            ap = tuple(row[fields["ap"]].to_numpy())
-
-            # update the Q value
-            Q[o, a] += lr * (r + gamma * Q[op, ap] - Q[o, a])
-
-        # track number of "cells" in Q dict that have not been updated ever
-        null_count = sum(1 for value in Q.values() if value == 0.0)
-        null_percentage = null_count/len(Q) * 100
+        (sample,), is_weights = source.next(batch)
+
+        # the pairs that this batch touches, as they were before it
+        sa, spa, r = data.sa[sample], data.spa[sample], data.r[sample]
+        used = np.unique(np.concatenate([sa, spa]))
+        was_null = in_q[used] & (q[used] == 0.0)
+        n_in += int(np.sum(~in_q[used]))
+        in_q[used] = True
+
+        # update the Q values, in order, a conflict-free segment at a time
+        td = sarsa_update(q, sa, spa, r, lr, gamma, is_weights)
+        source.record(td)
+
+        # track number of "cells" in Q that have not been updated ever
+        n_null += int(np.sum(q[used] == 0.0)) - int(np.sum(was_null))
+        null_percentage = n_null / n_in * 100
 
         # if % of (o,a) pairs not updated ever is high, use approximate Q-learning
         if null_percentage > 30: # experiment with this threshold value
             # ------------------------------
             # ------ KERNEL SMOOTHING ------
             # ------------------------------
-            # array of Q-values
-            q_values = np.array(list(Q.values()))
-            # get weights for each Q-value using Gaussian kernel function
-            # Q-values closer to target (op, ap) pair get higher weights
-            weights = np.exp(-np.sum((q_values - Q[op, ap])**2, axis=1) / (2 * 0.2**2)) # 0.2 = bandwidth
-            # get smoothed Q-value
-            smoothed_value = ks_helper(q_values, weights, 0.2) # 0.2 = bandwidth
+            # the last update of the batch, with the kernel-weighted mean of
+            # the neighbours (that are in Q) of its (o, a) pair
+            last = sample[-1]
+            i = row[last]
+            w = weights[i] * in_q[nbr[i]]
+            smoothed_value = np.dot(w, q[nbr[i]]) / w.sum()
+
             # update Q-value for current (o,a) pair
-            Q[o,a] += lr * (r + gamma * Q[op, ap] - smoothed_value)
+            sa, spa, r = data.sa[last], data.spa[last], data.r[last]
+            was_null = q[sa] == 0.0
+            q[sa] += lr * (r + gamma * q[spa] - smoothed_value)
+            n_null += int(q[sa] == 0.0) - int(was_null)
+
+    # every pair that was used is now part of the table
+    table.known[in_q] = True
+    return learned(table, Q)
+
+class IncrementalLinearRegression:
+    """
+    Least squares regression (with an intercept) over a set of points whose
+    targets change, kept as the sufficient statistics X^T X and X^T y so that
+    adding a point or changing its target costs O(features^2) and the fit is
+    only solved when a prediction is asked for.
+
+    The features are standardized with a fixed center and scale (e.g. those
+    of every point that can be added), which doesn't change the predictions
+    but keeps X^T X well conditioned when some features are 1e9.
+    """
+
+    def __init__(self, center: np.ndarray, scale: np.ndarray):
+        self.center = center
+        self.scale = np.where(scale > 0, scale, 1.0)
+        n = len(center) + 1
+        self.XtX = np.zeros((n, n))
+        self.Xty = np.zeros(n)
+        self._coef = None
+
+    def features(self, X: np.ndarray) -> np.ndarray:
+        X = (np.atleast_2d(X) - self.center) / self.scale
+        return np.hstack([np.ones((len(X), 1)), X])
+
+    def add(self, X: np.ndarray, y: np.ndarray):
+        """
+        Adds the points X with targets y.
+        """
+        F = self.features(X)
+        self.XtX += F.T @ F
+        self.Xty += F.T @ y
+        self._coef = None
+
+    def change(self, X: np.ndarray, dy: np.ndarray):
+        """
+        Changes the targets of the (already added) points X by dy.
+        """
+        self.Xty += self.features(X).T @ dy
+        self._coef = None
+
+    def predict(self, X: np.ndarray) -> np.ndarray:
+        if self._coef is None:
+            self._coef = np.linalg.lstsq(self.XtX, self.Xty, rcond=None)[0]
+        return self.features(X) @ self._coef
 
-    return Q
 
 def linear_interpolation(
     df: pd.DataFrame,
@@ -168,21 +250,77 @@ def linear_interpolation(
     fields: Union[dict, None] = None,
     replay_every: int = 10,
     verbose: bool = False,
+    rng: Union[np.random.Generator, None] = None,
+    replay: Union[PrioritizedReplay, None] = None,
 ):
     """
-    Performs SARSA with linear interpolation on a pandas dataframe.
-    """
+    Performs SARSA with linear interpolation on a pandas dataframe. The
+    batches are applied like in QLearning.sarsa. While too many of the (o, a)
+    pairs in Q have never been updated, the last update of each batch uses
+    the prediction of a linear regression from the (o, a) pairs in Q to their
+    values in place of Q(o, a). The regression is kept up to date as the
+    values change (see IncrementalLinearRegression) instead of being refit.
+    Like in sarsa, the old batches that are replayed are capped at about as
+    many rows as the data has.
 
+    params
+    ------
+    df: pd.DataFrame
+        dataframe containing the data
+    num_simulations: int
+        number of simulations to run
+    num_samples: int
+        number of samples each simulation
+    lr: float
+        learning rate
+    gamma: float
+        discount factor
+    Q: dict or QTable
+        initial Q values, which are updated in place
+    fields: dict
+        dictionary containing the column names for the observation, action,
+        reward, next observation, and next action
+    replay_every: int
+        how often to add a replay batch
+    verbose: bool
+        whether or not to print out the progress of the algorithm
+    rng: np.random.Generator
+        the generator that the batches are sampled with
+    replay: PrioritizedReplay
+        the buffer to replay from, for prioritized replay (as in sarsa)
+
+    returns
+    -------
+    Q: QTable
+        the learned Q values (Q itself, if it was given)
+    """
     # setup the fields
     verify_inputs(df, num_simulations, num_samples, lr, gamma, Q, fields)
-    if fields is None:
-        fields = infer_fields(df)
-    if Q is None:
-        Q = defaultdict(float)
+    rng = get_rng(rng)
 
-    # fill the null values with large numbers so they move to their own place
-    # in the KDTree
-    df = df.fillna(1e9)
+    # encode the dataframe once, into the table that's learned
+    table = Q if isinstance(Q, QTable) else QTable.from_dict(Q or {})
+    data = EncodedTransitions(df, fields, table)
+    q = table.q
+
+    # the (o, a) features of a pair
+    obs = table.obs_array().reshape(len(table.obs), -1)
+    actions = np.array(table.actions, dtype=float).reshape(len(table.actions), -1)
+
+    def features(pairs):
+        I, J = table.pair_obs[pairs], table.pair_act[pairs]
+        return np.hstack([obs[I], actions[J]])
+
+    # the pairs in Q, how many of them are still 0, and the regression over
+    # them
+    in_q = table.known.copy()
+    n_in = int(in_q.sum())
+    n_null = int(np.sum(q[in_q] == 0.0))
+
+    X = features(np.unique(np.concatenate([data.sa, data.spa])))
+    model = IncrementalLinearRegression(X.mean(axis=0), X.std(axis=0))
+    known = np.flatnonzero(in_q)
+    model.add(features(known), q[known])
 
     # verbose setup
     iterable = range(num_simulations)
@@ -190,53 +328,50 @@ def linear_interpolation(
         iterable = tqdm(iterable)
 
     # run the algorithm
-    batches = []
+    source = BatchSource(
+        lambda: (rng.choice(len(data), num_samples, replace=False),),
+        num_samples, replay_every, rng, replay,
+        max_batches=max(1, len(data) // num_samples)
+    )
     for batch in iterable:
-        # is this a replay batch?
-        if batch % replay_every == 0 and batches:
-            # replay an old batch
-            replay_batch = choice(batches)
-            sample = df.loc[replay_batch]
-
-        else:
-            # sample num_samples rows from the dataframe
-            sample = df.sample(num_samples)
-
-            # add the indexes to the list of batches
-            batches.append(sample.index)
-
-        # update the Q values
-        for _, row in sample.iterrows():
-            # get the observation, action, reward, next observation, and next action
-            o = tuple(row[fields["o"]].to_numpy())
-            a = tuple(row[fields["a"]].to_numpy())
-            r = row[fields["r"]].item()
-            op = tuple(row[fields["op"]].to_numpy())
-            ap = tuple(row[fields["ap"]].to_numpy())
-
-            # update the Q value
-            Q[o, a] += lr * (r + gamma * Q[op, ap] - Q[o, a])
-
-        # track number of "cells" in Q dict that have not been updated ever
-        null_count = sum(1 for value in Q.values() if value == 0.0)
-        null_percentage = null_count/len(Q) * 100
+        (sample,), is_weights = source.next(batch)
+
+        # the pairs that this batch touches, as they were before it; the new
+        # ones enter Q (and the regression) with the value 0
+        sa, spa, r = data.sa[sample], data.spa[sample], data.r[sample]
+        used = np.unique(np.concatenate([sa, spa]))
+        new = used[~in_q[used]]
+        model.add(features(new), np.zeros(len(new)))
+        n_in += len(new)
+        n_null += len(new)
+        in_q[new] = True
+        before = q[used]
+
+        # update the Q values, in order, a conflict-free segment at a time
+        td = sarsa_update(q, sa, spa, r, lr, gamma, is_weights)
+        source.record(td)
+
+        # track number of "cells" in Q that have not been updated ever
+        model.change(features(used), q[used] - before)
+        n_null += int(np.sum(q[used] == 0.0)) - int(np.sum(before == 0.0))
+        null_percentage = n_null / n_in * 100
 
         # if % of (o,a) pairs not updated ever is high, use approximate Q-learning
         if null_percentage > 30: # experiment with this threshold value
             # ------------------------------
             # ---- LINEAR INTERPOLATION ----
             # ------------------------------
+            # use the regression to predict Q-value for the last (o,a) pair
+            last = sample[-1]
+            sa, spa, r = data.sa[last], data.spa[last], data.r[last]
+            interpolated_value = model.predict(features([sa]))[0]
 
-            # array of all (o,a) pairs
-            X = np.array(list(Q.keys()))
-            # array of all Q-values
-            Y = np.array(list(Q.values()))
-            # train linear regression model using features: X,Y -> predict Q values based on (o,a) pairs
-            lr_model = LinearRegression()
-            lr_model.fit(X,Y)
-            # use linear regression model to predict Q-value for current (o,a) pair
-            interpolated_value = lr.model.predict(np.array([o,a]).reshape(1,-1))
             # update Q value for current (o,a) pair
-            Q[o, a] += lr * (r + gamma * Q[op, ap] - interpolated_value)
-
-    return Q
+            before = q[sa]
+            q[sa] += lr * (r + gamma * q[spa] - interpolated_value)
+            model.change(features([sa]), [q[sa] - before])
+            n_null += int(q[sa] == 0.0) - int(before == 0.0)
+
+    # every pair that was used is now part of the table
+    table.known[in_q] = True
+    return learned(table, Q)
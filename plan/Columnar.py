@@ -0,0 +1,128 @@
+"""
+File: Columnar.py
+-----------------
+
+This file implements a columnar binary format for the transition datasets:
+a directory with one .npy file per column of the csv (o_*, a_*, r, op_*,
+ap_*, day) and a manifest.json that lists them. The columns are opened
+memory-mapped, so loading a dataset costs nothing up front and processes that
+train on the same dataset share its pages.
+"""
+import json
+import os
+import numpy as np
+import pandas as pd
+from numpy.lib.format import open_memmap
+from typing import Iterable, List, Union
+
+
+MANIFEST = "manifest.json"
+
+
+def write_columns(csv: str, out: str, chunksize: int = 100_000) -> "ColumnarTransitions":
+    """
+    Converts a transition csv into the columnar format in the directory out,
+    a chunk at a time. Every column is stored as float64, with True/False as
+    1/0 and missing values as nan, as pandas reads them.
+
+    params
+    ------
+    csv: str
+        the csv to convert
+    out: str
+        the directory to write the columns and the manifest to
+    chunksize: int
+        the number of rows to convert at a time
+
+    returns
+    -------
+    data: ColumnarTransitions
+        the converted dataset
+    """
+    columns = list(pd.read_csv(csv, nrows=0).columns)
+    n_rows = sum(
+        len(chunk) for chunk in pd.read_csv(csv, usecols=columns[:1], chunksize=chunksize)
+    )
+
+    os.makedirs(out, exist_ok=True)
+    arrays = {
+        c: open_memmap(os.path.join(out, f"{c}.npy"), mode="w+", dtype=np.float64, shape=(n_rows,))
+        for c in columns
+    }
+
+    start = 0
+    for chunk in pd.read_csv(csv, chunksize=chunksize):
+        stop = start + len(chunk)
+        for c in columns:
+            arrays[c][start:stop] = chunk[c].to_numpy(dtype=np.float64, na_value=np.nan)
+        start = stop
+
+    for a in arrays.values():
+        a.flush()
+    with open(os.path.join(out, MANIFEST), "w") as f:
+        json.dump({
+            "n_rows": n_rows,
+            "columns": columns,
+            "files": {c: f"{c}.npy" for c in columns},
+            "dtype": "float64",
+        }, f, indent=2)
+
+    return ColumnarTransitions(out)
+
+
+class ColumnarTransitions:
+    """
+    A transition dataset in the columnar format, with its columns opened as
+    read-only memory maps. It has the same column names as the csv it came
+    from, so infer_fields(data) gives the usual fields dict, and data[c] is
+    column c.
+
+    attributes
+    ----------
+    columns: list
+        the names of the columns
+    """
+
+    def __init__(self, path: str):
+        with open(os.path.join(path, MANIFEST)) as f:
+            manifest = json.load(f)
+        self.path = path
+        self.columns: List[str] = manifest["columns"]
+        self.n_rows: int = manifest["n_rows"]
+        self._arrays = {
+            c: np.load(os.path.join(path, manifest["files"][c]), mmap_mode="r")
+            for c in self.columns
+        }
+
+    @staticmethod
+    def is_columnar(path) -> bool:
+        """
+        Whether path is a directory in the columnar format.
+        """
+        return isinstance(path, str) and os.path.isfile(os.path.join(path, MANIFEST))
+
+    def __len__(self):
+        return self.n_rows
+
+    def __getitem__(self, column: str) -> np.ndarray:
+        return self._arrays[column]
+
+    def frame(
+        self,
+        start: int = 0,
+        stop: Union[int, None] = None,
+        columns: Union[Iterable[str], None] = None,
+    ) -> pd.DataFrame:
+        """
+        Rows start to stop of the columns (all of them by default) as a
+        dataframe.
+        """
+        columns = self.columns if columns is None else list(columns)
+        return pd.DataFrame({c: self._arrays[c][start:stop] for c in columns})
+
+    def chunks(self, chunksize: int = 100_000, columns: Union[Iterable[str], None] = None):
+        """
+        The rows as consecutive dataframes of chunksize rows.
+        """
+        for start in range(0, self.n_rows, chunksize):
+            yield self.frame(start, start + chunksize, columns)
@@ -5,10 +5,15 @@ File: QLearning.py
 This file implements the QLearning algorithm on a pandas dataframe.
 """
 import pandas as pd
-from collections import defaultdict
+import numpy as np
 from typing import Union
 from tqdm import tqdm
-from random import choice
+
+from env import get_rng
+
+from .QTable import QTable
+from .Columnar import ColumnarTransitions
+from .Replay import BatchSource, PrioritizedReplay
 
 
 def infer_fields(df: pd.DataFrame):
@@ -23,7 +28,8 @@ def infer_fields(df: pd.DataFrame):
 
 
 def verify_inputs(df, m, d, lr, gamma, Q, fields):
-    assert 0 <= lr <= 1, "learning rate (alpha) must be between 0 and 1"
+    if lr is not None:
+        assert 0 <= lr <= 1, "learning rate (alpha) must be between 0 and 1"
     assert 0 <= gamma <= 1, "discount factor (gamma) must be between 0 and 1"
 
     if fields is not None:
@@ -32,8 +38,254 @@ def verify_inputs(df, m, d, lr, gamma, Q, fields):
         ), "fields must contain keys: o, a, r, op, ap"
 
 
+def encode_transitions(df: pd.DataFrame, fields: dict, table: QTable) -> tuple:
+    """
+    Interns the observations and actions of the rows of df into table, with
+    missing values filled in with 1e9.
+
+    returns
+    -------
+    o, a, r, op, ap: np.ndarray
+        the observation and action ids on both sides of each row, and its
+        reward
+    """
+    df = df.fillna(1e9)
+
+    # intern the observations and actions of both sides together
+    def intern(cur, nxt, intern_into):
+        codes, uniques = pd.MultiIndex.from_frame(pd.concat([
+            df[cur], df[nxt].set_axis(cur, axis=1)
+        ])).factorize()
+        ids = intern_into(uniques)[codes]
+        return ids[:len(df)], ids[len(df):]
+
+    o, op = intern(fields["o"], fields["op"], table.intern_obs)
+    a, ap = intern(fields["a"], fields["ap"], table.intern_actions)
+    r = df[fields["r"]].to_numpy(dtype=float).reshape(len(df))
+    return o, a, r, op, ap
+
+
+class EncodedTransitions:
+    """
+    The transitions of a dataframe encoded as integers, so the learning loops
+    can run over contiguous arrays. The observations and actions on both
+    sides of the transitions are interned into a QTable (with missing values
+    filled in with 1e9, see encode_transitions), and so are the (o, a) pairs,
+    so every pair is an index into the table's arrays.
+
+    attributes
+    ----------
+    table: QTable
+        the table that the observations and actions are interned into
+    sa: np.ndarray
+        the id of each row's (o, a) pair in the table
+    spa: np.ndarray
+        the id of each row's (op, ap) pair
+    r: np.ndarray
+        the reward of each row
+    """
+
+    def __init__(
+        self,
+        df: Union[pd.DataFrame, ColumnarTransitions],
+        fields: Union[dict, None] = None,
+        table: Union[QTable, None] = None,
+    ):
+        if fields is None:
+            fields = infer_fields(df)
+        if table is None:
+            table = QTable(
+                obs_ordering=[c[len("o_"):] for c in fields["o"]],
+                act_ordering=[c[len("a_"):] for c in fields["a"]],
+            )
+        self.fields = fields
+        self.table = table
+
+        if isinstance(df, ColumnarTransitions):
+            # encode the memory-mapped columns a chunk at a time
+            columns = [c for k in ("o", "a", "r", "op", "ap") for c in fields[k]]
+            parts = [encode_transitions(c, fields, table) for c in df.chunks(columns=columns)]
+            o, a, self.r, op, ap = (np.concatenate(x) for x in zip(*parts))
+        else:
+            o, a, self.r, op, ap = encode_transitions(df, fields, table)
+        self.sa = table.intern_pairs(o, a)
+        self.spa = table.intern_pairs(op, ap)
+
+    def __len__(self):
+        return len(self.sa)
+
+
+class TransitionStream:
+    """
+    The transitions of a csv file (or a dataset in the columnar format) that's
+    too big to load, read a chunk at a time. Each chunk is encoded into the table (like EncodedTransitions) as
+    it's read and added to a shuffle buffer, which hands out minibatches in
+    random order until it's back down to buffer_size rows. Only a chunk and
+    the buffer are ever in memory, as integer ids.
+
+    attributes
+    ----------
+    table: QTable
+        the table that the observations and actions are interned into
+    """
+
+    def __init__(
+        self,
+        path: Union[str, ColumnarTransitions],
+        fields: Union[dict, None] = None,
+        table: Union[QTable, None] = None,
+        chunksize: int = 100_000,
+        buffer_size: int = 100_000,
+    ):
+        if ColumnarTransitions.is_columnar(path):
+            path = ColumnarTransitions(path)
+        if fields is None:
+            columnar = isinstance(path, ColumnarTransitions)
+            fields = infer_fields(path if columnar else pd.read_csv(path, nrows=0))
+        if table is None:
+            table = QTable(
+                obs_ordering=[c[len("o_"):] for c in fields["o"]],
+                act_ordering=[c[len("a_"):] for c in fields["a"]],
+            )
+        self.path = path
+        self.fields = fields
+        self.table = table
+        self.chunksize = chunksize
+        self.buffer_size = buffer_size
+
+    def chunks(self):
+        """
+        Reads and encodes the file, a chunk at a time.
+        """
+        columns = [c for k in ("o", "a", "r", "op", "ap") for c in self.fields[k]]
+        if isinstance(self.path, ColumnarTransitions):
+            chunks = self.path.chunks(self.chunksize, columns)
+        else:
+            chunks = pd.read_csv(self.path, usecols=columns, chunksize=self.chunksize)
+
+        for chunk in chunks:
+            o, a, r, op, ap = encode_transitions(chunk, self.fields, self.table)
+            yield np.column_stack([
+                self.table.intern_pairs(o, a), self.table.intern_pairs(op, ap)
+            ]), r
+
+    def batches(self, d: int, rng: Union[np.random.Generator, None] = None):
+        """
+        Yields minibatches of d transitions, as (sa, spa, r) arrays of pair
+        ids and rewards (like the rows of EncodedTransitions), going over the
+        file again and again.
+        """
+        rng = get_rng(rng)
+        ids, r = np.empty((0, 2), dtype=int), np.empty(0)
+
+        def drain(keep):
+            # shuffle the buffer and hand out batches until keep rows are left
+            nonlocal ids, r
+            perm = rng.permutation(len(r))
+            ids, r = ids[perm], r[perm]
+            while len(r) >= d and len(r) > keep:
+                # copies, so replayed batches don't keep the buffer alive
+                (sa, spa), rb = ids[-d:].T.copy(), r[-d:].copy()
+                ids, r = ids[:-d], r[:-d]
+                yield sa, spa, rb
+
+        while True:
+            empty = True
+            for chunk_ids, chunk_r in self.chunks():
+                empty = False
+                ids = np.concatenate([ids, chunk_ids])
+                r = np.concatenate([r, chunk_r])
+                yield from drain(self.buffer_size)
+
+            # the end of the file: empty the buffer, except for less than a
+            # batch that goes on to the next pass
+            if empty:
+                return
+            yield from drain(0)
+
+
+def conflict_free_segments(write: np.ndarray, read: np.ndarray) -> list:
+    """
+    Splits a sequence of updates, where update j reads read[j] and write[j]
+    and then writes write[j], into consecutive segments in which no update
+    reads or writes an id that an earlier update of the segment wrote. The
+    updates of a segment can then be applied all at once with the same result
+    as applying them one at a time.
+
+    returns
+    -------
+    bounds: list
+        the (start, end) of each segment
+    """
+    n = len(write)
+    pos = np.arange(n)
+
+    # for every update, the last earlier update that wrote its ids: search
+    # the writes, sorted by (id, position), for (id, j)
+    order = np.lexsort((pos, write))
+    keys = write[order] * n + pos[order]
+
+    def last_write(ids):
+        i = np.searchsorted(keys, ids * n + pos) - 1
+        found = (i >= 0) & (write[order[np.maximum(i, 0)]] == ids)
+        return np.where(found, order[np.maximum(i, 0)], -1)
+
+    conflict = np.maximum(last_write(write), last_write(read))
+
+    # a segment ends just before the first update that conflicts with it
+    bounds = []
+    start = 0
+    while start < n:
+        later = np.flatnonzero(conflict[start + 1:] >= start)
+        end = start + 1 + later[0] if len(later) else n
+        bounds.append((start, end))
+        start = end
+    return bounds
+
+
+def learned(table: QTable, Q: Union[dict, QTable, None]) -> Union[dict, QTable]:
+    """
+    What a learner returns for the Q that it was given: the table it learned
+    into, or, if Q was a dict, Q itself, updated in place with the table's
+    values.
+    """
+    if Q is None or isinstance(Q, QTable):
+        return table
+
+    for (o, a), v in table.items():
+        Q[o, a] = v
+    return Q
+
+
+def sarsa_update(
+    q: np.ndarray,
+    sa: np.ndarray,
+    spa: np.ndarray,
+    r: np.ndarray,
+    lr: float,
+    gamma: float,
+    weights: Union[np.ndarray, None] = None,
+) -> np.ndarray:
+    """
+    Applies the SARSA updates of a batch to the flat Q values q, in order, a
+    conflict-free segment at a time. The step of each update is scaled by
+    its weight, if weights are given.
+
+    returns
+    -------
+    td: np.ndarray
+        the TD error of each update
+    """
+    td = np.empty(len(sa))
+    step = np.full(len(sa), lr) if weights is None else lr * weights
+    for (i, j) in conflict_free_segments(sa, spa):
+        td[i:j] = r[i:j] + gamma * q[spa[i:j]] - q[sa[i:j]]
+        q[sa[i:j]] += step[i:j] * td[i:j]
+    return td
+
+
 def sarsa(
-    df: pd.DataFrame,
+    df: Union[pd.DataFrame, "TransitionStream"],
     m: int = 1000,
     d: int = 100,
     lr: float = 1e-2,
@@ -42,13 +294,31 @@ def sarsa(
     fields: Union[dict, None] = None,
     replay_every: int = 10,
     verbose: bool = False,
+    rng: Union[np.random.Generator, None] = None,
+    replay: Union[PrioritizedReplay, None] = None,
 ):
     """
-    Performs SARSA on a pandas dataframe.
+    Performs SARSA on a pandas dataframe. The dataframe is encoded into
+    integer ids once (see EncodedTransitions), and every batch is applied as
+    a few vectorized updates over conflict-free segments, with the same
+    result as updating the rows one at a time.
+
+    The old batches that are replayed are a uniform (reservoir) sample of
+    the ones seen so far (see BatchSource), of about as many rows as the
+    data has, so memory doesn't grow with m.
+
+    The data can also be a TransitionStream, for files that don't fit in
+    memory; the fresh batches then come from its shuffle buffer and the Q
+    values are learned into its table. The replayed batches are then kept
+    to about the stream's buffer_size rows.
+
+    With a PrioritizedReplay, the rows of the fresh batches go into it along
+    with their TD errors, and the replay batches are drawn from it (by TD
+    error) instead of being old batches chosen uniformly.
 
     params
     ------
-    df: pd.DataFrame
+    df: pd.DataFrame or TransitionStream
         dataframe containing the data
     m: int
         number of simulations to run
@@ -58,8 +328,8 @@ def sarsa(
         learning rate
     gamma: float
         discount factor
-    Q: dict
-        initial Q values
+    Q: dict or QTable
+        initial Q values, which are updated in place
     fields: dict
         dictionary containing the column names for the observation, action,
         reward, next observation, and next action
@@ -67,22 +337,46 @@ def sarsa(
         how often to add an replay batch
     verbose: bool
         whether or not to print out the progress of the algorithm
+    rng: np.random.Generator
+        the generator that the batches are sampled with
+    replay: PrioritizedReplay
+        the buffer to replay from, for prioritized replay
 
     returns
     -------
-    Q: dict
-        the learned Q values
+    Q: QTable
+        the learned Q values (Q itself, if it was given)
     """
     # setup the fields
     verify_inputs(df, m, d, lr, gamma, Q, fields)
-    if fields is None:
-        fields = infer_fields(df)
-    if Q is None:
-        Q = defaultdict(float)
+    rng = get_rng(rng)
 
-    # fill the null values with large numbers so they move to their own place
-    # in the KDTree
-    df = df.fillna(1e9)
+    if isinstance(df, TransitionStream):
+        # the stream encodes the rows into the table as it reads them, and
+        # its batches are already (sa, spa, r)
+        assert Q is None or Q is df.table, "a stream learns into its own table"
+        table = df.table
+        stream = df.batches(d, rng)
+        source = BatchSource(
+            lambda: next(stream), d, replay_every, rng, replay,
+            max_batches=max(1, df.buffer_size // d)
+        )
+
+        def positions(sample):
+            return sample
+
+    else:
+        # encode the dataframe once, into the table that's learned
+        table = Q if isinstance(Q, QTable) else QTable.from_dict(Q or {})
+        data = EncodedTransitions(df, fields, table)
+        source = BatchSource(
+            lambda: (rng.choice(len(data), d, replace=False),),
+            d, replay_every, rng, replay, max_batches=max(1, len(data) // d)
+        )
+
+        def positions(sample):
+            (rows,) = sample
+            return data.sa[rows], data.spa[rows], data.r[rows]
 
     # verbose setup
     iterable = range(m)
@@ -90,31 +384,101 @@ def sarsa(
         iterable = tqdm(iterable)
 
     # run the algorithm
-    batches = []
     for batch in iterable:
-        # is this a replay batch?
-        if batch % replay_every == 0 and batches:
-            # replay an old batch
-            replay_batch = choice(batches)
-            sample = df.loc[replay_batch]
+        sample, is_weights = source.next(batch)
 
-        else:
-            # sample d rows from the dataframe
-            sample = df.sample(d)
+        # update the Q values, in order, a conflict-free segment at a time;
+        # every pair that's used becomes part of the table
+        sa, spa, r = positions(sample)
+        q, known = table.q, table.known
+        td = sarsa_update(q, sa, spa, r, lr, gamma, is_weights)
+        known[sa] = known[spa] = True
 
-            # add the indexes to the list of batches
-            batches.append(sample.index)
+        # keep the errors of the rows up to date
+        source.record(td)
 
-        # update the Q values
-        for _, row in sample.iterrows():
-            # get the observation, action, reward, next observation, and next action
-            o = tuple(row[fields["o"]].to_numpy())
-            a = tuple(row[fields["a"]].to_numpy())
-            r = row[fields["r"]].item()
-            op = tuple(row[fields["op"]].to_numpy())
-            ap = tuple(row[fields["ap"]].to_numpy())
+    return learned(table, Q)
 
-            # update the Q value
-            Q[o, a] += lr * (r + gamma * Q[op, ap] - Q[o, a])
 
-    return Q
+def fitted_sarsa(
+    df: pd.DataFrame,
+    gamma: float = 0.95,
+    tol: float = 1e-4,
+    max_iter: int = 1000,
+    Q: Union[dict, QTable, None] = None,
+    fields: Union[dict, None] = None,
+    greedy: bool = False,
+    verbose: bool = False,
+):
+    """
+    Performs batch fitted SARSA (or fitted Q iteration) on a pandas
+    dataframe. Every iteration is one Bellman backup over every row at once:
+    Q(o, a) becomes the mean, over the rows with that (o, a), of
+    r + gamma * Q(op, ap) (or r + gamma * max over a' of Q(op, a') when
+    greedy is set, where a' ranges over the actions stored for op). It stops
+    once the Bellman residual, the largest change in Q, is below tol.
+
+    params
+    ------
+    df: pd.DataFrame
+        dataframe containing the data
+    gamma: float
+        discount factor
+    tol: float
+        stop once the residual is below this
+    max_iter: int
+        the maximum number of backups
+    Q: dict or QTable
+        initial Q values, which are updated in place
+    fields: dict
+        dictionary containing the column names for the observation, action,
+        reward, next observation, and next action
+    greedy: bool
+        whether to back up the best next action (fitted Q iteration) instead
+        of the next action in the data (fitted SARSA)
+    verbose: bool
+        whether or not to print the residual of each iteration
+
+    returns
+    -------
+    Q: QTable
+        the learned Q values (Q itself, if it was given)
+    residuals: list
+        the residual of each iteration
+    """
+    verify_inputs(df, max_iter, None, None, gamma, Q, fields)
+    table = Q if isinstance(Q, QTable) else QTable.from_dict(Q or {})
+    data = EncodedTransitions(df, fields, table)
+    q = table.q
+    table.known[data.sa] = True
+    table.known[data.spa] = True
+
+    # the rows of each (o, a) pair, and the mean reward over them
+    size = len(q)
+    counts = np.bincount(data.sa, minlength=size)
+    fitted = counts > 0
+    mean_r = np.bincount(data.sa, data.r, minlength=size)[fitted] / counts[fitted]
+    op = table.pair_obs[data.spa]
+    known = np.flatnonzero(table.known[:table.n_pairs])
+
+    residuals = []
+    for i in range(max_iter):
+        if greedy:
+            best = np.full(len(table.obs), -np.inf)
+            np.maximum.at(best, table.pair_obs[known], q[known])
+            after = best[op]
+        else:
+            after = q[data.spa]
+
+        # the mean of the backed up values of each pair's rows
+        target = mean_r + gamma * np.bincount(data.sa, after, minlength=size)[fitted] / counts[fitted]
+        residual = np.abs(target - q[fitted]).max().item()
+        q[fitted] = target
+        residuals.append(residual)
+
+        if verbose:
+            print(f"iteration {i}: residual = {residual}")
+        if residual < tol:
+            break
+
+    return learned(table, Q), residuals
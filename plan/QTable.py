@@ -0,0 +1,328 @@
+"""
+File: QTable.py
+---------------
+
+This file implements QTable, an array-backed Q table. Observations and
+actions (as the tuples that the learners key Q by, with 1e9 in place of None)
+are interned into dense integer ids, and so are the (o, a) pairs that show
+up, whose values live in a 1-D float array. The table still behaves like the
+dict keyed by (o, a) that the rest of the code expects.
+"""
+import numpy as np
+from pickle import load
+from typing import Iterable, List, Tuple, Union
+
+
+class QTable:
+    """
+    Q values stored by (o, a) pair. obs[i] is the tuple of observation i and
+    actions[j] the tuple of action j, and pair p is (obs[pair_obs[p]],
+    actions[pair_act[p]]) with the value q[p]. Only the pairs that have been
+    set are part of the table (known[p]); reading any other pair gives 0,
+    like the defaultdict(float) the learners used.
+
+    Only the pairs that occur are stored (most observations only see a few
+    of the actions), sorted by (observation, action) in an index that's used
+    both to look pairs up and to find the pairs of an observation.
+
+    attributes
+    ----------
+    q: np.ndarray
+        q[p] is the value of pair p
+    known: np.ndarray
+        whether each pair is in the table
+    pair_obs, pair_act: np.ndarray
+        the observation and action ids of each pair
+    obs_ordering, act_ordering: list
+        the fields of the observation and action tuples, if known
+    """
+
+    def __init__(
+        self,
+        obs: Iterable[tuple] = (),
+        actions: Iterable[tuple] = (),
+        obs_ordering: Union[list, None] = None,
+        act_ordering: Union[list, None] = None,
+    ):
+        self.obs: List[tuple] = []
+        self.actions: List[tuple] = []
+        self.obs_index = {}
+        self.act_index = {}
+        self.obs_ordering = obs_ordering
+        self.act_ordering = act_ordering
+
+        # the pairs, by id (with room to grow)
+        self.n_pairs = 0
+        self.q = np.zeros(0)
+        self.known = np.zeros(0, dtype=bool)
+        self.pair_obs = np.zeros(0, dtype=np.int32)
+        self.pair_act = np.zeros(0, dtype=np.int32)
+
+        # the keys (i << 32 | j) of the pairs in sorted order, and their ids
+        self._keys = np.zeros(0, dtype=np.int64)
+        self._key_ids = np.zeros(0, dtype=np.int32)
+        self._indptr = None
+
+        self.intern_obs(obs)
+        self.intern_actions(actions)
+
+    # --------------------------------------------------------------------------
+    # interning
+    # --------------------------------------------------------------------------
+    def _reserve(self, n_pairs: int):
+        """
+        Makes sure the arrays have room for n_pairs pairs, doubling them when
+        they run out.
+        """
+        size = len(self.q)
+        if n_pairs <= size:
+            return
+
+        size = max(n_pairs, 2 * size)
+        for name in ("q", "known", "pair_obs", "pair_act"):
+            old = getattr(self, name)
+            new = np.zeros(size, dtype=old.dtype)
+            new[:len(old)] = old
+            setattr(self, name, new)
+
+    def intern_obs(self, obs: Iterable[tuple]) -> np.ndarray:
+        """
+        The ids of the observations, adding the ones that are new.
+        """
+        ids = [self._intern(o, self.obs, self.obs_index) for o in obs]
+        self._indptr = None
+        return np.array(ids, dtype=int)
+
+    def intern_actions(self, actions: Iterable[tuple]) -> np.ndarray:
+        """
+        The ids of the actions, adding the ones that are new.
+        """
+        return np.array([self._intern(a, self.actions, self.act_index) for a in actions], dtype=int)
+
+    @staticmethod
+    def _intern(key: tuple, keys: list, index: dict) -> int:
+        key = tuple(key)
+        i = index.get(key)
+        if i is None:
+            i = index[key] = len(keys)
+            keys.append(key)
+        return i
+
+    @staticmethod
+    def _key(I: np.ndarray, J: np.ndarray) -> np.ndarray:
+        return (np.asarray(I, dtype=np.int64) << 32) | np.asarray(J, dtype=np.int64)
+
+    def _lookup(self, keys: np.ndarray) -> np.ndarray:
+        if len(self._keys) == 0:
+            return np.full(len(keys), -1)
+        pos = np.minimum(np.searchsorted(self._keys, keys), len(self._keys) - 1)
+        return np.where(self._keys[pos] == keys, self._key_ids[pos], -1)
+
+    def pair_ids(self, I: np.ndarray, J: np.ndarray) -> np.ndarray:
+        """
+        The ids of the pairs (I[k], J[k]) of observation and action ids, or
+        -1 for the pairs that aren't stored.
+        """
+        return self._lookup(self._key(I, J))
+
+    def intern_pairs(self, I: np.ndarray, J: np.ndarray) -> np.ndarray:
+        """
+        The ids of the pairs (I[k], J[k]) of observation and action ids,
+        adding the ones that are new (as pairs that aren't known yet).
+        """
+        keys = self._key(I, J)
+        ids = self._lookup(keys)
+        new = np.unique(keys[ids < 0])
+        if len(new) == 0:
+            return ids
+
+        start, n = self.n_pairs, len(new)
+        self._reserve(start + n)
+        self.pair_obs[start:start + n] = new >> 32
+        self.pair_act[start:start + n] = new & 0xFFFFFFFF
+        self.n_pairs += n
+
+        pos = np.searchsorted(self._keys, new)
+        self._keys = np.insert(self._keys, pos, new)
+        self._key_ids = np.insert(self._key_ids, pos, np.arange(start, start + n, dtype=np.int32))
+        self._indptr = None
+        return self._lookup(keys)
+
+    # --------------------------------------------------------------------------
+    # the dict-like view, keyed by (o, a)
+    # --------------------------------------------------------------------------
+    def _pair(self, key: Tuple[tuple, tuple]) -> Union[int, None]:
+        o, a = key
+        i, j = self.obs_index.get(tuple(o)), self.act_index.get(tuple(a))
+        if i is None or j is None:
+            return None
+        p = self.pair_ids([i], [j])[0]
+        return None if p < 0 else int(p)
+
+    def __getitem__(self, key: Tuple[tuple, tuple]) -> float:
+        p = self._pair(key)
+        return 0.0 if p is None else self.q[p].item()
+
+    def __setitem__(self, key: Tuple[tuple, tuple], value: float):
+        o, a = key
+        p = self.intern_pairs(self.intern_obs([o]), self.intern_actions([a]))[0]
+        self.q[p] = value
+        self.known[p] = True
+
+    def __contains__(self, key: Tuple[tuple, tuple]) -> bool:
+        p = self._pair(key)
+        return p is not None and self.known[p].item()
+
+    def _known_ids(self) -> np.ndarray:
+        return np.flatnonzero(self.known[:self.n_pairs])
+
+    def __iter__(self):
+        for p in self._known_ids():
+            yield self.obs[self.pair_obs[p]], self.actions[self.pair_act[p]]
+
+    def __len__(self):
+        return int(self.known.sum())
+
+    def keys(self):
+        return iter(self)
+
+    def values(self) -> List[float]:
+        return self.q[self._known_ids()].tolist()
+
+    def items(self):
+        P = self._known_ids()
+        for (i, j, v) in zip(self.pair_obs[P], self.pair_act[P], self.q[P].tolist()):
+            yield (self.obs[i], self.actions[j]), v
+
+    def get(self, key: Tuple[tuple, tuple], default: float = 0.0) -> float:
+        return self[key] if key in self else default
+
+    @classmethod
+    def from_dict(cls, Q: dict, **kwargs) -> "QTable":
+        """
+        Builds a table from a dict keyed by (o, a).
+        """
+        out = cls(**kwargs)
+        keys = list(Q.keys())
+        P = out.intern_pairs(
+            out.intern_obs([o for (o, _) in keys]),
+            out.intern_actions([a for (_, a) in keys]),
+        )
+        out.q[P] = [Q[k] for k in keys]
+        out.known[P] = True
+        return out
+
+    def to_dict(self) -> dict:
+        return dict(self.items())
+
+    # --------------------------------------------------------------------------
+    # vectorized queries
+    # --------------------------------------------------------------------------
+    def obs_array(self) -> np.ndarray:
+        """
+        The observations as a (n_observations x n_fields) float array.
+        """
+        return np.array(self.obs, dtype=float)
+
+    def _rows(self) -> np.ndarray:
+        """
+        The row offsets of the observations in the sorted index: the pairs of
+        observation i are _key_ids[indptr[i]:indptr[i + 1]], by action.
+        """
+        if self._indptr is None:
+            self._indptr = np.searchsorted(self._keys >> 32, np.arange(len(self.obs) + 1))
+        return self._indptr
+
+    def row(self, i: int) -> np.ndarray:
+        """
+        The ids of the known pairs of observation i, by action id.
+        """
+        indptr = self._rows()
+        P = self._key_ids[indptr[i]:indptr[i + 1]]
+        return P[self.known[P]]
+
+    def action_ids(self, i: int) -> np.ndarray:
+        """
+        The ids of the actions stored for observation i, best first.
+        """
+        P = self.row(i)
+        order = np.argsort(-self.q[P], kind="stable")
+        return self.pair_act[P[order]]
+
+    def argmax(self, obs_ids: np.ndarray, valid: Union[np.ndarray, None] = None) -> np.ndarray:
+        """
+        The best stored action of each observation in obs_ids, optionally only
+        among the actions where valid (a boolean array of shape (len(obs_ids),
+        n_actions)) is true. Observations without any such action get -1.
+        """
+        obs_ids = np.asarray(obs_ids, dtype=int)
+        indptr = self._rows()
+        starts, ends = indptr[obs_ids], indptr[obs_ids + 1]
+
+        # every pair of every observation, tagged with its position in obs_ids
+        lengths = ends - starts
+        seg = np.repeat(np.arange(len(obs_ids)), lengths)
+        offsets = np.arange(lengths.sum()) - np.repeat(np.cumsum(lengths) - lengths, lengths)
+        P = self._key_ids[np.repeat(starts, lengths) + offsets]
+        J = self.pair_act[P]
+
+        mask = self.known[P]
+        if valid is not None:
+            mask &= valid[seg, J]
+        seg, P, J = seg[mask], P[mask], J[mask]
+
+        # the first pair of each observation, by decreasing value and then
+        # by action id
+        order = np.lexsort((J, -self.q[P], seg))
+        seg, J = seg[order], J[order]
+        first = np.flatnonzero(np.r_[True, seg[1:] != seg[:-1]]) if len(seg) else np.zeros(0, dtype=int)
+
+        out = np.full(len(obs_ids), -1)
+        out[seg[first]] = J[first]
+        return out
+
+    # --------------------------------------------------------------------------
+    # saving and loading
+    # --------------------------------------------------------------------------
+    def save(self, filename: str):
+        """
+        Saves the table as a compressed .npz: the observation and action
+        tuples as float arrays, and only the known entries.
+        """
+        P = self._known_ids()
+        np.savez_compressed(
+            filename,
+            obs=self.obs_array().reshape(len(self.obs), -1),
+            actions=np.array(self.actions, dtype=float).reshape(len(self.actions), -1),
+            i=self.pair_obs[P],
+            j=self.pair_act[P],
+            values=self.q[P],
+            obs_ordering=np.array(self.obs_ordering or [], dtype=str),
+            act_ordering=np.array(self.act_ordering or [], dtype=str),
+        )
+
+    @classmethod
+    def load(cls, filename: str) -> "QTable":
+        """
+        Loads a table that was saved with save, or converts one of the
+        pickled {"Q", "obs_ordering", "act_ordering"} dicts.
+        """
+        if not filename.endswith(".npz"):
+            data = load(open(filename, "rb"))
+            return cls.from_dict(
+                data["Q"],
+                obs_ordering=data.get("obs_ordering"),
+                act_ordering=data.get("act_ordering"),
+            )
+
+        data = np.load(filename)
+        out = cls(
+            map(tuple, data["obs"].tolist()),
+            map(tuple, data["actions"].tolist()),
+            obs_ordering=data["obs_ordering"].tolist() or None,
+            act_ordering=data["act_ordering"].tolist() or None,
+        )
+        P = out.intern_pairs(data["i"], data["j"])
+        out.q[P] = data["values"]
+        out.known[P] = True
+        return out
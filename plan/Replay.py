@@ -0,0 +1,269 @@
+"""
+File: Replay.py
+---------------
+
+This file implements experience replay for the offline learners: a sum tree
+over the priorities of the stored transitions, which samples and updates them
+in O(log n), a capped replay buffer on top of it that's prioritized by TD
+error, and BatchSource, which interleaves fresh and replayed batches the way
+that every learner does.
+"""
+import numpy as np
+from typing import Callable, Tuple, Union
+
+from env import get_rng
+
+
+class SumTree:
+    """
+    A complete binary tree over capacity leaves (rounded up to a power of 2)
+    where every node holds the sum of the priorities below it, stored as an
+    array with the root at 1 and the children of node i at 2i and 2i + 1. All
+    of the operations work on arrays of leaves at once.
+    """
+
+    def __init__(self, capacity: int):
+        self.size = 1 << max(int(capacity) - 1, 0).bit_length()
+        self.tree = np.zeros(2 * self.size)
+
+    @property
+    def total(self) -> float:
+        return self.tree[1].item()
+
+    def __getitem__(self, leaves: np.ndarray) -> np.ndarray:
+        return self.tree[self.size + np.asarray(leaves)]
+
+    def update(self, leaves: np.ndarray, priorities: np.ndarray):
+        """
+        Sets the priorities of the leaves and recomputes the sums above them.
+        """
+        nodes = self.size + np.asarray(leaves, dtype=int)
+        self.tree[nodes] = priorities
+        while len(nodes) and nodes[0] > 1:
+            nodes = np.unique(nodes // 2)
+            self.tree[nodes] = self.tree[2 * nodes] + self.tree[2 * nodes + 1]
+
+    def find(self, u: np.ndarray) -> np.ndarray:
+        """
+        The leaves where the running sum of the priorities passes u, for
+        every u in [0, total).
+        """
+        u = np.array(u, dtype=float)
+        nodes = np.ones(len(u), dtype=int)
+        while nodes[0] < self.size:
+            left = self.tree[2 * nodes]
+            right = u >= left
+            u -= np.where(right, left, 0)
+            nodes = 2 * nodes + right
+
+        # rounding can step past the last leaf with any priority
+        leaves = nodes - self.size
+        empty = self.tree[nodes] <= 0
+        if np.any(empty):
+            leaves[empty] = np.flatnonzero(self.tree[self.size:] > 0)[-1]
+        return leaves
+
+    def sample(self, n: int, rng: np.random.Generator) -> np.ndarray:
+        """
+        Draws n leaves with probability proportional to their priorities,
+        one from each of n equal slices of the total.
+        """
+        u = (np.arange(n) + rng.random(n)) * (self.total / n)
+        return self.find(np.minimum(u, np.nextafter(self.total, 0)))
+
+
+class PrioritizedReplay:
+    """
+    A replay buffer of up to capacity transitions that are sampled with
+    probability proportional to (|TD error| + eps) ** alpha. Once it's full,
+    new transitions replace the oldest ones.
+
+    A transition is any tuple of values (e.g. a row of the data, or its
+    ids), added as a tuple of arrays with one entry per transition.
+    Sampling also gives the importance sampling weights
+    (N * P(i)) ** -beta / max_j (N * P(j)) ** -beta, which undo the bias of
+    not sampling uniformly.
+
+    params
+    ------
+    capacity: int
+        the most transitions to keep
+    alpha: float
+        how strongly to prioritize (0 is uniform)
+    beta: float
+        how much of the bias to correct (1 is all of it)
+    eps: float
+        keeps transitions with no error in the running
+    """
+
+    def __init__(
+        self,
+        capacity: int = 100_000,
+        alpha: float = 0.6,
+        beta: float = 0.4,
+        eps: float = 1e-3,
+    ):
+        self.capacity = capacity
+        self.alpha = alpha
+        self.beta = beta
+        self.eps = eps
+        self.tree = SumTree(capacity)
+        self.items = None
+        self.n = 0
+        self.next = 0
+
+    def __len__(self):
+        return self.n
+
+    def priority(self, errors: np.ndarray) -> np.ndarray:
+        return (np.abs(errors) + self.eps) ** self.alpha
+
+    def add(self, items: tuple, errors: np.ndarray):
+        """
+        Adds transitions, given as a tuple of arrays, with their TD errors.
+        """
+        k = len(items[0])
+        if self.items is None:
+            self.items = tuple(
+                np.zeros((self.capacity,) + np.shape(x)[1:], dtype=np.asarray(x).dtype)
+                for x in items
+            )
+
+        # the oldest slots are overwritten first (only the last capacity of
+        # the transitions are kept, if there are more)
+        slots = (self.next + np.arange(k)) % self.capacity
+        keep = slice(max(k - self.capacity, 0), k)
+        for store, x in zip(self.items, items):
+            store[slots[keep]] = np.asarray(x)[keep]
+        self.tree.update(slots[keep], self.priority(np.asarray(errors)[keep]))
+
+        self.next = (self.next + k) % self.capacity
+        self.n = min(self.n + k, self.capacity)
+
+    def sample(
+        self,
+        n: int,
+        rng: Union[np.random.Generator, None] = None
+    ) -> Tuple[np.ndarray, tuple, np.ndarray]:
+        """
+        Samples n transitions.
+
+        returns
+        -------
+        slots: np.ndarray
+            where the transitions are stored, to update their errors with
+        items: tuple
+            the transitions, as a tuple of arrays
+        weights: np.ndarray
+            their importance sampling weights
+        """
+        rng = get_rng(rng)
+        slots = self.tree.sample(n, rng)
+
+        p = self.tree[slots] / self.tree.total
+        weights = (self.n * p) ** -self.beta
+        weights /= weights.max()
+
+        return slots, tuple(store[slots] for store in self.items), weights
+
+    def update(self, slots: np.ndarray, errors: np.ndarray):
+        """
+        Sets the TD errors of the transitions in slots. A slot that was
+        sampled more than once keeps its last error.
+        """
+        self.tree.update(slots, self.priority(errors))
+
+
+class BatchSource:
+    """
+    The batches that the offline learners train on. Batch i is a replayed one
+    when i is a multiple of replay_every (and there's something to replay),
+    and a fresh one from draw() otherwise. A batch is a tuple of arrays with
+    one entry per row (e.g. the row ids in the data, or (sa, spa, r)).
+
+    Without a PrioritizedReplay, the replayed batch is an old fresh batch
+    chosen uniformly. Only a reservoir sample of max_batches of the fresh
+    batches is kept, if max_batches is given: once it's full, fresh batch n
+    replaces a random one with probability max_batches / n, so what's kept
+    stays a uniform sample of every fresh batch so far.
+
+    With a PrioritizedReplay, the rows of the fresh batches go into it along
+    with their TD errors (see record), and the replayed batches are drawn
+    from it by TD error, with importance sampling weights.
+
+    params
+    ------
+    draw: Callable
+        returns a fresh batch
+    batch_size: int
+        the number of rows in a batch
+    replay_every: int
+        how often to replay a batch
+    rng: np.random.Generator
+        the generator that the replayed batches are chosen with
+    replay: PrioritizedReplay
+        the buffer to replay from, for prioritized replay
+    max_batches: int
+        the most old batches to keep for uniform replay
+    """
+
+    def __init__(
+        self,
+        draw: Callable[[], tuple],
+        batch_size: int,
+        replay_every: int,
+        rng: np.random.Generator,
+        replay: Union[PrioritizedReplay, None] = None,
+        max_batches: Union[int, None] = None,
+    ):
+        self.draw = draw
+        self.batch_size = batch_size
+        self.replay_every = replay_every
+        self.rng = rng
+        self.replay = replay
+        self.max_batches = max_batches
+        self.batches = []
+        self.n_fresh = 0
+        self._fresh = None
+        self._slots = None
+
+    def _can_replay(self) -> bool:
+        return len(self.batches if self.replay is None else self.replay) > 0
+
+    def next(self, i: int) -> Tuple[tuple, Union[np.ndarray, None]]:
+        """
+        Batch i, along with the importance sampling weights of its rows (None
+        unless it was replayed from a PrioritizedReplay).
+        """
+        self._fresh = self._slots = None
+        if i % self.replay_every == 0 and self._can_replay():
+            if self.replay is None:
+                # replay an old batch
+                return self.batches[self.rng.integers(len(self.batches))], None
+
+            # replay the rows with the largest errors
+            self._slots, sample, weights = self.replay.sample(self.batch_size, self.rng)
+            return sample, weights
+
+        sample = self._fresh = self.draw()
+        if self.replay is None:
+            self.n_fresh += 1
+            if self.max_batches is None or len(self.batches) < self.max_batches:
+                self.batches.append(sample)
+            else:
+                k = self.rng.integers(self.n_fresh)
+                if k < self.max_batches:
+                    self.batches[k] = sample
+        return sample, None
+
+    def record(self, td: np.ndarray):
+        """
+        Records the TD errors of the rows of the last batch, for prioritized
+        replay.
+        """
+        if self.replay is None:
+            return
+        if self._slots is None:
+            self.replay.add(self._fresh, td)
+        else:
+            self.replay.update(self._slots, td)
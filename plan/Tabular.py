@@ -0,0 +1,488 @@
+"""
+File: Tabular.py
+----------------
+
+This file compiles the Teacher POMDP into tabular form (by discretizing mh,
+prod and g onto a grid) and implements exact solvers over the resulting
+tensors: value iteration, QMDP and point-based value iteration (PBVI).
+"""
+import numpy as np
+from scipy import sparse
+from typing import List, Tuple
+
+from env.Teacher import Teacher
+from env import (
+    AlphaVectorUtility,
+    TeacherAction,
+    TeacherObservation,
+    TeacherStateBatch,
+    TeacherActionBatch,
+    get_rng,
+)
+
+
+def teacher_action_grid(step: int = 10) -> List[TeacherAction]:
+    """
+    Every split of the teacher's time between rest, grading and pd in
+    multiples of 1 / step. With step = 10 these are the 66 actions of the deep
+    Q teacher.
+    """
+    return [
+        TeacherAction(r / step, g / step, (step - r - g) / step)
+        for r in range(step + 1)
+        for g in range(step + 1 - r)
+    ]
+
+
+def kuhn_weights(grids: Tuple[np.ndarray, ...], X: Tuple[np.ndarray, ...]) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Interpolates the points X (one array per dimension) on the grids with the
+    Kuhn triangulation: every point is written as a convex combination of
+    the d + 1 vertices of the simplex of its grid cell that contains it, so
+    a point between grid points keeps its position in expectation instead of
+    snapping to the nearest one.
+
+    returns
+    -------
+    idx: np.ndarray
+        (d + 1, n, d) grid indices of the vertices of each point
+    weights: np.ndarray
+        (d + 1, n) their interpolation weights
+    """
+    lo, frac = [], []
+    for (grid, x) in zip(grids, X):
+        i = np.clip(np.searchsorted(grid, x, side="right") - 1, 0, max(len(grid) - 2, 0))
+        hi = np.minimum(i + 1, len(grid) - 1)
+        width = np.where(hi > i, grid[hi] - grid[i], 1)
+        lo.append(i)
+        frac.append(np.clip((x - grid[i]) / width, 0, 1) * (hi > i))
+    lo, frac = np.stack(lo, axis=-1), np.stack(frac, axis=-1)
+    n, d = frac.shape
+
+    # walk from the lower corner, stepping up the dimensions in order of
+    # decreasing fractional part
+    order = np.argsort(-frac, axis=1, kind="stable")
+    f = np.take_along_axis(frac, order, axis=1)
+    f = np.hstack([np.ones((n, 1)), f, np.zeros((n, 1))])
+    weights = (f[:, :-1] - f[:, 1:]).T
+
+    # (a grid with a single point never steps up; its weight is 0)
+    top = np.array([len(grid) - 1 for grid in grids])
+    idx = np.empty((d + 1, n, d), dtype=int)
+    idx[0] = lo
+    step = np.zeros((n, d), dtype=int)
+    for k in range(d):
+        np.put_along_axis(step, order[:, k:k + 1], 1, axis=1)
+        idx[k + 1] = np.minimum(lo + step, top)
+    return idx, weights
+
+
+class TabularTeacher:
+    """
+    The Teacher POMDP over a finite grid of states. A state is a grid point
+    (mh, prod, g) together with a free time in 0-7 and a number of assignments
+    in 0-max_assignments, and state i is at position i of the raveled array of
+    shape (len(mh_grid), len(prod_grid), len(g_grid), 8, max_assignments + 1).
+
+    An observation is a (free time, number of assignments) pair, numbered the
+    same way, so the observation of state i is i % n_observations.
+
+    attributes
+    ----------
+    states: TeacherStateBatch
+        the grid states, in order
+    actions: list
+        the actions
+    T: list
+        T[a] is the sparse (n_states x n_states) transition matrix of action a
+    Z: sparse matrix
+        the (n_states x n_observations) observation matrix, which is the same
+        for every action
+    R: np.ndarray
+        R[s, a] is the expected reward of taking action a in state s
+    """
+
+    def __init__(
+        self,
+        model: Teacher,
+        mh_grid: np.ndarray,
+        prod_grid: np.ndarray,
+        g_grid: np.ndarray,
+        max_assignments: int,
+        actions: List[TeacherAction],
+        dense: bool = False,
+    ):
+        self.model = model
+        self.discount = model.discount
+        self.grids = (np.asarray(mh_grid), np.asarray(prod_grid), np.asarray(g_grid))
+        self.max_assignments = max_assignments
+        self.actions = actions
+        self.action_index = {a: i for (i, a) in enumerate(actions)}
+
+        self.shape = tuple(len(grid) for grid in self.grids) + (8, max_assignments + 1)
+        self.n_states = int(np.prod(self.shape))
+        self.n_observations = 8 * (max_assignments + 1)
+
+        # every state on the grid
+        mh, prod, g, ft, na = np.meshgrid(
+            *self.grids, np.arange(8), np.arange(max_assignments + 1), indexing="ij"
+        )
+        self.states = TeacherStateBatch(
+            mh=mh.ravel(), prod=prod.ravel(), g=g.ravel(),
+            free_time=ft.ravel(), num_assignments=na.ravel()
+        )
+
+        self.T, self.R = self._compile_dynamics()
+        self.Z = sparse.csr_matrix((
+            np.ones(self.n_states),
+            (np.arange(self.n_states), np.arange(self.n_states) % self.n_observations)
+        ), shape=(self.n_states, self.n_observations))
+
+        if dense:
+            self.T = [T.toarray() for T in self.T]
+            self.Z = self.Z.toarray()
+
+    def _compile_dynamics(self) -> Tuple[list, np.ndarray]:
+        """
+        Builds the transition matrices and the reward table, one action at a
+        time over every state at once. The next (mh, prod, g) is spread over
+        the vertices of its grid simplex with kuhn_weights (the steps of the
+        Teacher are much smaller than the grid spacing, so snapping them to
+        the nearest grid point would undo them) and the free time is uniform
+        over 0-7, as in Teacher.transition.
+        """
+        S = self.states
+        n_obs = self.n_observations
+        T, R = [], np.zeros((self.n_states, len(self.actions)))
+
+        for (i, a) in enumerate(self.actions):
+            A = TeacherActionBatch.from_items([a])
+            mh, prod, g, na = self.model._batch_next_fields(S, A)
+            idx, weights = kuhn_weights(self.grids, (mh, prod, g))
+
+            # the index of each next state with a free time of 0...
+            hidden = np.ravel_multi_index(tuple(np.moveaxis(idx, -1, 0)), self.shape[:3])
+            na = np.minimum(na, self.max_assignments)
+            base = hidden * n_obs + na
+
+            # ...and the 8 free times that it can have
+            cols = base[..., None] + np.arange(8) * (self.max_assignments + 1)
+            rows = np.broadcast_to(np.arange(self.n_states)[:, None], cols.shape)
+            data = np.broadcast_to(weights[..., None] / 8, cols.shape)
+            keep = data > 0
+            T.append(sparse.csr_matrix(
+                (data[keep], (rows[keep], cols[keep])),
+                shape=(self.n_states, self.n_states)
+            ))
+            R[:, i] = self.model.batch_reward_state(S, A)
+
+        return T, R
+
+    def observation_index(self, o: TeacherObservation) -> int:
+        return o.free_time * (self.max_assignments + 1) + min(o.num_assignments, self.max_assignments)
+
+    def initial_belief(self, o: TeacherObservation) -> np.ndarray:
+        """
+        The belief that's uniform over the grid points for mh, prod and g, and
+        certain of the observed free time and number of assignments.
+        """
+        b = np.zeros(self.n_states)
+        b[self.observation_index(o)::self.n_observations] = 1
+        return b / b.sum()
+
+    def update(self, b: np.ndarray, a: TeacherAction, o: TeacherObservation) -> np.ndarray:
+        """
+        The exact belief update after taking action a and observing o. If the
+        model gives o no probability (e.g. new assignments arrived, which the
+        Teacher model doesn't predict), the predicted beliefs over (mh, prod,
+        g) are kept and the rest is taken from o.
+        """
+        return self.update_index(b, self.action_index[a], self.observation_index(o))
+
+    def update_index(self, b: np.ndarray, a: int, k: int) -> np.ndarray:
+        """
+        update, for the action with index a and the observation with index k.
+        """
+        predicted = self.T[a].T @ b
+
+        # the states that are consistent with o are every n_observations-th
+        bp = np.zeros(self.n_states)
+        bp[k::self.n_observations] = predicted[k::self.n_observations]
+        if bp.sum() > 0:
+            return bp / bp.sum()
+
+        hidden = predicted.reshape(-1, self.n_observations).sum(axis=1)
+        bp = np.zeros(self.n_states)
+        bp[k::self.n_observations] = hidden
+        return bp
+
+
+def compile_teacher(
+    model: Teacher = None,
+    n_mh: int = 5,
+    n_prod: int = 5,
+    n_g: int = 5,
+    max_assignments: int = 20,
+    actions: List[TeacherAction] = None,
+    dense: bool = False,
+) -> TabularTeacher:
+    """
+    Compiles the Teacher POMDP onto an evenly spaced grid.
+
+    params
+    ------
+    model: Teacher
+        the model to compile (a new Teacher by default)
+    n_mh, n_prod, n_g: int
+        the number of grid points for mh (over [-1, 1]), prod and g (over
+        [0, 1])
+    max_assignments: int
+        the largest number of outstanding assignments that's tracked; larger
+        numbers are treated as this one
+    actions: list
+        the actions (the 66 of teacher_action_grid by default)
+    dense: bool
+        whether to store T and Z as dense arrays instead of sparse matrices;
+        on the default grid that's 66 dense 21000 x 21000 matrices (about
+        230 GB), so it's only meant for small grids
+
+    returns
+    -------
+    tab: TabularTeacher
+        the compiled model
+    """
+    return TabularTeacher(
+        Teacher() if model is None else model,
+        np.linspace(-1, 1, n_mh),
+        np.linspace(0, 1, n_prod),
+        np.linspace(0, 1, n_g),
+        max_assignments,
+        teacher_action_grid() if actions is None else actions,
+        dense,
+    )
+
+
+def value_iteration(
+    tab: TabularTeacher,
+    tol: float = 1e-6,
+    max_iter: int = 10_000,
+    verbose: bool = False,
+) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Runs value iteration on the fully observable version of the compiled
+    model, backing up every state and action in one sparse matrix product
+    per iteration.
+
+    params
+    ------
+    tab: TabularTeacher
+        the compiled model
+    tol: float
+        stop once the utilities change by less than this
+    max_iter: int
+        the maximum number of iterations
+
+    returns
+    -------
+    U: np.ndarray
+        the utility of each state
+    Q: np.ndarray
+        Q[s, a], the action values
+    """
+    # every action's transitions stacked into one (n_actions * n_states) x
+    # n_states matrix
+    stacked = sparse.vstack(tab.T, format="csr") if sparse.issparse(tab.T[0]) else np.vstack(tab.T)
+    n_actions = len(tab.actions)
+
+    U = np.zeros(tab.n_states)
+    for i in range(max_iter):
+        Q = tab.R + tab.discount * (stacked @ U).reshape(n_actions, tab.n_states).T
+        U_new = Q.max(axis=1)
+        delta = np.abs(U_new - U).max()
+        U = U_new
+
+        if verbose:
+            print(f"iteration {i}: delta = {delta}")
+        if delta < tol:
+            break
+
+    return U, Q
+
+
+def qmdp(tab: TabularTeacher, **kwargs) -> AlphaVectorUtility:
+    """
+    The QMDP utility, with one alpha vector per action: alpha[a] = Q[:, a]
+    from value iteration.
+    """
+    _, Q = value_iteration(tab, **kwargs)
+    return AlphaVectorUtility(Q.T.copy(), tab.actions)
+
+
+def sample_beliefs(
+    tab: TabularTeacher,
+    n: int,
+    depth: int = 10,
+    rng: np.random.Generator = None,
+) -> np.ndarray:
+    """
+    Samples a belief set by following random trajectories in the compiled
+    model: each one starts from the initial belief of a random observation
+    and takes random actions, sampling the observations from the belief.
+
+    returns
+    -------
+    B: np.ndarray
+        the n beliefs, with shape (n, n_states)
+    """
+    rng = get_rng(rng)
+    B = []
+    while len(B) < n:
+        k = rng.integers(tab.n_observations)
+        b = np.zeros(tab.n_states)
+        b[k::tab.n_observations] = 1
+        b /= b.sum()
+        B.append(b)
+
+        for _ in range(depth):
+            if len(B) >= n:
+                break
+            a = rng.integers(len(tab.actions))
+            obs_prob = (tab.T[a].T @ b).reshape(-1, tab.n_observations).sum(axis=0)
+            k = rng.choice(tab.n_observations, p=obs_prob / obs_prob.sum())
+            b = tab.update_index(b, a, k)
+            B.append(b)
+
+    return np.array(B)
+
+
+def backup(
+    tab: TabularTeacher,
+    B: np.ndarray,
+    alphas: np.ndarray,
+) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    The point-based Bellman backup of the alpha vectors at every belief in B,
+    with one matrix product (over every belief and vector) per action and
+    observation.
+
+    For belief b and action a, the best vector after observation o is the
+    one that maximizes b @ T[a] @ diag(Z[:, o]) @ alpha, and the backed up
+    vector is R[:, a] + discount * T[a] @ (sum over o of Z[:, o] * that
+    vector). Each belief keeps the backed up vector of its best action.
+
+    params
+    ------
+    tab: TabularTeacher
+        the compiled model
+    B: np.ndarray
+        the beliefs, with shape (m, n_states)
+    alphas: np.ndarray
+        the current alpha vectors, with shape (K, n_states)
+
+    returns
+    -------
+    alphas: np.ndarray
+        the new vector of every belief, with shape (m, n_states)
+    actions: np.ndarray
+        the index of each new vector's action
+    """
+    Z = sparse.coo_matrix(tab.Z)
+    m, K = len(B), len(alphas)
+
+    # the states that can produce each observation, with their probabilities
+    Zc = sparse.csc_matrix(tab.Z)
+    support = [
+        (Zc.indices[Zc.indptr[o]:Zc.indptr[o + 1]], Zc.data[Zc.indptr[o]:Zc.indptr[o + 1]])
+        for o in range(tab.n_observations)
+    ]
+    alphas_o = [alphas[:, idx] for (idx, _) in support]
+
+    # sums the (belief, nonzero of Z) terms into (belief, state)
+    rows = sparse.csr_matrix(
+        (Z.data, (np.arange(Z.nnz), Z.row)), shape=(Z.nnz, tab.n_states)
+    )
+
+    best_value = np.full(m, -np.inf)
+    out = np.zeros((m, tab.n_states))
+    out_actions = np.zeros(m, dtype=int)
+    for (a, T) in enumerate(tab.T):
+        # the predicted next states from each belief
+        predicted = np.asarray((T.T @ B.T).T)
+
+        # the best vector for each (belief, observation), by the value of
+        # every vector after the observation, one matrix product per
+        # observation
+        best = np.zeros((m, tab.n_observations), dtype=int)
+        for (o, (idx, z)) in enumerate(support):
+            if len(idx):
+                best[:, o] = ((predicted[:, idx] * z) @ alphas_o[o].T).argmax(axis=1)
+
+        # G[b, sp] = sum over o of Z[sp, o] * alphas[best[b, o], sp]
+        G = (rows.T @ alphas[best[:, Z.col], Z.row].T).T
+        new = tab.R[:, a][None, :] + tab.discount * np.asarray((T @ G.T).T)
+
+        # keep each belief's best action
+        value = np.einsum("ij,ij->i", new, B)
+        better = value > best_value
+        out[better] = new[better]
+        out_actions[better] = a
+        best_value[better] = value[better]
+
+    return out, out_actions
+
+
+def pbvi(
+    tab: TabularTeacher,
+    B: np.ndarray = None,
+    n_beliefs: int = 100,
+    n_iter: int = 50,
+    tol: float = 1e-4,
+    rng: np.random.Generator = None,
+    verbose: bool = False,
+) -> AlphaVectorUtility:
+    """
+    Point-based value iteration over a belief set: starting from a lower
+    bound, the alpha vectors are backed up at every belief until their values
+    at the beliefs stop changing.
+
+    params
+    ------
+    tab: TabularTeacher
+        the compiled model
+    B: np.ndarray
+        the beliefs to back up at, with shape (m, n_states); sampled with
+        sample_beliefs by default
+    n_beliefs: int
+        the number of beliefs to sample, if B isn't given
+    n_iter: int
+        the maximum number of backups
+    tol: float
+        stop once the values at the beliefs change by less than this
+
+    returns
+    -------
+    U: AlphaVectorUtility
+        the utility, with one alpha vector per belief
+    """
+    if B is None:
+        B = sample_beliefs(tab, n_beliefs, rng=rng)
+
+    # the value of always getting the smallest reward is a lower bound
+    alphas = np.full((1, tab.n_states), tab.R.min() / (1 - tab.discount))
+    actions = np.zeros(1, dtype=int)
+    values = (B @ alphas.T).max(axis=1)
+
+    for i in range(n_iter):
+        alphas, actions = backup(tab, B, alphas)
+        new_values = np.einsum("ij,ij->i", alphas, B)
+        delta = np.abs(new_values - values).max()
+        values = new_values
+
+        if verbose:
+            print(f"iteration {i}: delta = {delta}")
+        if delta < tol:
+            break
+
+    # beliefs that ended up with the same vector only need it once
+    alphas, idx = np.unique(alphas, axis=0, return_index=True)
+    return AlphaVectorUtility(alphas, [tab.actions[a] for a in actions[idx]])
@@ -1,4 +1,3 @@
-from random import random
 import numpy as np
 
 from env import (
@@ -6,16 +5,18 @@ from env import (
     TeacherObservation,
     StudentObservation,
     StudentAction,
-    TeacherAction
+    TeacherAction,
+    get_rng
 )
 
 
 class StudentAlwaysWork(MemorylessPolicy):
-    def __init__(self, submit_thresh: float = 0.3):
+    def __init__(self, submit_thresh: float = 0.3, rng: np.random.Generator = None):
         self.submit_thresh = submit_thresh
+        self.rng = get_rng(rng)
 
     def action(self, o: StudentObservation):
-        if o.num_assignments > 0 and random() < self.submit_thresh:
+        if o.num_assignments > 0 and self.rng.random() < self.submit_thresh:
             return StudentAction(submit=True)
 
         return StudentAction(rest=0, work=1)
@@ -1,7 +1,7 @@
-from env import MemorylessPolicy, Observation, Action
-from collections import defaultdict
+import numpy as np
+from env import MemorylessPolicy, Observation, Action, get_rng
 from sklearn.neighbors import KDTree
-from pickle import load
+from plan.QTable import QTable
 from .RandomPolicy import rand_action
 
 
@@ -13,20 +13,16 @@ class QPolicy(MemorylessPolicy):
         act_ordering: list,
         act_class: type(Action),
         q_thresh: float = 1e2,
-        is_valid: callable = lambda o, a: True
+        is_valid: callable = lambda o, a: True,
+        rng: np.random.Generator = None
     ):
+        if not isinstance(Q, QTable):
+            Q = QTable.from_dict(Q)
         self.Q = Q
 
-        # extract the states and actions from the Q table
-        stored_actions = defaultdict(list)
-        stored_obs = []
-        for (o, a) in Q:
-            stored_actions[o].append(a)
-            stored_obs.append(o)
-
-        # build a KDTree for the states
-        self.tree = KDTree(stored_obs)
-        self.stored_actions = stored_actions
+        # build a KDTree for the states, where the index of each point is its
+        # id in the Q table
+        self.tree = KDTree(Q.obs_array())
         self.q_thresh = q_thresh
 
         # store the orderings to turn the observations and actions into tuples
@@ -35,6 +31,9 @@ class QPolicy(MemorylessPolicy):
         self.act_class = act_class
         self.is_valid = is_valid
 
+        # the generator for the random actions
+        self.rng = get_rng(rng)
+
         # store statistics
         self.num_rand = 0
         self.num_q = 0
@@ -47,21 +46,13 @@ class QPolicy(MemorylessPolicy):
 
         # get the nearest neighbor
         dist, idx = self.tree.query([o], k=1)
-        o_nbr = tuple(self.tree.data[idx[0][0]])
+        o_nbr = idx[0][0]
 
         # if we're close enough, take the action with the highest Q value
         if dist[0][0] < self.q_thresh:
-            possible_actions = self.stored_actions[o_nbr]
-
-            # get the action with the highest Q value
-            possible_actions = sorted(
-                possible_actions,
-                key=lambda a: self.Q[(o_nbr, a)],
-                reverse=True
-            )
-            # go in order until we find a valid action
-            for a in possible_actions:
-                a = tuple(v if v != 1e9 else None for v in a)
+            # go in order of Q value until we find a valid action
+            for j in self.Q.action_ids(o_nbr):
+                a = tuple(v if v != 1e9 else None for v in self.Q.actions[j])
                 a = self.act_class(**dict(zip(self.act_ordering, a)))
 
                 if not a.is_valid(o_raw, a):
@@ -72,14 +63,14 @@ class QPolicy(MemorylessPolicy):
 
         # otherwise, or if there are no valid actions, take a random action
         self.num_rand += 1
-        return rand_action(o_raw, self.act_class)
+        return rand_action(o_raw, self.act_class, self.rng)
 
 
 def load_qpolicy(filename: str, act_class: type(Action)):
-    data = load(open(filename, "rb"))
+    Q = QTable.load(filename)
     return QPolicy(
-        data["Q"],
-        data["obs_ordering"],
-        data["act_ordering"],
+        Q,
+        Q.obs_ordering,
+        Q.act_ordering,
         act_class
     )
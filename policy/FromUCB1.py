@@ -1,9 +1,10 @@
 from math import log, sqrt
 from numpy import argmax
-from env import MemorylessPolicy, Observation, Action
+import numpy as np
+from env import MemorylessPolicy, Observation, Action, get_rng
 from collections import defaultdict
 from sklearn.neighbors import KDTree
-from pickle import load
+from plan.QTable import QTable
 from .RandomPolicy import rand_action
 
 
@@ -18,7 +19,10 @@ class UCB1Policy(MemorylessPolicy):
         o_counter: defaultdict = None,
         o_a_counter: defaultdict = None,
         c: int = 2,
+        rng: np.random.Generator = None,
     ):
+        if not isinstance(Q, QTable):
+            Q = QTable.from_dict(Q)
         self.Q = Q
         self.c = c
         if o_counter is None:
@@ -30,21 +34,15 @@ class UCB1Policy(MemorylessPolicy):
         self.o_counter = o_counter
         self.o_a_counter = o_a_counter
 
-        # extract the states and actions from the Q table
-        stored_actions = defaultdict(list)
-        stored_obs = []
-        for (o, a) in Q:
-            stored_actions[o].append(a)
-            stored_obs.append(o)
-
-        self.stored_actions = stored_actions
-
         # store the orderings to turn the observations and actions into tuples
         self.obs_ordering = obs_ordering
         self.act_ordering = act_ordering
         self.act_class = act_class
         self.is_valid = is_valid
 
+        # the generator for the random actions
+        self.rng = get_rng(rng)
+
         # store statistics
         self.num_rand = 0
         self.num_q = 0
@@ -60,18 +58,20 @@ class UCB1Policy(MemorylessPolicy):
         o = tuple(o_list)
         o = tuple(v if v is not None else 1e9 for v in o)
         self.o_counter[o] += 1
-        action_space = self.stored_actions[o]
+        i = self.Q.obs_index.get(o)
+        action_space = self.Q.row(i) if i is not None else []
         next_action = {}
-        for a in action_space:
+        for p in action_space:
+            a = self.Q.actions[self.Q.pair_act[p]]
             if self.o_a_counter[(o, a)] == 0:
                 b = float('inf')
             else:
-                b = self.Q[(o, a)] + self.c * sqrt(log(self.o_counter[o]) / self.o_a_counter[(o, a)])
+                b = self.Q.q[p] + self.c * sqrt(log(self.o_counter[o]) / self.o_a_counter[(o, a)])
             next_action[a] = b
         # if there are no valid actions in action space, return random action
         if len(next_action) == 0:
             self.num_rand += 1
-            return rand_action(o_raw, self.act_class)
+            return rand_action(o_raw, self.act_class, self.rng)
         a_max = max(next_action, key=next_action.get)
         self.o_a_counter[(o, a_max)] += 1
         a_max = tuple(v if v != 1e9 else None for v in a_max)
@@ -80,10 +80,10 @@ class UCB1Policy(MemorylessPolicy):
 
 
 def load_ucb1_policy(filename: str, act_class: type(Action)):
-    data = load(open(filename, "rb"))
+    Q = QTable.load(filename)
     return UCB1Policy(
-        data["Q"],
-        data["obs_ordering"],
-        data["act_ordering"],
+        Q,
+        Q.obs_ordering,
+        Q.act_ordering,
         act_class
     )
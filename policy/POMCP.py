@@ -0,0 +1,289 @@
+import numpy as np
+from math import log, sqrt
+from time import perf_counter
+from typing import Callable, Hashable, List, Tuple
+from weakref import WeakKeyDictionary
+
+from env import (
+    POMDP,
+    Policy,
+    MemorylessPolicy,
+    HistoryView,
+    State,
+    Action,
+    Observation,
+    StudentState,
+    StudentAction,
+    StudentObservation,
+    TeacherState,
+    TeacherAction,
+    TeacherObservation,
+    get_rng
+)
+
+
+class Node:
+    """
+    A node of the search tree, for the history that ends in observation o.
+    It keeps the states that the simulations passed through at this history
+    (its particle belief) and, for every action, the visit count, the value
+    estimate, and the children by observation key (see observation_key).
+    """
+    __slots__ = ("o", "n", "particles", "N", "Q", "children")
+
+    def __init__(self, o: Observation):
+        self.o = o
+        self.n = 0
+        self.particles: List[State] = []
+        self.N: dict[Action, int] = {}
+        self.Q: dict[Action, float] = {}
+        self.children: dict[Action, dict[Hashable, "Node"]] = {}
+
+
+def observation_key(o: Observation, grade_step: float = 10) -> Hashable:
+    """
+    The key that the children of a node are stored under, so that
+    observations that only differ by noise share a node. Student grades are
+    continuous, so they're binned to the nearest multiple of grade_step;
+    every other observation is its own key.
+    """
+    if isinstance(o, StudentObservation):
+        grade = o.assignment_grade
+        return (
+            None if grade is None else round(grade / grade_step),
+            o.free_time, o.num_assignments
+        )
+    return o
+
+
+class UniformPolicy(MemorylessPolicy):
+    """
+    Picks one of the available actions uniformly at random; the default
+    rollout policy.
+    """
+
+    def __init__(self, actions: Callable[[Observation], List[Action]], rng: np.random.Generator = None):
+        self.actions = actions
+        self.rng = get_rng(rng)
+
+    def action(self, o: Observation):
+        A = self.actions(o)
+        return A[self.rng.integers(len(A))]
+
+
+class POMCPPolicy(Policy):
+    """
+    An online planner that runs Monte Carlo tree search over action-observation
+    histories (POMCP). Every decision runs simulations from states sampled
+    from the particle belief at the root, picks actions in the tree with UCB1,
+    steps with the model's generative model and evaluates new leaves with
+    POMDP.rollout. It then takes the action with the highest value estimate.
+
+    The search stops after max_sims simulations or max_time seconds, whichever
+    comes first (either can be None, but not both).
+
+    When it's given HistoryViews (as in simulate), the tree is kept between
+    decisions, one per History: the next day's root is the subtree for the
+    action that was taken and the observation that came back, along with the
+    particles that the earlier simulations left there. The subtrees are found
+    by observation_key, so an observed grade reuses the subtree of the
+    simulated grades in its bin. If that observation was never simulated (or
+    left no particles), the root starts over from prior. One policy can
+    therefore plan for every student of a classroom.
+
+    params:
+        model -- the POMDP to plan with
+        actions -- returns the actions that are available after observation o
+        prior -- samples a state consistent with observation o, used when the
+                 root has no particles
+        rollout_policy -- the policy that's used to evaluate leaves (a random
+                          one by default)
+        max_sims -- the number of simulations per decision
+        max_time -- the time limit per decision, in seconds
+        depth -- the planning horizon
+        c -- the exploration constant of UCB1
+        rng -- the generator that the search draws from
+        observation_key -- the key that observations are merged by in the
+                           tree (observation_key by default)
+    """
+
+    def __init__(
+        self,
+        model: POMDP,
+        actions: Callable[[Observation], List[Action]],
+        prior: Callable[[Observation, np.random.Generator], State],
+        rollout_policy: Policy = None,
+        max_sims: int = 1000,
+        max_time: float = None,
+        depth: int = 10,
+        c: float = 1.0,
+        rng: np.random.Generator = None,
+        observation_key: Callable[[Observation], Hashable] = observation_key
+    ):
+        assert max_sims is not None or max_time is not None, "need a budget"
+        self.model = model
+        self.actions = actions
+        self.prior = prior
+        self.rollout_policy = rollout_policy
+        self._default_rollout = rollout_policy is None
+        self.max_sims = max_sims
+        self.max_time = max_time
+        self.depth = depth
+        self.c = c
+        self.rng = get_rng(rng)
+        self.observation_key = observation_key
+
+        # the root of each history's tree and the length of the history it's for
+        self._trees: WeakKeyDictionary = WeakKeyDictionary()
+
+    @property
+    def rng(self) -> np.random.Generator:
+        return self._rng
+
+    @rng.setter
+    def rng(self, rng: np.random.Generator):
+        # the default rollout policy draws from the same generator
+        self._rng = rng
+        if self._default_rollout:
+            self.rollout_policy = UniformPolicy(self.actions, rng)
+
+    def action(self, h: List[Tuple[Observation, Action]]) -> Action:
+        root = self._root(h)
+        self.search(root)
+
+        # the best of the actions that were actually tried
+        a = max(root.Q, key=lambda a: (root.N[a] > 0, root.Q[a]))
+
+        if isinstance(h, HistoryView):
+            self._trees[h.history] = (len(h), root)
+
+        return a
+
+    def _root(self, h: List[Tuple[Observation, Action]]) -> Node:
+        """
+        Finds the root for history h in the stored trees, or makes a new one.
+        """
+        o = h[-1][0]
+        if isinstance(h, HistoryView) and h.history in self._trees:
+            n, prev = self._trees[h.history]
+            if n == len(h) - 1:
+                children = prev.children.get(h[-2][1], {})
+                node = children.get(self.observation_key(o))
+                if node is not None and node.particles:
+                    # the node may have been made for a different observation
+                    # in the same bin
+                    node.o = o
+                    return node
+
+        return Node(o)
+
+    def search(self, root: Node):
+        """
+        Runs simulations from root until the budget runs out.
+        """
+        start = perf_counter()
+        sims = 0
+        while True:
+            if root.particles:
+                s = root.particles[self.rng.integers(len(root.particles))]
+            else:
+                s = self.prior(root.o, self.rng)
+            self.simulate(s, root, self.depth)
+            sims += 1
+
+            if self.max_sims is not None and sims >= self.max_sims:
+                break
+            if self.max_time is not None and perf_counter() - start >= self.max_time:
+                break
+
+    def simulate(self, s: State, node: Node, d: int) -> float:
+        """
+        Runs one simulation from state s at node, d steps deep, and returns
+        its discounted return.
+        """
+        if d == 0:
+            return 0
+
+        # expand new nodes and evaluate them with a rollout
+        if not node.N:
+            for a in self.actions(node.o):
+                node.N[a] = 0
+                node.Q[a] = 0.0
+                node.children[a] = {}
+            node.particles.append(s)
+            node.n += 1
+            return self.model.rollout(s, node.o, self.rollout_policy, d, self.rng)
+
+        a = self._ucb1(node)
+        sp, o, r = self.model.generate(s, a, self.rng)
+        key = self.observation_key(o)
+        child = node.children[a].get(key)
+        if child is None:
+            child = node.children[a][key] = Node(o)
+        q = r + self.model.discount * self.simulate(sp, child, d - 1)
+
+        node.particles.append(s)
+        node.n += 1
+        node.N[a] += 1
+        node.Q[a] += (q - node.Q[a]) / node.N[a]
+        return q
+
+    def _ucb1(self, node: Node) -> Action:
+        best, best_value = None, -float('inf')
+        for a, n in node.N.items():
+            if n == 0:
+                return a
+            value = node.Q[a] + self.c * sqrt(log(node.n) / n)
+            if value > best_value:
+                best, best_value = a, value
+        return best
+
+
+# ------------------------------------------------------------------------------
+# action spaces and priors for the student and teacher
+# ------------------------------------------------------------------------------
+def student_actions(o: StudentObservation, step: int = 4) -> List[Action]:
+    """
+    Submitting (if there's anything to submit) and splitting the time between
+    resting and working in multiples of 1 / step.
+    """
+    out = [StudentAction(rest=i / step, work=(step - i) / step) for i in range(step + 1)]
+    if o.num_assignments > 0:
+        out.append(StudentAction(submit=True))
+    return out
+
+
+def teacher_actions(o: TeacherObservation, step: int = 4) -> List[Action]:
+    """
+    Every split of the time between resting, grading and pd in multiples of
+    1 / step.
+    """
+    return [
+        TeacherAction(i / step, j / step, (step - i - j) / step)
+        for i in range(step + 1)
+        for j in range(step + 1 - i)
+    ]
+
+
+def student_prior(o: StudentObservation, rng: np.random.Generator = None) -> StudentState:
+    """
+    Samples a student from the classroom's initial distribution, with the
+    observed free time and number of assignments.
+    """
+    rng = get_rng(rng)
+    return StudentState(
+        rng.uniform(-1, 1), rng.uniform(0, 1), rng.uniform(0, 1, 8).tolist(),
+        o.free_time, o.num_assignments, 0, []
+    )
+
+
+def teacher_prior(o: TeacherObservation, rng: np.random.Generator = None) -> TeacherState:
+    """
+    Samples a teacher from the classroom's initial distribution, with the
+    observed free time and number of assignments.
+    """
+    rng = get_rng(rng)
+    return TeacherState(
+        rng.uniform(-1, 1), rng.uniform(0, 1), rng.uniform(0, 1),
+        o.free_time, o.num_assignments
+    )
@@ -0,0 +1,47 @@
+import numpy as np
+from typing import List, Tuple
+from weakref import WeakKeyDictionary
+
+from env import Policy, HistoryView, AlphaVectorUtility, TeacherObservation, TeacherAction
+from plan.Tabular import TabularTeacher
+
+
+class AlphaVectorPolicy(Policy):
+    """
+    Acts greedily with respect to alpha vectors over the states of a compiled
+    model (e.g. from qmdp or pbvi): in belief b it takes the action of the
+    alpha vector with the highest alpha @ b.
+
+    The policy tracks the belief of each History it's given (through the
+    HistoryViews that simulate passes in) and updates it with the compiled
+    model every day. A plain list history restarts from the initial belief of
+    its latest observation.
+
+    params:
+        tab -- the compiled model
+        U -- the alpha vectors, over the states of tab
+    """
+
+    def __init__(self, tab: TabularTeacher, U: AlphaVectorUtility):
+        self.tab = tab
+        self.U = U
+
+        # the belief of each history and the length of the history it's for
+        self._beliefs: WeakKeyDictionary = WeakKeyDictionary()
+
+    def belief(self, h: List[Tuple[TeacherObservation, TeacherAction]]) -> np.ndarray:
+        o = h[-1][0]
+        if isinstance(h, HistoryView) and h.history in self._beliefs:
+            n, b = self._beliefs[h.history]
+            a = h[-2][1] if len(h) > 1 else None
+            if n == len(h) - 1 and a in self.tab.action_index:
+                return self.tab.update(b, a, o)
+
+        return self.tab.initial_belief(o)
+
+    def action(self, h: List[Tuple[TeacherObservation, TeacherAction]]) -> TeacherAction:
+        b = self.belief(h)
+        if isinstance(h, HistoryView):
+            self._beliefs[h.history] = (len(h), b)
+
+        return self.U.action(b)
@@ -1,4 +1,3 @@
-from random import random
 import numpy as np
 
 from env import (
@@ -8,46 +7,89 @@ from env import (
     StudentAction,
     TeacherAction,
     Observation,
-    Action
+    Action,
+    StudentActionBatch,
+    StudentObservationBatch,
+    TeacherActionBatch,
+    TeacherObservationBatch,
+    get_rng
 )
-from numeric import full_round
+from numeric import full_round_array
 
 
 class StudentPolicy(MemorylessPolicy):
-    def __init__(self, submit_thresh: float = 0.3):
+    def __init__(self, submit_thresh: float = 0.3, rng: np.random.Generator = None):
         self.submit_thresh = submit_thresh
+        self.rng = get_rng(rng)
 
     def action(self, o: StudentObservation):
-        if o.num_assignments > 0 and random() < self.submit_thresh:
-            return StudentAction(submit=True)
+        return _student_action(o, self.submit_thresh, self.rng)
 
-        rest = random()
-        work = 1 - rest
-        rest, work = full_round((rest, work), 1)
-        return StudentAction(rest=rest, work=work)
+    def batch_action(self, O: StudentObservationBatch, rng: np.random.Generator = None):
+        rng = self.rng if rng is None else rng
+
+        # the same two draws per student as action, in the same order
+        u = rng.random(O.shape + (2,))
+        submit = (O.num_assignments > 0) & (u[..., 0] < self.submit_thresh)
+
+        rest = u[..., 1]
+        rest_work = full_round_array(np.stack([rest, 1 - rest], axis=-1), 1)
+        return StudentActionBatch(
+            submit=submit,
+            rest=np.where(submit, np.nan, rest_work[..., 0]),
+            work=np.where(submit, np.nan, rest_work[..., 1]),
+        )
 
 
 class TeacherPolicy(MemorylessPolicy):
+    def __init__(self, rng: np.random.Generator = None):
+        self.rng = get_rng(rng)
+
     def action(self, o: TeacherObservation):
-        a = np.random.dirichlet((1, 1, 1))
-        a = full_round(a, 1)
-        return TeacherAction(*a)
+        return _teacher_action(self.rng)
+
+    def batch_action(self, O: TeacherObservationBatch, rng: np.random.Generator = None):
+        rng = self.rng if rng is None else rng
+        a = rng.dirichlet((1, 1, 1), O.shape)
+        a = full_round_array(a, 1)
+        return TeacherActionBatch(rest=a[..., 0], grading=a[..., 1], pd=a[..., 2])
 
 
-def rand_action(o: Observation, act_class: type(Action)):
+def rand_action(
+    o: Observation, act_class: type(Action), rng: np.random.Generator = None
+):
     """
     Returns a random action for the given observation.
     """
+    rng = get_rng(rng)
     if act_class is StudentAction:
-        if o.num_assignments > 0 and random() < 0.3:
-            return StudentAction(submit=True)
-
-        rest = random()
-        work = 1 - rest
-        rest, work = full_round((rest, work), 1)
-        return StudentAction(rest=rest, work=work)
+        return _student_action(o, 0.3, rng)
 
     elif act_class is TeacherAction:
-        a = np.random.dirichlet((1, 1, 1))
-        a = full_round(a, 1)
-        return TeacherAction(*a)
+        return _teacher_action(rng)
+
+
+def _student_action(
+    o: StudentObservation, submit_thresh: float, rng: np.random.Generator
+) -> StudentAction:
+    """
+    A random student action. It always draws whether to submit and then how
+    to split the time, and rounds like full_round_array, so that it makes
+    exactly the draws (and actions) of StudentPolicy.batch_action for one
+    student.
+    """
+    u_submit, u_rest = rng.random(2).tolist()
+    if o.num_assignments > 0 and u_submit < submit_thresh:
+        return StudentAction(submit=True)
+
+    rest, work = full_round_array([u_rest, 1 - u_rest], 1).tolist()
+    return StudentAction(rest=rest, work=work)
+
+
+def _teacher_action(rng: np.random.Generator) -> TeacherAction:
+    """
+    A random teacher action, rounded like TeacherPolicy.batch_action rounds
+    it.
+    """
+    a = full_round_array(rng.dirichlet((1, 1, 1)), 1)
+    return TeacherAction(*a.tolist())
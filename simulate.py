@@ -1,39 +1,91 @@
 import pandas as pd
+import numpy as np
+import random
+from contextlib import contextmanager
+from multiprocessing import Pool
 from tqdm import tqdm
+from typing import Callable, List, Tuple
 
-from env import Classroom, Policy
-from evaluate import Log
+from env import (
+    Classroom, ClassroomBatch, Policy, MemorylessPolicy, GeneratorBatch,
+    run_rng, seed_default_rng, ENV_STREAM, POLICY_STREAM
+)
+from evaluate import Log, BatchLog
+
+
+@contextmanager
+def _seed_policies(policies: List[Policy], rng: np.random.Generator):
+    """
+    Points the policies that draw from their own generator (the ones with an
+    rng attribute, like the baseline policies) at rng for the duration of the
+    block, and gives them back their own generators afterwards. Nothing
+    changes if rng is None.
+    """
+    seeded = [π for π in policies if rng is not None and hasattr(π, 'rng')]
+    saved = [π.rng for π in seeded]
+    try:
+        for π in seeded:
+            π.rng = rng
+        yield
+    finally:
+        # in reverse, in case the same policy was passed twice
+        for π, old in reversed(list(zip(seeded, saved))):
+            π.rng = old
 
 
 def simulate(
     n_students: float,
     d: int,
     sπ: Policy,
-    tπ: Policy
+    tπ: Policy,
+    seed: int = None,
+    run: int = 0
 ):
     """
     Starts the simulation with the given number of students and the given
     policies for the student and teacher.
 
+    If a seed is given, the classroom draws from the environment stream of
+    run `run` of that seed and the policies from its policy stream, so the
+    run is reproducible no matter where it's executed.
+
     params:
         n_students -- the number of students in the classroom
         d -- the number of time steps / days to simulate
         sπ -- the student policy
         tπ -- the teacher policy
+        seed -- the seed of the sweep that this run is a part of
+        run -- the index of this run in the sweep
+    """
+    c = Classroom(n_students, rng=run_rng(seed, run, ENV_STREAM))
+    π_rng = None if seed is None else run_rng(seed, run, POLICY_STREAM)
+    with _seed_policies([sπ, tπ], π_rng):
+        return _run(c, d, sπ, tπ)
+
+
+def _run(c: Classroom, d: int, sπ: Policy, tπ: Policy) -> Log:
+    """
+    Runs classroom c for d days with the given policies.
     """
-    c = Classroom(n_students)
     l = Log(c)
 
     # record initial state
     l.record(-1)
 
     for t in range(d):
-        # 1. student actions
-        student_as = [sπ[h] for h in c.student_h]
+        # 1. student actions (memoryless policies only need the latest
+        # observations, so they skip building the histories)
+        if isinstance(sπ, MemorylessPolicy):
+            student_as = [sπ.action(o) for o in c.student_latest_o]
+        else:
+            student_as = [sπ[h] for h in c.student_h]
         student_rs = c.student_step(student_as, t)
 
         # 2. teacher actions
-        teacher_a = tπ[c.teacher_h]
+        if isinstance(tπ, MemorylessPolicy):
+            teacher_a = tπ.action(c.teacher_latest_o)
+        else:
+            teacher_a = tπ[c.teacher_h]
         teacher_r = c.teacher_step(teacher_a, t)
 
         # 3. record results
@@ -48,23 +100,178 @@ def simulate(
     return l
 
 
+def simulate_batch(
+    n_classrooms: int,
+    n_students: int,
+    d: int,
+    sπ: MemorylessPolicy,
+    tπ: MemorylessPolicy,
+    seed: int = None,
+    first_run: int = 0
+):
+    """
+    Simulates n_classrooms independent classrooms in lockstep with a
+    ClassroomBatch. The policies must be memoryless, since they choose the
+    actions of every classroom at once from the latest observations (through
+    batch_action).
+
+    If a seed is given, classroom k is run first_run + k of that seed: it
+    draws from that run's environment and policy streams, so it comes out
+    bit-identical whether it's simulated alone (n_classrooms=1,
+    first_run=k), batched with any other runs, or run on its own with
+    simulate(..., seed=seed, run=first_run + k).
+
+    params:
+        n_classrooms -- the number of classrooms to simulate
+        n_students -- the number of students in each classroom
+        d -- the number of time steps / days to simulate
+        sπ -- the student policy
+        tπ -- the teacher policy
+        seed -- the seed of the sweep that these runs are a part of
+        first_run -- the index of the first classroom's run in the sweep
+    """
+    runs = range(first_run, first_run + n_classrooms)
+    c = ClassroomBatch(
+        n_classrooms, n_students,
+        rngs=[run_rng(seed, k, ENV_STREAM) for k in runs]
+    )
+    l = BatchLog(c)
+
+    # the policies of classroom k draw from the policy stream of its run
+    π_rng = None
+    if seed is not None:
+        π_rng = GeneratorBatch([run_rng(seed, k, POLICY_STREAM) for k in runs])
+
+    # record initial state
+    l.record(-1)
+
+    for t in range(d):
+        # 1. student actions
+        student_rs = c.student_step(
+            sπ.batch_action(c.student_o[-1], rng=π_rng), t
+        )
+
+        # 2. teacher actions
+        teacher_r = c.teacher_step(
+            tπ.batch_action(c.teacher_o[-1], rng=π_rng), t
+        )
+
+        # 3. record results
+        l.record(
+            t,
+            teacher_a=c.teacher_a[-1],
+            teacher_r=teacher_r,
+            student_a=c.student_a[-1],
+            student_r=student_rs
+        )
+
+    return l
+
+
+# ------------------------------------------------------------------------------
+# running many simulations in parallel
+# ------------------------------------------------------------------------------
+# the policies of the current worker process, loaded once by _init_worker
+_worker_policies: Tuple[Policy, Policy] = None
+
+
+def _init_worker(load_policies: Callable[[], Tuple[Policy, Policy]]):
+    global _worker_policies
+    _worker_policies = load_policies()
+
+
+def _run_one(args) -> object:
+    n_students, d, seed, run, collect = args
+
+    # forked workers inherit the same global random state, so it's reseeded
+    # for the policies that still draw from the global generators
+    global_seed = np.random.SeedSequence(seed, spawn_key=(run,)).generate_state(1)
+    random.seed(global_seed.item())
+    np.random.seed(global_seed)
+    seed_default_rng(global_seed)
+
+    sπ, tπ = _worker_policies
+    l = simulate(n_students, d, sπ, tπ, seed=seed, run=run)
+    return l if collect is None else collect(l)
+
+
+def simulate_many(
+    n_runs: int,
+    n_students: int,
+    d: int,
+    load_policies: Callable[[], Tuple[Policy, Policy]],
+    collect: Callable[[Log], object] = None,
+    processes: int = None,
+    seed: int = None
+) -> list:
+    """
+    Runs n_runs independent simulations across a pool of processes. The
+    policies are loaded once per worker by calling load_policies, so it's
+    fine for it to read torch models or pickled Q tables from disk.
+
+    load_policies and collect are sent to the workers, so they need to be
+    picklable (e.g. module-level functions or functools.partial objects).
+
+    params:
+        n_runs -- the number of simulations to run
+        n_students -- the number of students in each classroom
+        d -- the number of time steps / days to simulate
+        load_policies -- a function that returns the (student, teacher)
+                         policies
+        collect -- an optional function that each worker applies to its Log
+                   (e.g. Log.s_oaroa_memoryless) so that only the result is
+                   sent back instead of the whole Log
+        processes -- the number of worker processes, defaults to the number of
+                     CPUs
+        seed -- the seed of the sweep; run k is bit-identical to
+                simulate(..., seed=seed, run=k)
+
+    returns:
+        results -- the Log of each run (or what collect returned for it), in
+                   the order of the runs
+    """
+    if seed is None:
+        # every worker has to derive its run from the same seed
+        seed = np.random.SeedSequence().entropy
+    args = [(n_students, d, seed, k, collect) for k in range(n_runs)]
+
+    with Pool(processes, initializer=_init_worker, initargs=(load_policies,)) as pool:
+        return list(tqdm(pool.imap(_run_one, args), total=n_runs))
+
+
+def concat_runs(dfs: List[pd.DataFrame]) -> pd.DataFrame:
+    """
+    Merges the DataFrames of several runs into one, with a run column that
+    says which run each row came from.
+    """
+    return pd.concat(
+        [df.assign(run=i) for i, df in enumerate(dfs)], ignore_index=True
+    )
+
+
+def load_random_policies() -> Tuple[Policy, Policy]:
+    from policy.RandomPolicy import StudentPolicy, TeacherPolicy
+    return StudentPolicy(), TeacherPolicy()
+
+
 def main():
     from policy.RandomPolicy import StudentPolicy, TeacherPolicy
     sπ = StudentPolicy()
     tπ = TeacherPolicy()
 
-    s_dfs, t_dfs = [], []
-    for _ in tqdm(range(50)):
-        l_random = simulate(35, 30, sπ, tπ)
-
-        t_dfs.append(l_random.t_oaroa_memoryless())
-        s_dfs.append(l_random.s_oaroa_memoryless())
+    # 50 classrooms of 35 students for 30 days, in one vectorized run
+    l_random = simulate_batch(50, 35, 30, sπ, tπ)
+    t_df = l_random.t_oaroa_memoryless()
+    s_df = l_random.s_oaroa_memoryless()
 
-    # df = pd.concat(t_dfs)
-    # df.to_csv('data/50y-1m-rounded/teacher-random.csv', index=False)
+    # t_df.to_csv('data/50y-1m-rounded/teacher-random.csv', index=False)
+    # s_df.to_csv('data/50y-1m-rounded/student-random.csv', index=False)
 
-    # df = pd.concat(s_dfs)
-    # df.to_csv('data/50y-1m-rounded/student-random.csv', index=False)
+    # policies that need the full history (or that can't be batched) are run
+    # as separate simulations across a process pool instead
+    # s_df = concat_runs(simulate_many(
+    #     50, 35, 30, load_random_policies, collect=Log.s_oaroa_memoryless
+    # ))
 
 if __name__ == '__main__':
     main()
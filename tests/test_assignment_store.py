@@ -0,0 +1,62 @@
+import numpy as np
+import pytest
+
+from env import AssignmentStore
+
+
+def _store():
+    store = AssignmentStore(3)
+    store.issue(0.5)
+    store.issue(0.2)
+    g = np.full((3, 8), 0.5)
+    store.submit([2, 0], g[:2], [1.0, 2.0], t=0)
+    return store, g
+
+
+def test_queue_is_fifo():
+    store, g = _store()
+    store.submit([0, 1], g[:2], [0.0, 0.0], t=1)
+    assert store.n_ungraded == 4
+    np.testing.assert_array_equal(store.n_pending, [0, 1, 1])
+
+    # student 2's first copy, student 0's first and second copies, student 1's first
+    np.testing.assert_array_equal(store.pop_ungraded(3, t=2), [2, 0, 3])
+    np.testing.assert_array_equal(store.pop_ungraded(5, t=4), [1])
+    assert store.mean_grading_gap() == pytest.approx((2 + 2 + 1 + 3) / 4)
+
+    with pytest.raises(ValueError):
+        store.submit([0], g[:1], [0.0], t=5)
+
+
+def test_fork_is_copy_on_write():
+    store, g = _store()
+    quality = store.quality.copy()
+    fork = store.fork()
+
+    fork.submit([1], g[:1], [3.0], t=1)
+    fork.pop_ungraded(2, t=1)
+    assert store.n_ungraded == 2 and store.n_graded == 0
+    np.testing.assert_array_equal(store.quality, quality)
+    assert np.isnan(store.time_graded).all()
+
+    store.issue(0.9)
+    assert len(store) == 9 and len(fork) == 6
+    np.testing.assert_array_equal(fork.n_pending, [1, 1, 1])
+
+
+def test_batched_store_matches_single_ones():
+    stores = [AssignmentStore(2) for _ in range(2)]
+    batch = AssignmentStore(2, n_classrooms=2)
+    g = np.full((2, 8), 0.25)
+    for s, d in zip(stores, [0.1, 0.6]):
+        s.issue(d)
+    batch.issue([0.1, 0.6])
+
+    stores[0].submit([1, 0], g, [1.0, 0.0], t=0)
+    stores[1].submit([0], g[:1], [2.0], t=0)
+    batch.submit([1, 0, 0], np.full((3, 8), 0.25), [1.0, 2.0, 0.0], t=0, classroom_idx=[0, 1, 0])
+
+    k, rows = batch.pop_ungraded(np.array([2, 1]), t=1)
+    for i, s in enumerate(stores):
+        np.testing.assert_array_equal(rows[k == i], s.pop_ungraded(2, t=1))
+        np.testing.assert_array_equal(batch.quality[i], s.quality)
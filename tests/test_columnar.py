@@ -0,0 +1,34 @@
+import numpy as np
+import pandas as pd
+
+from plan.Columnar import ColumnarTransitions, write_columns
+from plan.QLearning import EncodedTransitions
+
+
+CSV = """o_assignment_grade,o_free_time,a_submit,a_work,r,op_assignment_grade,op_free_time,ap_submit,ap_work,day
+,4,False,0.3,0.25,,5,True,,0
+,5,True,,-1.5,71.25,5,False,0.7,1
+71.25,5,False,0.7,0.5,,2,False,0.3,2
+,2,False,0.3,0.125,,4,True,,3
+,4,True,,0.0,12.5,4,False,0.0,4
+"""
+
+
+def test_columns_encode_like_the_csv(tmp_path):
+    csv = tmp_path / "t.csv"
+    csv.write_text(CSV)
+    data = write_columns(str(csv), str(tmp_path / "t"), chunksize=2)
+
+    reopened = ColumnarTransitions(str(tmp_path / "t"))
+    assert ColumnarTransitions.is_columnar(str(tmp_path / "t"))
+    assert len(reopened) == 5 and reopened.columns == list(pd.read_csv(csv).columns)
+    np.testing.assert_array_equal(reopened["a_submit"], [0, 1, 0, 0, 1])
+
+    expected = EncodedTransitions(pd.read_csv(csv))
+    for d in (data, reopened):
+        encoded = EncodedTransitions(d)
+        assert encoded.table.obs == expected.table.obs
+        assert encoded.table.actions == expected.table.actions
+        np.testing.assert_array_equal(encoded.sa, expected.sa)
+        np.testing.assert_array_equal(encoded.spa, expected.spa)
+        np.testing.assert_array_equal(encoded.r, expected.r)
@@ -0,0 +1,28 @@
+from env import History
+
+
+def test_fork_is_copy_on_write():
+    h = History("o0")
+    h.append("a0", "o1")
+    f = h.fork()
+
+    # both sides extend independently
+    h.append("a1", "o2")
+    f.append("b1", "p2")
+    f.append("b2", "p3")
+    assert list(h.o) == ["o0", "o1", "o2"] and list(h.a) == ["a0", "a1"]
+    assert list(f.o) == ["o0", "o1", "p2", "p3"] and list(f.a) == ["a0", "b1", "b2"]
+
+    # replacing a shared observation only changes the side that replaces it
+    g = f.fork()
+    g.replace_latest("q3")
+    assert f.latest == "p3" and g.latest == "q3"
+    assert list(g.o) == ["o0", "o1", "p2", "q3"]
+
+
+def test_view_is_a_snapshot():
+    h = History("o0")
+    h.append("a0", "o1")
+    v = h.view()
+    h.append("a1", "o2")
+    assert list(v) == [("o0", "a0"), ("o1", None)]
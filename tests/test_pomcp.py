@@ -0,0 +1,58 @@
+import numpy as np
+
+from env import History, StudentAction, StudentObservation
+from env.Student import Student
+from policy.POMCP import (
+    POMCPPolicy, observation_key, student_actions, student_prior
+)
+
+
+def _planner(max_sims=300):
+    return POMCPPolicy(
+        Student(), student_actions, student_prior, max_sims=max_sims, depth=4,
+        rng=np.random.default_rng(0)
+    )
+
+
+def test_grades_share_children():
+    """
+    The simulated grades after a submit are continuous, but they're merged
+    into one child per grade bin (and free time) instead of one per grade.
+    """
+    π = _planner(1000)
+    h = History(StudentObservation(None, 3, 2))
+    π[h.view()]
+
+    root = π._trees[h][1]
+    submit = StudentAction(submit=True)
+    children = root.children[submit]
+    assert len(children) < root.N[submit] / 2
+    assert sum(c.n for c in children.values()) > len(children)
+
+
+def test_root_is_reused_after_a_submit():
+    """
+    After submitting, an observed grade that was never simulated exactly
+    still picks up the subtree of the simulated grades in its bin.
+    """
+    π = _planner()
+    h = History(StudentObservation(None, 3, 2))
+    π[h.view()]
+
+    # the most visited grade bin after submitting, and a grade in it that
+    # the search didn't produce
+    submit = StudentAction(submit=True)
+    child = max(π._trees[h][1].children[submit].values(), key=lambda c: c.n)
+    key = observation_key(child.o)
+    grade = key[0] * 10.0 + (0.25 if key[0] < 10 else -0.25)
+    o = StudentObservation(grade, child.o.free_time, child.o.num_assignments)
+    assert observation_key(o) == key and o != child.o
+
+    h.append(submit, o)
+    n = child.n
+    π[h.view()]
+
+    root = π._trees[h][1]
+    assert root is child
+    assert root.o is o
+    assert root.n > n
@@ -0,0 +1,51 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from plan.QLearning import conflict_free_segments, sarsa, sarsa_update
+
+
+def _row_by_row(q, sa, spa, r, lr, gamma, weights):
+    td = np.empty(len(sa))
+    for j in range(len(sa)):
+        td[j] = r[j] + gamma * q[spa[j]] - q[sa[j]]
+        q[sa[j]] += lr * weights[j] * td[j]
+    return td
+
+
+@pytest.mark.parametrize("seed", range(5))
+@pytest.mark.parametrize("n_pairs", [3, 50])
+def test_sarsa_update_matches_row_by_row(seed, n_pairs):
+    rng = np.random.default_rng(seed)
+    n = 200
+    sa, spa = rng.integers(n_pairs, size=(2, n))
+    r, weights = rng.normal(size=n), rng.uniform(size=n)
+    q = rng.normal(size=n_pairs)
+
+    expected = q.copy()
+    expected_td = _row_by_row(expected, sa, spa, r, 0.1, 0.9, weights)
+    td = sarsa_update(q, sa, spa, r, 0.1, 0.9, weights)
+    np.testing.assert_allclose(q, expected, rtol=0, atol=1e-12)
+    np.testing.assert_allclose(td, expected_td, rtol=0, atol=1e-12)
+
+
+def test_segments_are_conflict_free():
+    rng = np.random.default_rng(0)
+    write, read = rng.integers(20, size=(2, 100))
+    bounds = conflict_free_segments(write, read)
+    assert bounds[0][0] == 0 and bounds[-1][1] == 100
+    for (i, j), (k, _) in zip(bounds, bounds[1:]):
+        assert j == k
+    for i, j in bounds:
+        for m in range(i + 1, j):
+            assert write[m] not in write[i:m] and read[m] not in write[i:m]
+
+
+def test_sarsa_fills_a_dict():
+    df = pd.DataFrame({
+        "o_x": [0, 1, 0, 1], "a_y": [0, 0, 1, 1], "r": [1.0, 0.0, 2.0, 0.5],
+        "op_x": [1, 0, 1, 0], "ap_y": [0, 1, 1, 0],
+    })
+    Q = {}
+    out = sarsa(df, m=20, d=2, Q=Q, rng=np.random.default_rng(0))
+    assert out is Q and len(Q) == 4
@@ -0,0 +1,50 @@
+import pickle
+
+import numpy as np
+import pytest
+
+from plan.QTable import QTable
+
+
+Q = {
+    ((0.0, 1.0), (1.0,)): 0.5,
+    ((0.0, 1.0), (0.0,)): -1.25,
+    ((1e9, 2.0), (1.0,)): 3.0,
+    ((2.0, 2.0), (0.0,)): 0.0,
+}
+
+
+def _table():
+    return QTable.from_dict(Q, obs_ordering=["grade", "free_time"], act_ordering=["submit"])
+
+
+def test_behaves_like_the_dict():
+    table = _table()
+    assert table.to_dict() == Q
+    assert table[(2.0, 2.0), (1.0,)] == 0.0 and ((2.0, 2.0), (1.0,)) not in table
+
+    table[(2.0, 2.0), (1.0,)] = 4.0
+    assert len(table) == 5
+    best = table.argmax(table.intern_obs([(0.0, 1.0), (2.0, 2.0), (1e9, 2.0)]))
+    assert [table.actions[j] for j in best] == [(1.0,)] * 3
+
+
+def test_npz_round_trip(tmp_path):
+    table = _table()
+    table.save(str(tmp_path / "q.npz"))
+    out = QTable.load(str(tmp_path / "q.npz"))
+    assert out.to_dict() == Q
+    assert out.obs_ordering == ["grade", "free_time"] and out.act_ordering == ["submit"]
+
+
+@pytest.mark.parametrize("orderings", [True, False])
+def test_pickle_is_converted(tmp_path, orderings):
+    data = {"Q": Q}
+    if orderings:
+        data.update(obs_ordering=["grade", "free_time"], act_ordering=["submit"])
+    with open(tmp_path / "q.pkl", "wb") as f:
+        pickle.dump(data, f)
+
+    out = QTable.load(str(tmp_path / "q.pkl"))
+    assert out.to_dict() == Q
+    assert out.obs_ordering == (["grade", "free_time"] if orderings else None)
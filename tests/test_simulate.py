@@ -0,0 +1,61 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from simulate import simulate, simulate_batch
+from policy.RandomPolicy import StudentPolicy, TeacherPolicy
+
+
+def _as_float(df: pd.DataFrame) -> pd.DataFrame:
+    # Log stores missing grades and time splits as None, BatchLog as nan
+    return df.astype(float).reset_index(drop=True)
+
+
+@pytest.mark.parametrize("seed", [0, 7])
+def test_simulate_matches_batch(seed):
+    """
+    Run k of a seed is bit-identical whether it's simulated with the
+    object-based Classroom or as classroom k of a ClassroomBatch.
+    """
+    K, n, d = 3, 6, 20
+    batch = simulate_batch(K, n, d, StudentPolicy(), TeacherPolicy(), seed=seed)
+    s_batch = batch.s_oaroa_memoryless()
+    t_batch = batch.t_oaroa_memoryless()
+
+    for k in range(K):
+        l = simulate(n, d, StudentPolicy(), TeacherPolicy(), seed=seed, run=k)
+        s, t = l.s_oaroa_memoryless(), l.t_oaroa_memoryless()
+
+        pd.testing.assert_frame_equal(
+            _as_float(s),
+            _as_float(s_batch.iloc[k * len(s):(k + 1) * len(s)][s.columns]),
+            check_exact=True
+        )
+        pd.testing.assert_frame_equal(
+            _as_float(t),
+            _as_float(t_batch.iloc[k * len(t):(k + 1) * len(t)][t.columns]),
+            check_exact=True
+        )
+
+
+def test_batch_is_independent_of_the_other_runs():
+    """
+    A classroom comes out the same whether it's batched with other runs or
+    simulated alone.
+    """
+    batch = simulate_batch(3, 5, 15, StudentPolicy(), TeacherPolicy(), seed=3)
+    alone = simulate_batch(
+        1, 5, 15, StudentPolicy(), TeacherPolicy(), seed=3, first_run=2
+    )
+
+    s = alone.s_oaroa_memoryless()
+    pd.testing.assert_frame_equal(
+        s, batch.s_oaroa_memoryless().iloc[2 * len(s):].reset_index(drop=True)
+    )
+
+
+def test_seeded_simulate_keeps_the_policies_generators():
+    rng = np.random.default_rng(3)
+    sπ, tπ = StudentPolicy(rng=rng), TeacherPolicy(rng=rng)
+    simulate(4, 5, sπ, tπ, seed=1)
+    assert sπ.rng is rng and tπ.rng is rng
@@ -0,0 +1,34 @@
+import numpy as np
+
+from env import Classroom, VectorClassroom, StudentStateBatch
+from policy.RandomPolicy import StudentPolicy, TeacherPolicy
+
+
+def test_vector_classroom_matches_classroom():
+    """
+    Given the same generator and the same actions, the struct-of-arrays
+    engine steps the classroom exactly like the object-based one.
+    """
+    n, d = 8, 30
+    c = Classroom(n, rng=np.random.default_rng(5))
+    v = VectorClassroom(n, rng=np.random.default_rng(5))
+    sπ = StudentPolicy(rng=np.random.default_rng(6))
+    tπ = TeacherPolicy(rng=np.random.default_rng(7))
+
+    for t in range(d):
+        student_as = [sπ.action(o) for o in c.student_latest_o]
+        assert c.student_step(student_as, t) == v.student_step(student_as, t).tolist()
+
+        teacher_a = tπ.action(c.teacher_latest_o)
+        assert c.teacher_step(teacher_a, t) == v.teacher_step(teacher_a, t)
+
+        S = StudentStateBatch.from_items(c.student_s)
+        np.testing.assert_array_equal(S.mh, v.student_s.mh)
+        np.testing.assert_array_equal(S.g, v.student_s.g)
+        np.testing.assert_array_equal(S.num_assignments, v.student_s.num_assignments)
+        np.testing.assert_array_equal(
+            [o.assignment_grade if o.assignment_grade is not None else np.nan
+             for o in c.student_latest_o],
+            v.student_o[-1].assignment_grade
+        )
+        assert c.teacher_s.mh == v.teacher_s.mh